@@ -1,140 +1,335 @@
-from flask import Flask, jsonify, request, send_file, send_from_directory, session
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, session
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
 from feishu_api import FeishuAPI
+from async_feishu_api import AsyncFeishuAPI
+from mirror import TableMirror
+from daily_reset import DailyResetScheduler
+from user_state import UserCompletionStore
+from write_journal import WriteJournal
+from static_assets import built_index, send_asset
+from history import parse_range
 from config import Config
+from log_setup import setup_logging
+from serializers import FastJSONProvider, compact_all_data, compact_changes, compact_records, compact_reward, compact_task
+from compression import compress_response
 from datetime import datetime
+import hashlib
+import logging
 import os
 
-app = Flask(__name__, static_url_path='', static_folder='.')
-app.secret_key = os.urandom(24)  # 设置session密钥
-CORS(app)
+logger = logging.getLogger(__name__)
 
-# 初始化飞书API
-feishu_api = FeishuAPI()
+bp = Blueprint('main', __name__)
 
-# 在应用启动时进行配置验证
-print('开始应用初始化...')
-Config.validate_config()
-print('应用初始化完成')
+# 路由中使用的共享对象，由 create_app 创建并保存在 app.extensions 中
+feishu_api = LocalProxy(lambda: current_app.extensions['feishu_api'])
+async_api = LocalProxy(lambda: current_app.extensions['async_api'])
+reset_scheduler = LocalProxy(lambda: current_app.extensions['reset_scheduler'])
 
-# 创建一个文件来存储上次重置日期，避免依赖session
-RESET_DATE_FILE = 'last_reset_date.txt'
 
-def get_last_reset_date():
-    """从文件中获取上次重置日期"""
-    try:
-        if os.path.exists(RESET_DATE_FILE):
-            with open(RESET_DATE_FILE, 'r') as f:
-                return f.read().strip()
-        return None
-    except Exception as e:
-        print(f'读取上次重置日期失败: {str(e)}')
+def create_app():
+    """创建应用并启动后台任务
+
+    多进程部署（gunicorn/uwsgi）时每个工作进程各调用一次，需在 fork 之后创建，
+    后台线程才能在工作进程中运行。进程之间通过 SHARED_STATE_DIR 下的文件共享访问令牌、
+    缓存版本号和各类文件锁，session 依赖配置中固定的 SECRET_KEY。
+    """
+    # 日志由后台线程写出，请求线程只负责入队
+    setup_logging()
+    logger.info('开始应用初始化')
+    Config.validate_config()
+
+    # 静态文件由 index / serve_asset / serve_static 从静态资源目录发送，不暴露项目根目录
+    app = Flask(__name__, static_folder=None)
+    app.json = FastJSONProvider(app)
+    if Config.SECRET_KEY:
+        app.secret_key = Config.SECRET_KEY
+    else:
+        logger.warning('未配置 SECRET_KEY，使用随机密钥；多个工作进程之间的 session 将无法共用')
+        app.secret_key = os.urandom(24)
+    # 跨域请求时允许页面读取条件请求、增量查询和数据新鲜度用到的响应头
+    CORS(app, expose_headers=['ETag', 'X-Data-Version', 'X-Data-Stale', 'X-Data-Age'])
+
+    # 初始化飞书API，并在后台主动刷新访问令牌
+    api = FeishuAPI()
+    api.token_manager.start()
+    app.extensions['feishu_api'] = api
+    # 异步路由使用的客户端，与 feishu_api 共享连接池、缓存和令牌
+    app.extensions['async_api'] = AsyncFeishuAPI(api)
+
+    # 可选：启用本地镜像，读接口优先由镜像提供
+    app.extensions['mirror'] = None
+    if Config.MIRROR_ENABLED:
+        mirror = TableMirror.from_config(api)
+        api.attach_mirror(mirror)
+        mirror.start()
+        app.extensions['mirror'] = mirror
+
+    # 每天定时重置任务状态（多个进程同时启用时通过文件锁保证只重置一次）
+    scheduler = DailyResetScheduler.from_config(api)
+    if Config.RESET_SCHEDULER_ENABLED:
+        scheduler.start()
+    app.extensions['reset_scheduler'] = scheduler
+
+    # 可选：多用户模式，完成状态按用户和任务日保存，任务日与每日重置使用相同的时间
+    if Config.MULTI_USER_ENABLED:
+        api.attach_user_state(UserCompletionStore.from_config(scheduler.business_date))
+
+    # 可选：打卡先写入本地日志，由后台线程回放到飞书
+    if Config.JOURNAL_ENABLED:
+        api.attach_journal(WriteJournal.from_config(api, scheduler.business_date).start())
+
+    app.register_blueprint(bp)
+    logger.info('应用初始化完成')
+    return app
+
+def conditional_json(data, version=None, freshness=None):
+    """返回带 ETag 的JSON响应；请求的 If-None-Match 与内容一致时返回 304，不再发送响应体
+
+    ETag 是响应内容的哈希，多个工作进程对相同数据计算出的 ETag 一致。
+    version 为变更通知的数据版本号，客户端下次可以通过 ?since= 只获取之后的变化。
+    freshness 为 data_freshness 的结果：响应头 X-Data-Stale / X-Data-Age 标明数据是否为旧快照和快照的年龄，
+    旧快照的响应体中另有 stale 字段（获取时间、来源、上游错误）；年龄只放在响应头中，ETag 不会每秒变化。
+    """
+    body = {'code': 0, 'data': data}
+    if freshness and freshness['stale']:
+        body['stale'] = {
+            'fetched_at': datetime.fromtimestamp(freshness['fetched_at']).astimezone().isoformat(timespec='seconds'),
+            'source': freshness['source'],
+            'error': freshness['error']
+        }
+    response = current_app.response_class(current_app.json.dumps(body), mimetype='application/json')
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    if version:
+        response.headers['X-Data-Version'] = version
+    if freshness:
+        response.headers['X-Data-Stale'] = 'true' if freshness['stale'] else 'false'
+        response.headers['X-Data-Age'] = str(int(freshness['age']))
+    return response.make_conditional(request)
+
+def data_freshness(*table_ids):
+    """合并响应中各数据表的新鲜度（见 TableCache.freshness），以最旧的一份为准"""
+    states = [state for state in map(feishu_api.cache.freshness, table_ids) if state]
+    if not states:
         return None
+    oldest = min(states, key=lambda state: state['fetched_at'])
+    return {
+        'stale': any(state['stale'] for state in states),
+        'age': oldest['age'],
+        'fetched_at': oldest['fetched_at'],
+        'source': 'snapshot' if any(state['source'] == 'snapshot' for state in states) else 'upstream',
+        'error': next((state['error'] for state in states if state['error']), None)
+    }
 
-def save_reset_date(date_str):
-    """保存重置日期到文件"""
+async def read_star_account(user_id):
+    """读接口附带的星星账户；新用户开户需要最新的任务数据，上游不可用时不返回账户，页面显示进度中的星星数"""
     try:
-        with open(RESET_DATE_FILE, 'w') as f:
-            f.write(date_str)
-        print(f'已保存重置日期: {date_str}')
+        return await async_api.star_account(user_id, reset_scheduler.business_date())
     except Exception as e:
-        print(f'保存重置日期失败: {str(e)}')
+        logger.warning('获取用户 %s 的星星账户失败: %s', user_id, e)
+        return None
+
+def current_user_id():
+    """当前用户ID：请求头 X-User-ID，EventSource 无法设置请求头时使用 ?user_id="""
+    return request.headers.get('X-User-ID') or request.args.get('user_id') or 'default_user'
+
+def changes_since():
+    """解析 ?since=<版本号>，可以增量返回时返回 (当前版本号, 各类数据的记录变更)，否则返回 None
+
+    变更通知只覆盖本进程的写入，多进程共享缓存时总是返回完整数据。
+    """
+    since = request.args.get('since')
+    if not since or feishu_api.cache.shared is not None:
+        return None
+    return feishu_api.changes.changes_since(since, current_user_id())
+
+def compact_enabled():
+    """默认返回紧凑格式，?format=raw 时返回飞书原始记录"""
+    return request.args.get('format') != 'raw'
 
-@app.route('/')
+def delta_for(changes, kind):
+    delta = changes.get(kind, EMPTY_DELTA)
+    return compact_changes(kind, delta) if compact_enabled() else delta
+
+EMPTY_DELTA = {'records': [], 'removed': []}
+
+@bp.before_app_request
+def start_trace():
+    # 之后该请求发出的飞书调用都会记录到 g.trace 中
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace, g.trace_token = feishu_api.tracer.start_request(request.method, route)
+
+@bp.after_app_request
+def finish_trace(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        summary = feishu_api.tracer.end_request(trace, g.pop('trace_token'), response.status_code)
+        response.headers['X-Upstream-Calls'] = str(summary['upstream_calls'])
+        response.headers['Server-Timing'] = (
+            f'app;dur={summary["duration"] * 1000:.1f}, '
+            f'upstream;dur={summary["upstream_duration"] * 1000:.1f};desc="{summary["upstream_calls"]} calls"'
+        )
+    return response
+
+@bp.after_app_request
+def compress(response):
+    return compress_response(response, request.accept_encodings,
+                             min_size=Config.COMPRESS_MIN_SIZE, level=Config.COMPRESS_LEVEL)
+
+@bp.route('/')
 def index():
-    # 检查是否需要重置任务状态（每天首次访问时）
-    today = datetime.now().strftime('%Y-%m-%d')
-    last_reset_date = get_last_reset_date()
-    
-    if last_reset_date != today:
-        print(f'检测到新的一天，上次重置日期: {last_reset_date}, 当前日期: {today}')
-        try:
-            reset_count = feishu_api.reset_tasks_status()
-            print(f'已重置 {reset_count} 个任务的状态')
-            # 更新最后重置日期
-            save_reset_date(today)
-        except Exception as e:
-            print(f'重置任务状态失败: {str(e)}')
-    
-    return send_file('index.html')
-
-@app.route('/<path:filename>')
+    # 每日重置由后台调度器完成，首页直接返回静态页面；构建过静态资源时返回引用带哈希文件的页面
+    directory = built_index(Config.ASSET_BUILD_DIR) or Config.STATIC_DIR
+    return send_asset(directory, 'index.html', request.accept_encodings)
+
+@bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """构建后带哈希的静态资源，内容不会变化，长期缓存"""
+    return send_asset(Config.ASSET_BUILD_DIR, filename, request.accept_encodings, max_age=Config.ASSET_MAX_AGE)
+
+@bp.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('.', filename)
+    """未构建时页面直接引用的源文件，每次向服务器验证"""
+    return send_asset(Config.STATIC_DIR, filename, request.accept_encodings)
 
-@app.route('/api/tasks', methods=['GET'])
-def get_tasks():
+@bp.route('/api/tasks', methods=['GET'])
+async def get_tasks():
     """获取任务列表"""
-    print('收到获取任务列表请求')
+    logger.debug('收到获取任务列表请求')
     try:
-        tasks = feishu_api.get_tasks()
-        print(f'成功获取任务列表，返回{len(tasks)}个任务')
-        return jsonify({
-            'code': 0,
-            'data': tasks
-        })
+        delta = changes_since()
+        if delta:
+            version, changes = delta
+            return conditional_json({'delta': True, **delta_for(changes, 'tasks')}, version)
+        # 先取版本号再读数据，读取期间发生的变更会包含在下一次增量中
+        version = feishu_api.changes.version()
+        tasks = feishu_api.tasks_for_user(current_user_id(), await async_api.get_tasks(allow_stale=True))
+        logger.debug('成功获取任务列表，返回%d个任务', len(tasks))
+        return conditional_json(compact_records('tasks', tasks) if compact_enabled() else tasks, version,
+                                data_freshness(feishu_api.table_id))
     except Exception as e:
         error_msg = str(e)
-        print(f'获取任务列表失败: {error_msg}')
+        logger.error('获取任务列表失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
-@app.route('/api/all-data', methods=['GET'])
-def get_all_data():
+@bp.route('/api/all-data', methods=['GET'])
+async def get_all_data():
     """获取所有数据（任务、进度、奖励）"""
-    print('收到获取所有数据请求')
+    logger.debug('收到获取所有数据请求')
     try:
-        all_data = feishu_api.get_all_data()
-        print('成功获取所有数据')
-        return jsonify({
-            'code': 0,
-            'data': all_data
-        })
+        user_id = current_user_id()
+        delta = changes_since()
+        if delta:
+            version, changes = delta
+            data = {
+                'delta': True,
+                'tasks': delta_for(changes, 'tasks'),
+                'rewards': delta_for(changes, 'rewards')
+            }
+            freshness = None
+            if 'tasks' in changes:
+                # 任务有变化时附带最新的进度汇总
+                data['progress'] = await async_api.user_progress(user_id, allow_stale=True)
+                freshness = data_freshness(feishu_api.table_id)
+            data['stars'] = await read_star_account(user_id)
+            return conditional_json(data, version, freshness)
+        version = feishu_api.changes.version()
+        all_data = await async_api.get_all_data(user_id, allow_stale=True)
+        logger.debug('成功获取所有数据')
+        data = compact_all_data(all_data) if compact_enabled() else all_data
+        # 当前用户的星星余额（服务器端账本）
+        data['stars'] = await read_star_account(user_id)
+        return conditional_json(data, version, data_freshness(feishu_api.table_id, Config.REWARD_TABLE_ID))
     except Exception as e:
         error_msg = str(e)
-        print(f'获取所有数据失败: {error_msg}')
+        logger.error('获取所有数据失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
-@app.route('/api/tasks/<record_id>', methods=['PUT'])
-def update_task(record_id):
+@bp.route('/api/tasks/<record_id>', methods=['PUT'])
+async def update_task(record_id):
     """更新任务状态"""
-    print(f'收到更新任务请求，任务ID: {record_id}')
+    logger.debug('收到更新任务请求，任务ID: %s', record_id)
     try:
         # 只获取并传递任务状态字段
         is_completed = request.json.get('fields', {}).get('已完成', False)
         fields = {'任务完成状态': '是' if is_completed else '否'}
-        print(f'更新字段: {fields}')
-        updated_task = feishu_api.update_task(record_id, fields, is_progress=False)
-        print('任务更新成功')
+        logger.debug('更新字段: %s', fields)
+        if feishu_api.user_state is not None:
+            # 多用户模式下只修改当前用户的完成状态
+            await async_api.set_user_completed(current_user_id(), [record_id], bool(is_completed))
+            updated_task = {'record_id': record_id, 'fields': fields}
+        else:
+            updated_task = await async_api.update_task(record_id, fields, is_progress=False)
+        logger.debug('任务更新成功')
+        return jsonify({
+            'code': 0,
+            # 飞书返回的记录可能只包含更新的字段
+            'data': compact_task(updated_task, partial=True) if updated_task and compact_enabled() else updated_task
+        })
+    except Exception as e:
+        error_msg = str(e)
+        logger.error('更新任务失败: %s', error_msg)
+        return jsonify({
+            'code': 1,
+            'message': error_msg
+        }), 500
+
+@bp.route('/api/user/progress', methods=['GET'])
+async def get_user_progress():
+    """获取用户进度"""
+    logger.debug('收到获取用户进度请求')
+    try:
+        progress_data = await async_api.user_progress(current_user_id(), allow_stale=True)
+        return conditional_json(progress_data, freshness=data_freshness(feishu_api.table_id))
+    except Exception as e:
+        error_msg = str(e)
+        logger.error('获取用户进度失败: %s', error_msg)
+        return jsonify({
+            'code': 1,
+            'message': error_msg
+        }), 500
+
+@bp.route('/api/user/progress/rebuild', methods=['POST'])
+async def rebuild_user_progress():
+    """由飞书中的最新任务数据重建进度汇总"""
+    logger.debug('收到重建进度请求')
+    try:
+        progress_data = await async_api.rebuild_progress()
+        logger.info('已重建进度汇总: %s', progress_data)
         return jsonify({
             'code': 0,
-            'data': updated_task
+            'data': {
+                'progress': progress_data,
+                'stats': feishu_api.progress.stats()
+            }
         })
     except Exception as e:
         error_msg = str(e)
-        print(f'更新任务失败: {error_msg}')
+        logger.error('重建进度失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
-@app.route('/api/user/progress', methods=['GET'])
-@app.route('/api/user/checkin', methods=['POST'])
-def user_checkin():
+@bp.route('/api/user/checkin', methods=['POST'])
+async def user_checkin():
     """用户打卡功能 - 支持部分任务打卡和多次打卡"""
-    print('收到用户打卡请求')
+    logger.debug('收到用户打卡请求')
     try:
         # 获取任务列表
-        tasks = feishu_api.get_tasks()
+        tasks = await async_api.get_tasks()
         
         # 获取用户选择的任务ID列表
         selected_task_ids = request.json.get('task_ids', [])
-        print(f'用户选择的任务ID: {selected_task_ids}')
+        logger.debug('用户选择的任务ID: %s', selected_task_ids)
         
         # 如果没有选择任何任务，返回错误
         if not selected_task_ids:
@@ -146,88 +341,148 @@ def user_checkin():
         # 筛选出用户选择的任务
         selected_tasks = [task for task in tasks if task['record_id'] in selected_task_ids]
         
-        # 更新选中任务的完成状态
-        for task in selected_tasks:
-            task_id = task['record_id']
-            # 将任务标记为已完成
-            fields = {'任务完成状态': '是'}
-            feishu_api.update_task(task_id, fields, is_progress=False)
-            print(f'已将任务 {task_id} 标记为已完成')
-        
-        # 重新获取任务列表以获取最新状态
-        updated_tasks = feishu_api.get_tasks()
+        user_id = current_user_id()
+        business_date = reset_scheduler.business_date()
+        # 首次使用账本时以打卡前的星星数开户，本次打卡的星星再单独计入
+        await async_api.star_account(user_id, business_date)
         
-        # 获取当前用户进度
-        completed_tasks = [task for task in updated_tasks if task['fields'].get('已完成', False) or task['fields'].get('任务完成状态') == '是']
-        total_tasks = len(updated_tasks)
-        completed_count = len(completed_tasks)
+        if feishu_api.journal is not None:
+            # 写入本地日志后立即返回，任务状态和进度记录由后台线程回放到飞书
+            selected_tasks, progress_data = await async_api.checkin_deferred(
+                user_id, [task['record_id'] for task in selected_tasks])
+        else:
+            # 批量更新选中任务的完成状态（多用户模式下只记录当前用户的完成状态）
+            updates = [{'record_id': task['record_id'], 'fields': {'任务完成状态': '是'}} for task in selected_tasks]
+            if feishu_api.user_state is not None:
+                changed = await async_api.set_user_completed(user_id, [task['record_id'] for task in selected_tasks])
+                logger.info('用户 %s 新完成 %d 个任务', user_id, len(changed))
+            elif updates:
+                result = await async_api.batch_update_records(feishu_api.table_id, updates)
+                if result['errors']:
+                    raise Exception(f'{len(result["errors"])} 个任务更新失败: {result["errors"][0]["error"]}')
+                logger.info('已将 %d 个任务标记为已完成', len(updates))
+            
+            # 重新获取任务列表以获取最新状态（写入后缓存已同步更新，不会再次请求飞书）
+            updated_tasks = feishu_api.tasks_for_user(user_id, await async_api.get_tasks())
+            
+            # 写入时进度汇总已增量更新，直接读取
+            progress_data = await async_api.user_progress(user_id)
+            
+            # 更新用户进度表 - 只传递当前选择的任务，而不是所有已完成的任务
+            # 更新selected_tasks以获取最新状态
+            selected_tasks = [task for task in updated_tasks if task['record_id'] in selected_task_ids]
+            await async_api.update_user_progress(user_id, selected_tasks, progress_data)
+        current_level = progress_data['current_level']
+        total_stars = progress_data['total_stars']
         
-        # 计算新的进度数据
-        current_level = (completed_count // 3) + 1
-        
-        # 计算总星星数 - 累加每个已完成任务的星星数量
-        total_stars = sum(int(task['fields'].get('星星数量', 1)) for task in completed_tasks)
-        
-        # 准备进度数据
-        progress_data = {
-            'current_level': current_level,
-            'total_stars': total_stars,
-            'completed_tasks': completed_count,
-            'total_tasks': total_tasks
-        }
-        
-        # 更新用户进度表 - 只传递当前选择的任务，而不是所有已完成的任务
-        user_id = request.headers.get('X-User-ID', 'default_user')  # 从请求头获取用户ID
-        # 更新selected_tasks以获取最新状态
-        selected_tasks = [task for task in updated_tasks if task['record_id'] in selected_task_ids]
-        feishu_api.update_user_progress(user_id, selected_tasks, progress_data)
+        # 打卡获得的星星计入账本，完成的任务计入按日汇总（同一任务每个任务日只计一次）
+        await async_api.credit_checkin(user_id, selected_tasks, business_date)
+        await async_api.record_history(user_id, selected_tasks, business_date)
+        stars = await async_api.star_account(user_id, business_date)
         
         # 生成奖励消息
-        reward_message = f'恭喜你完成了{len(selected_task_ids)}项任务！\n当前等级：{current_level}\n累计星星：{total_stars}颗'
+        reward_message = f'恭喜你完成了{len(selected_task_ids)}项任务！\n当前等级：{current_level}\n今日星星：{total_stars}颗\n可用星星：{stars["balance"]}颗'
         
         return jsonify({
             'code': 0,
             'data': {
                 'reward_message': reward_message,
-                'progress': progress_data
+                'progress': progress_data,
+                'stars': stars
             }
         })
     except Exception as e:
         error_msg = str(e)
-        print(f'用户打卡失败: {error_msg}')
+        logger.error('用户打卡失败: %s', error_msg)
+        return jsonify({
+            'code': 1,
+            'message': error_msg
+        }), 500
+
+@bp.route('/api/user/history', methods=['GET'])
+async def get_user_history():
+    """获取用户的打卡历史：?from=&to=（YYYY-MM-DD）范围内每天完成的任务数和星星数，以及按任务类型汇总的星星数"""
+    try:
+        today = reset_scheduler.business_date()
+        try:
+            start, end = parse_range(request.args.get('from'), request.args.get('to'), today,
+                                     Config.HISTORY_DEFAULT_DAYS, Config.HISTORY_MAX_DAYS)
+        except ValueError as e:
+            return jsonify({
+                'code': 1,
+                'message': str(e)
+            }), 400
+        return conditional_json(await async_api.user_history(current_user_id(), start, end))
+    except Exception as e:
+        error_msg = str(e)
+        logger.error('获取打卡历史失败: %s', error_msg)
+        return jsonify({
+            'code': 1,
+            'message': error_msg
+        }), 500
+
+@bp.route('/api/user/streaks', methods=['GET'])
+async def get_user_streaks():
+    """获取用户当前和最长的连续打卡天数"""
+    try:
+        return conditional_json(await async_api.user_streaks(current_user_id(), reset_scheduler.business_date()))
+    except Exception as e:
+        error_msg = str(e)
+        logger.error('获取连续打卡天数失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
-@app.route('/api/rewards', methods=['GET'])
-def get_rewards():
+@bp.route('/api/rewards', methods=['GET'])
+async def get_rewards():
     """获取奖励列表"""
-    print('收到获取奖励列表请求')
+    logger.debug('收到获取奖励列表请求')
+    try:
+        delta = changes_since()
+        if delta:
+            version, changes = delta
+            return conditional_json({'delta': True, **delta_for(changes, 'rewards')}, version)
+        version = feishu_api.changes.version()
+        rewards = await async_api.get_rewards(allow_stale=True)
+        logger.debug('成功获取奖励列表，返回%d个奖励', len(rewards))
+        return conditional_json(compact_records('rewards', rewards) if compact_enabled() else rewards, version,
+                                data_freshness(Config.REWARD_TABLE_ID))
+    except Exception as e:
+        error_msg = str(e)
+        logger.error('获取奖励列表失败: %s', error_msg)
+        return jsonify({
+            'code': 1,
+            'message': error_msg
+        }), 500
+
+@bp.route('/api/user/stars', methods=['GET'])
+async def get_user_stars():
+    """获取用户的星星余额、累计获得和累计消耗"""
     try:
-        rewards = feishu_api.get_rewards()
-        print(f'成功获取奖励列表，返回{len(rewards)}个奖励')
+        user_id = current_user_id()
         return jsonify({
             'code': 0,
-            'data': rewards
+            'data': await async_api.star_account(user_id, reset_scheduler.business_date())
         })
     except Exception as e:
         error_msg = str(e)
-        print(f'获取奖励列表失败: {error_msg}')
+        logger.error('获取星星余额失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
-@app.route('/api/rewards/redeem', methods=['POST'])
-def redeem_reward():
+@bp.route('/api/rewards/redeem', methods=['POST'])
+async def redeem_reward():
     """兑换奖励"""
-    print('收到兑换奖励请求')
+    logger.debug('收到兑换奖励请求')
     try:
         # 获取请求数据
         reward_id = request.json.get('reward_id')
-        user_id = request.headers.get('X-User-ID', 'default_user')  # 从请求头获取用户ID
-        current_stars = request.json.get('current_stars', 0)
+        user_id = current_user_id()
+        # 客户端为每次兑换生成的幂等键，重复提交时返回同一个结果
+        idempotency_key = request.headers.get('Idempotency-Key') or request.json.get('idempotency_key')
         
         if not reward_id:
             return jsonify({
@@ -235,14 +490,15 @@ def redeem_reward():
                 'message': '缺少奖励ID'
             }), 400
         
-        # 调用飞书API兑换奖励
-        result = feishu_api.redeem_reward(reward_id, user_id, current_stars)
+        # 星星余额以服务器端账本为准，不再使用客户端传来的星星数；首次使用账本时先开户
+        await async_api.star_account(user_id, reset_scheduler.business_date())
+        result = await async_api.redeem_reward(reward_id, user_id, idempotency_key)
         
-        print(f'成功兑换奖励: {reward_id}')
+        logger.info('成功兑换奖励: %s', reward_id)
         return jsonify({
             'code': 0,
             'data': {
-                'reward': result['reward'],
+                'reward': compact_reward(result['reward']) if compact_enabled() else result['reward'],
                 'stars_spent': result['stars_spent'],
                 'remaining_stars': result['remaining_stars'],
                 'message': f'恭喜你成功兑换了 {result["reward"]["fields"].get("奖励名称", "未命名奖励")}！'
@@ -250,11 +506,164 @@ def redeem_reward():
         })
     except Exception as e:
         error_msg = str(e)
-        print(f'兑换奖励失败: {error_msg}')
+        logger.error('兑换奖励失败: %s', error_msg)
         return jsonify({
             'code': 1,
             'message': error_msg
         }), 500
 
+@bp.route('/api/stream', methods=['GET'])
+def stream_changes():
+    """以 Server-Sent Events 推送任务、进度和奖励的变更
+
+    事件ID为"进程标识-序号"。客户端断线重连时浏览器会带上 Last-Event-ID，从该序号之后继续推送；
+    无法增量补齐（包括 ID 来自其他工作进程或重启前的进程）时推送 reload 事件，由客户端重新加载全部数据。
+
+    连接建立后先推送 ready 事件：complete 为 false 表示多个工作进程共享缓存，
+    其他进程处理的写入不会推送到本连接，客户端需要继续轮询。
+    每个连接在推送期间占用一个请求线程，连接数超过 STREAM_MAX_CONNECTIONS 时推送 busy 事件后关闭，
+    浏览器在 STREAM_BUSY_RETRY 秒后重连，期间客户端回退到轮询。
+    """
+    changes = feishu_api.changes
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    heartbeat = Config.STREAM_HEARTBEAT_INTERVAL
+    limit = Config.STREAM_MAX_CONNECTIONS
+    complete = feishu_api.cache.shared is None
+    # 生成器在请求上下文之外运行，提前取出序列化函数
+    dumps = current_app.json.dumps
+    compact = compact_enabled()
+    user_id = current_user_id()
+
+    def generate():
+        if not changes.subscribe(limit):
+            yield f'retry: {int(Config.STREAM_BUSY_RETRY * 1000)}\nevent: busy\ndata: {{}}\n\n'
+            return
+        try:
+            # 断线后浏览器等待5秒再重连
+            yield 'retry: 5000\n\n'
+            yield f'event: ready\ndata: {dumps({"complete": complete})}\n\n'
+            cursor = changes.last_id if not last_id else changes.sequence(last_id)
+            while True:
+                result = None if cursor is None else changes.wait(cursor, timeout=heartbeat, user=user_id)
+                if result is None:
+                    cursor = changes.last_id
+                    yield f'id: {changes.version(cursor)}\nevent: reload\ndata: {{}}\n\n'
+                    continue
+                new_cursor, events = result
+                if not events:
+                    # 注释行作为心跳，防止代理因空闲断开连接
+                    yield ': keepalive\n\n'
+                for event_id, kind, data in events:
+                    if compact:
+                        data = compact_changes(kind, data)
+                    yield f'id: {changes.version(event_id)}\nevent: {kind}\ndata: {dumps(data)}\n\n'
+                # 其他用户的事件不推送，但游标同样前进
+                cursor = new_cursor
+        finally:
+            changes.unsubscribe()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/stream/stats', methods=['GET'])
+def get_stream_stats():
+    """获取变更推送的订阅数和事件数"""
+    return jsonify({
+        'code': 0,
+        'data': feishu_api.changes.stats()
+    })
+
+@bp.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """获取数据表缓存的命中统计"""
+    stats = feishu_api.cache.stats()
+    stats['freshness'] = {
+        'tasks': feishu_api.cache.freshness(feishu_api.table_id),
+        'rewards': feishu_api.cache.freshness(Config.REWARD_TABLE_ID)
+    }
+    if feishu_api.user_state is not None:
+        stats['user_state'] = feishu_api.user_state.stats()
+    return jsonify({
+        'code': 0,
+        'data': stats
+    })
+
+@bp.route('/api/upstream/stats', methods=['GET'])
+def get_upstream_stats():
+    """获取上游请求的限流、重试、熔断指标和访问令牌状态"""
+    return jsonify({
+        'code': 0,
+        'data': {
+            'scheduler': feishu_api.scheduler.stats(),
+            'token': feishu_api.token_manager.status()
+        }
+    })
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 格式的请求和上游调用延迟指标"""
+    return Response(feishu_api.tracer.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/trace/slow', methods=['GET'])
+def get_slow_requests():
+    """最近的慢请求及其上游调用明细"""
+    return jsonify({
+        'code': 0,
+        'data': feishu_api.tracer.slow_requests()
+    })
+
+@bp.route('/api/reset/status', methods=['GET'])
+def get_reset_status():
+    """获取每日重置的状态"""
+    return jsonify({
+        'code': 0,
+        'data': reset_scheduler.status()
+    })
+
+@bp.route('/api/mirror/status', methods=['GET'])
+def get_mirror_status():
+    """获取本地镜像的同步状态"""
+    mirror = current_app.extensions['mirror']
+    if mirror is None:
+        return jsonify({
+            'code': 1,
+            'message': '本地镜像未启用'
+        }), 404
+    return jsonify({
+        'code': 0,
+        'data': mirror.status()
+    })
+
+@bp.route('/api/journal/status', methods=['GET'])
+def get_journal_status():
+    """获取打卡写入日志的回放状态（待回放、失败的条目）"""
+    journal = feishu_api.journal
+    if journal is None:
+        return jsonify({
+            'code': 1,
+            'message': '写入日志未启用'
+        }), 404
+    return jsonify({
+        'code': 0,
+        'data': journal.status()
+    })
+
+@bp.route('/api/journal/retry', methods=['POST'])
+def retry_journal():
+    """把回放失败的条目重新排队"""
+    journal = feishu_api.journal
+    if journal is None:
+        return jsonify({
+            'code': 1,
+            'message': '写入日志未启用'
+        }), 404
+    return jsonify({
+        'code': 0,
+        'data': {'requeued': journal.retry_failed()}
+    })
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # 开发服务器；生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    create_app().run(debug=Config.DEBUG)
\ No newline at end of file
@@ -0,0 +1,10 @@
+"""ASGI 入口
+
+Flask 的异步路由在 WSGI 服务器下也能运行；需要部署到 ASGI 服务器时使用本模块:
+    uvicorn asgi:application --port 5000
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+application = WsgiToAsgi(create_app())
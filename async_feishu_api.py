@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from feishu_api import FeishuAPI
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFeishuAPI:
+    """FeishuAPI 的 asyncio 版本
+
+    方法与 FeishuAPI 一一对应，内部在专用线程池中调用同一个 FeishuAPI 实例，
+    因此连接池、表缓存、本地镜像和访问令牌都与同步版本共享。
+    互不依赖的上游请求可以用 asyncio.gather 并发执行。
+    """
+
+    def __init__(self, api=None):
+        self.api = api or FeishuAPI()
+        # 与 FeishuAPI 的分页预取线程池分开，避免等待预取结果时占满线程导致死锁
+        self._executor = ThreadPoolExecutor(max_workers=Config.ASYNC_WORKERS, thread_name_prefix='feishu-async')
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # run_in_executor 不会传递 contextvars，手动复制以保留请求追踪上下文
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.api.close()
+
+    @property
+    def table_id(self):
+        return self.api.table_id
+
+    @property
+    def cache(self):
+        return self.api.cache
+
+    async def get_tables(self, app_token):
+        return await self._call(self.api.get_tables, app_token)
+
+    async def get_tasks(self, allow_stale=False):
+        return await self._call(self.api.get_tasks, allow_stale)
+
+    async def get_rewards(self, allow_stale=False):
+        return await self._call(self.api.get_rewards, allow_stale)
+
+    async def iter_records(self, table_id, **kwargs):
+        """异步逐条遍历记录，参数同 FeishuAPI.iter_records"""
+        records = self.api.iter_records(table_id, **kwargs)
+        done = object()
+        try:
+            while True:
+                record = await self._call(next, records, done)
+                if record is done:
+                    return
+                yield record
+        finally:
+            records.close()
+
+    async def count_records(self, table_id, filter=None):
+        return await self._call(self.api.count_records, table_id, filter)
+
+    async def update_task(self, record_id, fields, is_progress=False):
+        return await self._call(self.api.update_task, record_id, fields, is_progress)
+
+    async def create_task(self, fields):
+        return await self._call(self.api.create_task, fields)
+
+    async def batch_update_records(self, table_id, records):
+        """批量更新记录，超过单次上限时各批次并发提交"""
+        return await self._batch(self.api.batch_update_records, table_id, records)
+
+    async def batch_create_records(self, table_id, fields_list):
+        """批量创建记录，超过单次上限时各批次并发提交"""
+        return await self._batch(self.api.batch_create_records, table_id, fields_list)
+
+    async def _batch(self, func, table_id, items):
+        chunks = list(self.api._chunks(items)) or [[]]
+        results = await asyncio.gather(*(self._call(func, table_id, chunk) for chunk in chunks))
+        return {
+            "records": [record for result in results for record in result["records"]],
+            "errors": [error for result in results for error in result["errors"]]
+        }
+
+    async def get_all_data(self, user_id=None, allow_stale=False):
+        """并发获取任务和奖励数据，并附带进度汇总；多用户模式下按 user_id 计算完成状态和进度
+
+        allow_stale 同 FeishuAPI.get_tasks，只有只读接口传入 True。
+        """
+        logger.debug('开始获取所有数据')
+        try:
+            generation = self.api.cache.generation(self.api.table_id)
+            tasks, rewards = await asyncio.gather(self.get_tasks(allow_stale), self.get_rewards(allow_stale))
+            if self.api.user_state is not None and user_id:
+                progress = await self.user_progress(user_id, allow_stale)
+                return FeishuAPI.compose_all_data(self.api.tasks_for_user(user_id, tasks), rewards, progress)
+            return FeishuAPI.compose_all_data(tasks, rewards, self.api.progress.current(generation, tasks))
+        except Exception as e:
+            error_msg = f"获取所有数据失败: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+    async def get_progress(self):
+        return await self._call(self.api.get_progress)
+
+    async def user_progress(self, user_id, allow_stale=False):
+        return await self._call(self.api.user_progress, user_id, allow_stale)
+
+    async def set_user_completed(self, user_id, task_ids, completed=True):
+        return await self._call(self.api.set_user_completed, user_id, task_ids, completed)
+
+    async def rebuild_progress(self):
+        return await self._call(self.api.rebuild_progress)
+
+    async def update_user_progress(self, user_id, tasks, progress_data):
+        return await self._call(self.api.update_user_progress, user_id, tasks, progress_data)
+
+    async def checkin_deferred(self, user_id, task_ids):
+        return await self._call(self.api.checkin_deferred, user_id, task_ids)
+
+    async def reset_tasks_status(self):
+        return await self._call(self.api.reset_tasks_status)
+
+    async def redeem_reward(self, reward_id, user_id, idempotency_key=None):
+        return await self._call(self.api.redeem_reward, reward_id, user_id, idempotency_key)
+
+    async def star_account(self, user_id, business_date):
+        return await self._call(self.api.star_account, user_id, business_date)
+
+    async def credit_checkin(self, user_id, tasks, business_date):
+        return await self._call(self.api.credit_checkin, user_id, tasks, business_date)
+
+    async def record_history(self, user_id, tasks, business_date):
+        return await self._call(self.api.record_history, user_id, tasks, business_date)
+
+    async def user_history(self, user_id, start, end):
+        return await self._call(self.api.user_history, user_id, start, end)
+
+    async def user_streaks(self, user_id, today):
+        return await self._call(self.api.user_streaks, user_id, today)
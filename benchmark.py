@@ -0,0 +1,1051 @@
+"""基于本地桩服务器的性能测试
+
+用法:
+    python benchmark.py pool --requests 500 --concurrency 4
+    python benchmark.py pagination --records 20000
+    python benchmark.py projection --records 2000
+    python benchmark.py async --latency 0.05
+    python benchmark.py routes --concurrency 8 --requests 200 --latency 0.02 --tasks tasks.json
+    python benchmark.py redeem --rewards 20 --tabs 3 --clicks 3 --concurrency 16
+    python benchmark.py users --users 100,1000,5000 --requests 300 --concurrency 8
+    python benchmark.py journal --checkins 200 --latency 0.05 --error-rate 0.3
+    python benchmark.py bulk --records 5000 --latency 0.05
+    python benchmark.py stale --latency 0.5
+    python benchmark.py history --days 30,365,3650
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import Config
+from feishu_stub import FeishuStub
+from log_setup import setup_logging
+
+
+def start_stub(task_count=9):
+    """启动桩服务器并把 Config 指向它"""
+    stub = FeishuStub().start()
+    Config.FEISHU_API_BASE = stub.url
+    Config.FEISHU_APP_ID = Config.FEISHU_APP_ID or 'cli_stub'
+    Config.FEISHU_APP_SECRET = Config.FEISHU_APP_SECRET or 'stub_secret'
+    Config.BASE_ID = Config.BASE_ID or 'stub_base'
+    Config.TASK_TABLE_ID = Config.TASK_TABLE_ID or 'tbl_tasks'
+    Config.REWARD_TABLE_ID = Config.REWARD_TABLE_ID or 'tbl_rewards'
+    Config.PROGRESS_TABLE_ID = Config.PROGRESS_TABLE_ID or 'tbl_progress'
+    # 快照写到临时目录，不会用上一次测试的数据预热；其他测试按读穿缓存测量，不返回过期数据
+    Config.SNAPSHOT_DIR = tempfile.mkdtemp()
+    Config.TABLE_CACHE_STALE_TTL = 0
+    Config.HISTORY_DB_PATH = os.path.join(tempfile.mkdtemp(), 'history.db')
+    # 桩服务器没有配额限制，放开本地限流，测量的是被测优化本身而不是令牌桶的排队（routes 可用 --qps 恢复配额）
+    Config.FEISHU_QPS = Config.FEISHU_BURST = 10 ** 6
+    stub.add_records(Config.TASK_TABLE_ID, [
+        {'任务名称': f'任务{i}', '任务类型': '学习任务', '星星数量': '1', '任务完成状态': '否'}
+        for i in range(task_count)
+    ])
+    return stub
+
+
+def run_rounds(func, total, concurrency):
+    """并发执行 func 共 total 次，返回每秒往返次数"""
+    start = time.perf_counter()
+    # 屏蔽接口内部的打印输出，避免干扰计时
+    with contextlib.redirect_stdout(io.StringIO()):
+        if concurrency <= 1:
+            for _ in range(total):
+                func()
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(lambda _: func(), range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed
+
+
+def bench_pool(args):
+    """对比每次新建连接与共享连接池的往返吞吐量"""
+    from feishu_api import FeishuAPI
+
+    # 对照组直接发送请求，不经过限流；start_stub 已放开配额，两组只在连接是否复用上有区别
+    stub = start_stub()
+    try:
+        api = FeishuAPI()
+        api.get_tasks()  # 预热：获取令牌并建立连接
+        url = f"{stub.url}/bitable/v1/apps/{Config.BASE_ID}/tables/{Config.TASK_TABLE_ID}/records"
+        headers = {'Authorization': f'Bearer {api._get_access_token()}'}
+
+        def unpooled():
+            requests.get(url, headers=headers, timeout=api.timeout).json()
+
+        def pooled():
+            # 绕过表缓存，每次都向上游发送请求，只比较连接复用的效果
+            list(api.iter_records(Config.TASK_TABLE_ID, prefetch=False))
+
+        unpooled_rps = run_rounds(unpooled, args.requests, args.concurrency)
+        pooled_rps = run_rounds(pooled, args.requests, args.concurrency)
+        api.close()
+    finally:
+        stub.stop()
+
+    print(f'请求数: {args.requests}, 并发: {args.concurrency}')
+    print(f'每次新建连接: {unpooled_rps:8.1f} 次/秒')
+    print(f'共享连接池:   {pooled_rps:8.1f} 次/秒')
+    print(f'提升: {pooled_rps / unpooled_rps:.2f}x')
+
+
+def measure_peak(func):
+    """返回 func 执行期间 Python 内存分配的峰值（字节）和返回值"""
+    tracemalloc.start()
+    try:
+        result = func()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def bench_pagination(args):
+    """验证 iter_records 完整读取大表且内存占用不随表大小增长"""
+    from feishu_api import FeishuAPI
+
+    stub = start_stub()
+    table_id = 'tbl_large'
+    description = '每天坚持完成任务，' * 10
+    try:
+        api = FeishuAPI()
+        rows = []
+        for size in (args.records, args.records * 4):
+            stub.tables.pop(table_id, None)
+            stub.add_records(table_id, [
+                {'任务名称': f'任务{i}', '任务描述': description, '星星数量': str(i % 5 + 1)}
+                for i in range(size)
+            ])
+            with contextlib.redirect_stdout(io.StringIO()):
+                api._get_access_token()
+                stream_peak, count = measure_peak(
+                    lambda: sum(1 for _ in api.iter_records(table_id, page_size=args.page_size)))
+                list_peak, records = measure_peak(
+                    lambda: list(api.iter_records(table_id, page_size=args.page_size)))
+            rows.append((size, count, len(records), stream_peak, list_peak))
+            del records
+        api.close()
+    finally:
+        stub.stop()
+
+    print(f'每页记录数: {args.page_size}')
+    for size, count, listed, stream_peak, list_peak in rows:
+        print(f'{size:>7} 条: 流式读取 {count} 条, 峰值 {stream_peak / 1024:8.0f} KB | '
+              f'全部载入 {listed} 条, 峰值 {list_peak / 1024:8.0f} KB')
+    complete = all(size == count == listed for size, count, listed, _, _ in rows)
+    bounded = rows[1][3] < rows[0][3] * 1.5
+    print(f'读取完整: {"是" if complete else "否"}')
+    print(f'流式内存有界: {"是" if bounded else "否"}')
+    if not (complete and bounded):
+        raise SystemExit(1)
+
+
+def bench_projection(args):
+    """对比全表读取与字段裁剪+服务端筛选的进度计算"""
+    from feishu_api import FeishuAPI, COMPLETED_FILTER
+
+    stub = start_stub(task_count=0)
+    description = '每天坚持完成任务，' * 10
+    stub.add_records(Config.TASK_TABLE_ID, [
+        {'任务名称': f'任务{i}', '任务描述': description, '任务类型': '学习任务',
+         '星星数量': str(i % 5 + 1), '任务完成状态': '是' if i % 3 == 0 else '否'}
+        for i in range(args.records)
+    ])
+    try:
+        api = FeishuAPI()
+        results = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            api._get_access_token()
+            for name, func in (
+                ('全表读取', lambda: FeishuAPI.calculate_progress(
+                    [t for t in api.iter_records(api.table_id) if t['fields'].get('任务完成状态') == '是'],
+                    args.records)),
+                ('裁剪+筛选', api.query_progress),
+                ('重置扫描(全表)', lambda: [t for t in api.iter_records(api.table_id)
+                                           if t['fields'].get('任务完成状态') == '是']),
+                ('重置扫描(筛选)', lambda: list(api.iter_records(
+                    api.table_id, fields=['任务完成状态'], filter=COMPLETED_FILTER))),
+            ):
+                stub.reset_counters()
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    result = func()
+                elapsed = (time.perf_counter() - start) / args.rounds
+                results[name] = (stub.bytes_sent / args.rounds, elapsed, result)
+        api.close()
+    finally:
+        stub.stop()
+
+    print(f'任务数: {args.records}')
+    for name, (size, elapsed, _) in results.items():
+        print(f'{name:<12} 响应体 {size / 1024:8.1f} KB, 耗时 {elapsed * 1000:7.1f} ms')
+    if results['全表读取'][2] != results['裁剪+筛选'][2]:
+        print('错误: 两种方式计算的进度不一致')
+        raise SystemExit(1)
+
+
+def bench_async(args):
+    """在注入延迟的桩服务器上对比同步与异步客户端的墙钟耗时"""
+    import asyncio
+    from feishu_api import FeishuAPI
+    from async_feishu_api import AsyncFeishuAPI
+
+    stub = start_stub()
+    Config.TABLE_CACHE_TTL = 0  # 关闭表缓存，每次都请求上游
+    try:
+        api = FeishuAPI()
+        async_api = AsyncFeishuAPI(api)
+        with contextlib.redirect_stdout(io.StringIO()):
+            api._get_access_token()
+            tasks = api.get_tasks()
+        stub.latency = args.latency
+        updates = [{'record_id': task['record_id'], 'fields': {'任务完成状态': '否'}} for task in tasks]
+
+        async def async_writes():
+            # 逐条更新任务：异步版本并发提交
+            await asyncio.gather(*(async_api.update_task(u['record_id'], u['fields']) for u in updates))
+
+        def sync_writes():
+            for u in updates:
+                api.update_task(u['record_id'], u['fields'])
+
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, sync_func, async_func in (
+                ('获取所有数据', api.get_all_data, async_api.get_all_data),
+                (f'逐条更新{len(updates)}个任务', sync_writes, async_writes),
+            ):
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    sync_func()
+                sync_elapsed = (time.perf_counter() - start) / args.rounds
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    asyncio.run(async_func())
+                async_elapsed = (time.perf_counter() - start) / args.rounds
+                results.append((name, sync_elapsed, async_elapsed))
+        async_api.close()
+    finally:
+        stub.stop()
+
+    print(f'上游延迟: {args.latency * 1000:.0f} ms')
+    for name, sync_elapsed, async_elapsed in results:
+        print(f'{name}: 同步 {sync_elapsed * 1000:7.1f} ms, 异步 {async_elapsed * 1000:7.1f} ms, '
+              f'提升 {sync_elapsed / async_elapsed:.2f}x')
+
+
+def percentile(values, pct):
+    """按最近秩法取百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def bench_routes(args):
+    """通过 Flask 接口并发压测主要业务路径，统计延迟分位数和每个请求触发的上游调用数"""
+    stub = start_stub(task_count=0)
+    stub.seed(Config.TASK_TABLE_ID, Config.REWARD_TABLE_ID, args.tasks, args.task_count, args.reward_count)
+    # 压测期间不启动后台重置和镜像同步，避免产生额外的上游请求
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    if args.cache_ttl is not None:
+        Config.TABLE_CACHE_TTL = args.cache_ttl
+    if args.qps is not None:
+        Config.FEISHU_QPS = args.qps
+        Config.FEISHU_BURST = max(int(args.qps), 1)
+    # 只输出警告及以上的日志，关闭慢请求日志
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    Config.LEDGER_DB_PATH = os.path.join(tempfile.mkdtemp(), 'star_ledger.db')
+    setup_logging(level='WARNING')
+    try:
+        from app import create_app
+        flask_app = create_app()
+        client_local = threading.local()
+        feishu_api = flask_app.extensions['feishu_api']
+        task_ids = list(stub.tables[Config.TASK_TABLE_ID])
+        reward_ids = list(stub.tables[Config.REWARD_TABLE_ID])
+        # 兑换以服务器端账本为准，预先发放足够的星星
+        feishu_api.ledger.record('default_user', 'earn', 10 ** 9, key='benchmark:grant')
+        fresh_rewards = []
+
+        def client():
+            if not hasattr(client_local, 'client'):
+                client_local.client = flask_app.test_client()
+            return client_local.client
+
+        def all_data():
+            return client().get('/api/all-data')
+
+        def checkin():
+            selected = random.sample(task_ids, min(3, len(task_ids)))
+            return client().post('/api/user/checkin', json={'task_ids': selected})
+
+        def prepare_redeem():
+            # 每个奖励只能兑换一次，为每个请求准备一个未兑换的奖励（直接写入桩服务器，不计入上游调用）
+            fresh_rewards.extend(record['record_id'] for record in stub.add_records(
+                Config.REWARD_TABLE_ID, [{'奖励名称': f'压测奖励{i}', '所需星星数': '1', '是否已兑换': '否'}
+                                         for i in range(args.requests)]))
+            feishu_api.cache.invalidate(Config.REWARD_TABLE_ID)
+            feishu_api.get_rewards()
+
+        def redeem():
+            return client().post('/api/rewards/redeem', json={'reward_id': fresh_rewards.pop()})
+
+        def reset():
+            # 先在桩服务器上直接把一部分任务标记为已完成（不计入上游调用），再执行每日重置
+            for record_id in random.sample(task_ids, min(3, len(task_ids))):
+                stub.update_record(Config.TASK_TABLE_ID, record_id, {'任务完成状态': '是'})
+            feishu_api.reset_tasks_status()
+
+        scenarios = {'all-data': all_data, 'checkin': checkin, 'redeem': redeem, 'reset': reset}
+        setups = {'redeem': prepare_redeem}
+        selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+
+        def timed(func):
+            start = time.perf_counter()
+            response = func()
+            elapsed = time.perf_counter() - start
+            ok = response is None or response.status_code < 400
+            return elapsed, ok
+
+        results = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            feishu_api._get_access_token()
+            stub.latency = args.latency
+            stub.error_rate = args.error_rate
+            for name in selected:
+                func = scenarios[name]
+                if name in setups:
+                    setups[name]()
+                stub.reset_counters()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    samples = list(executor.map(lambda _: timed(func), range(args.requests)))
+                wall = time.perf_counter() - start
+                latencies = [elapsed for elapsed, _ in samples]
+                results.append((name, latencies, sum(1 for _, ok in samples if not ok),
+                                stub.call_count / args.requests, args.requests / wall))
+            stub.latency = 0
+            stub.error_rate = 0
+        feishu_api.close()
+    finally:
+        stub.stop()
+
+    print(f'任务数: {len(task_ids)}, 奖励数: {len(reward_ids)}, 并发: {args.concurrency}, '
+          f'每个场景请求数: {args.requests}, 上游延迟: {args.latency * 1000:.0f} ms, 错误率: {args.error_rate:.0%}')
+    print(f'{"场景":<10} {"p50(ms)":>9} {"p95(ms)":>9} {"p99(ms)":>9} {"吞吐(次/秒)":>11} {"上游调用/请求":>13} {"失败":>5}')
+    for name, latencies, failures, calls, throughput in results:
+        print(f'{name:<10} {percentile(latencies, 50) * 1000:9.1f} {percentile(latencies, 95) * 1000:9.1f} '
+              f'{percentile(latencies, 99) * 1000:9.1f} {throughput:11.1f} {calls:13.2f} {failures:5}')
+
+
+def bench_redeem(args):
+    """并发兑换压测：重复点击、多个标签页和多个用户同时兑换同一个奖励时，每个奖励只兑换一次，星星不会多扣"""
+    stub = start_stub(task_count=0)
+    stub.seed(Config.TASK_TABLE_ID, Config.REWARD_TABLE_ID, reward_count=args.rewards)
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    Config.LEDGER_DB_PATH = os.path.join(tempfile.mkdtemp(), 'star_ledger.db')
+    # 预期内的兑换失败（已兑换、星星不足）会输出错误日志，压测时不显示
+    setup_logging(level='CRITICAL')
+    users = [f'bench_user{index}' for index in range(args.users)]
+    try:
+        from app import create_app
+        flask_app = create_app()
+        feishu_api = flask_app.extensions['feishu_api']
+        rewards = stub.tables[Config.REWARD_TABLE_ID]
+        costs = {record_id: int(record['fields']['所需星星数']) for record_id, record in rewards.items()}
+        # 默认发放的星星只够兑换大约一半的奖励，同时检验余额不足的情况
+        balance = args.balance if args.balance is not None else sum(costs.values()) // 2
+        for user_id in users:
+            feishu_api.ledger.record(user_id, 'earn', balance, key=f'benchmark:grant:{user_id}')
+
+        # 每个奖励由 tabs 个标签页同时兑换，标签页依次属于各个用户，每个标签页用自己的幂等键连续点击 clicks 次
+        attempts = [(record_id, f'{record_id}-{tab}') for record_id in costs
+                    for tab in range(args.tabs) for _ in range(args.clicks)]
+        random.shuffle(attempts)
+        client_local = threading.local()
+
+        def redeem(attempt):
+            if not hasattr(client_local, 'client'):
+                client_local.client = flask_app.test_client()
+            record_id, key = attempt
+            user_id = users[int(key.rsplit('-', 1)[1]) % len(users)]
+            response = client_local.client.post('/api/rewards/redeem', json={'reward_id': record_id},
+                                                headers={'Idempotency-Key': key, 'X-User-ID': user_id})
+            return attempt, response.get_json()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            feishu_api._get_access_token()
+            feishu_api.get_rewards()
+            stub.reset_counters()
+            stub.latency = args.latency
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = list(executor.map(redeem, attempts))
+            wall = time.perf_counter() - start
+            stub.latency = 0
+        summaries = {user_id: feishu_api.ledger.summary(user_id) for user_id in users}
+        puts = stub.calls_by_route.get('update_record', 0)
+        feishu_api.close()
+    finally:
+        stub.stop()
+
+    redeemed = [record_id for record_id, record in rewards.items() if record['fields'].get('是否已兑换') == '是']
+    succeeded = {}
+    for (record_id, key), body in results:
+        if body['code'] == 0:
+            succeeded.setdefault(key, []).append(body['data'])
+    winners = {}
+    for key, bodies in succeeded.items():
+        winners.setdefault(key.rsplit('-', 1)[0], set()).add(key)
+    expected_spent = sum(costs[record_id] for record_id in redeemed)
+    spent = sum(summary['spent'] for summary in summaries.values())
+    pending = sum(summary['pending'] for summary in summaries.values())
+
+    print(f'奖励数: {len(costs)}, 用户数: {len(users)}, 每个奖励的标签页: {args.tabs}, 每个标签页点击: {args.clicks}, '
+          f'并发: {args.concurrency}, 兑换请求: {len(attempts)}, 耗时 {wall:.2f} s')
+    print(f'每个用户的初始星星: {balance}, 已兑换奖励: {len(redeemed)}, 飞书写入: {puts}, 账本消耗: {spent}, '
+          f'余额: {[summary["balance"] for summary in summaries.values()]}, 预扣中: {pending}')
+    checks = {
+        '每个奖励最多兑换一次': puts == len(redeemed) and all(len(keys) == 1 for keys in winners.values()),
+        '成功兑换的奖励都已写入飞书': set(winners) == set(redeemed),
+        '星星消耗与已兑换奖励一致': spent == expected_spent and pending == 0,
+        '余额不为负': all(summary['balance'] == balance - summary['spent'] >= 0 for summary in summaries.values()),
+        '重复点击返回相同结果': all(all(body == bodies[0] for body in bodies) for bodies in succeeded.values()),
+    }
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_users(args):
+    """多用户压测：用户数增加时打卡和读取进度的延迟应基本不变，且用户之间的完成状态互不影响"""
+    stub = start_stub(task_count=args.task_count)
+    stub.seed(Config.TASK_TABLE_ID, Config.REWARD_TABLE_ID, reward_count=5)
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    Config.MULTI_USER_ENABLED = True
+    state_dir = tempfile.mkdtemp()
+    Config.USER_STATE_DB_PATH = os.path.join(state_dir, 'user_state.db')
+    Config.LEDGER_DB_PATH = os.path.join(state_dir, 'star_ledger.db')
+    setup_logging(level='CRITICAL')
+    counts = [int(count) for count in args.users.split(',')]
+    rows = []
+    try:
+        from app import create_app
+        flask_app = create_app()
+        feishu_api = flask_app.extensions['feishu_api']
+        store = feishu_api.user_state
+        client_local = threading.local()
+
+        def client():
+            if not hasattr(client_local, 'client'):
+                client_local.client = flask_app.test_client()
+            return client_local.client
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            task_ids = [task['record_id'] for task in feishu_api.get_tasks()]
+            seeded = 0
+            for count in counts:
+                # 补足用户：每个用户已完成随机的一部分任务
+                for index in range(seeded, count):
+                    store.set_completed(f'user-{index}', random.sample(task_ids, random.randint(0, len(task_ids))))
+                seeded = max(seeded, count)
+                latencies = {'checkin': [], 'progress': [], 'all-data': []}
+
+                def request_once(_):
+                    user_id = f'user-{random.randrange(count)}'
+                    headers = {'X-User-ID': user_id}
+                    scenario = random.choice(list(latencies))
+                    start = time.perf_counter()
+                    if scenario == 'checkin':
+                        response = client().post('/api/user/checkin', headers=headers,
+                                                 json={'task_ids': random.sample(task_ids, 2)})
+                    elif scenario == 'progress':
+                        response = client().get('/api/user/progress', headers=headers)
+                    else:
+                        response = client().get('/api/all-data', headers=headers)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    if response.status_code != 200:
+                        raise Exception(f'{scenario} 请求失败: {response.status_code}')
+                    latencies[scenario].append(elapsed)
+
+                stub.reset_counters()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    list(executor.map(request_once, range(args.requests)))
+                rows.append((count, latencies, sum(stub.calls_by_route.values())))
+
+            # 隔离性：一个用户打卡后，其他用户和任务表的完成状态都不变
+            first, second = client(), flask_app.test_client()
+            first.post('/api/user/checkin', headers={'X-User-ID': 'isolation-a'}, json={'task_ids': task_ids[:3]})
+            progress_a = first.get('/api/user/progress', headers={'X-User-ID': 'isolation-a'}).get_json()['data']
+            progress_b = second.get('/api/user/progress', headers={'X-User-ID': 'isolation-b'}).get_json()['data']
+            tasks_b = second.get('/api/tasks', headers={'X-User-ID': 'isolation-b'}).get_json()['data']
+        table_untouched = all(record['fields'].get('任务完成状态') != '是'
+                              for record in stub.tables[Config.TASK_TABLE_ID].values())
+        stats = store.stats()
+        feishu_api.close()
+    finally:
+        stub.stop()
+
+    print(f'任务数: {len(task_ids)}, 每档请求数: {args.requests}, 并发: {args.concurrency}')
+    print(f'{"用户数":>8} {"场景":<10} {"请求数":>6} {"p50(ms)":>9} {"p95(ms)":>9} {"上游调用":>8}')
+    for count, latencies, upstream in rows:
+        for scenario, values in latencies.items():
+            print(f'{count:>8} {scenario:<10} {len(values):>6} {percentile(values, 50):>9.2f} '
+                  f'{percentile(values, 95):>9.2f} {upstream:>8}')
+    print(f'用户分区缓存: {stats}')
+    checks = {
+        '打卡用户的进度已更新': progress_a['completed_tasks'] == 3,
+        '其他用户的进度不受影响': progress_b['completed_tasks'] == 0,
+        '其他用户的任务仍为未完成': not any(task['completed'] for task in tasks_b),
+        '任务表的完成状态列未被修改': table_untouched,
+    }
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_journal(args):
+    """打卡写入日志压测：对比同步写入与写入日志后的打卡延迟，并校验上游出错、重复回放时进度记录不重复、不丢失，
+    以及多用户模式下日志写入失败时撤销用户的完成状态"""
+    stub = start_stub(task_count=args.task_count)
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    state_dir = tempfile.mkdtemp()
+    Config.LEDGER_DB_PATH = os.path.join(state_dir, 'star_ledger.db')
+    Config.JOURNAL_DB_PATH = os.path.join(state_dir, 'write_journal.db')
+    Config.JOURNAL_FLUSH_INTERVAL = 0.05
+    setup_logging(level='CRITICAL')
+    progress_table = stub.tables.setdefault(Config.PROGRESS_TABLE_ID, {})
+    results = {}
+    try:
+        from app import create_app
+        for mode in ('sync', 'journal'):
+            Config.JOURNAL_ENABLED = mode == 'journal'
+            flask_app = create_app()
+            feishu_api = flask_app.extensions['feishu_api']
+            client_local = threading.local()
+
+            def checkin(index):
+                if not hasattr(client_local, 'client'):
+                    client_local.client = flask_app.test_client()
+                task_ids = random.sample(task_ids_all, 3)
+                start = time.perf_counter()
+                response = client_local.client.post('/api/user/checkin', headers={'X-User-ID': f'user-{index}'},
+                                                    json={'task_ids': task_ids})
+                return (time.perf_counter() - start) * 1000, response.status_code == 200, task_ids
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                task_ids_all = [task['record_id'] for task in feishu_api.get_tasks()]
+                for record in stub.tables[Config.TASK_TABLE_ID].values():
+                    record['fields']['任务完成状态'] = '否'
+                feishu_api.cache.invalidate()
+                feishu_api.get_tasks()
+                before = len(progress_table)
+                stub.reset_counters()
+                stub.latency = args.latency
+                # 写入日志模式下上游随机出错，由后台回放重试
+                stub.error_rate = args.error_rate if mode == 'journal' else 0
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    rows = list(executor.map(checkin, range(args.checkins)))
+                journal = feishu_api.journal
+                replayed = True
+                if journal is not None:
+                    time.sleep(args.latency * 4)
+                    stub.error_rate = 0
+                    # 上游恢复后等待全部回放完成（失败的条目重新排队）
+                    deadline = time.monotonic() + 60
+                    while journal.status()['pending'] or journal.status()['failed']:
+                        if time.monotonic() > deadline:
+                            replayed = False
+                            break
+                        journal.retry_failed()
+                        journal.flush()
+                    created = len(progress_table) - before
+                    # 模拟回放成功后、标记完成前进程退出：全部条目重新回放一次，不应产生新记录
+                    with journal._lock, journal._conn:
+                        journal._conn.execute("UPDATE entries SET status = 'pending'")
+                    journal.flush()
+                    duplicates = len(progress_table) - before - created
+                    status = journal.status()
+                else:
+                    created, duplicates, status = len(progress_table) - before, 0, None
+                stub.latency = 0
+                upstream = dict(stub.calls_by_route)
+            completed = {task_id for _, ok, task_ids in rows if ok for task_id in task_ids}
+            results[mode] = {
+                'latencies': [row[0] for row in rows],
+                'failed': sum(not row[1] for row in rows),
+                'expected': sum(len(row[2]) for row in rows if row[1]),
+                'created': created,
+                'duplicates': duplicates,
+                'replayed': replayed,
+                'marked': all(stub.tables[Config.TASK_TABLE_ID][task_id]['fields']['任务完成状态'] == '是'
+                              for task_id in completed),
+                'upstream': upstream,
+                'status': status
+            }
+            feishu_api.close()
+
+        # 多用户模式下日志写入失败：本次新完成的任务恢复为未完成，用户可以重新打卡
+        Config.JOURNAL_ENABLED = True
+        Config.MULTI_USER_ENABLED = True
+        Config.USER_STATE_DB_PATH = os.path.join(state_dir, 'user_state.db')
+        Config.JOURNAL_DB_PATH = os.path.join(state_dir, 'write_journal_failure.db')
+        flask_app = create_app()
+        feishu_api = flask_app.extensions['feishu_api']
+        client = flask_app.test_client()
+        with contextlib.redirect_stdout(io.StringIO()):
+            already, task_id = task_ids_all[:2]
+            feishu_api.set_user_completed('journal-failure', [already])
+            append = feishu_api.journal.append
+
+            def failing_append(*args, **kwargs):
+                raise OSError('磁盘已满')
+
+            feishu_api.journal.append = failing_append
+            failed_status = client.post('/api/user/checkin', headers={'X-User-ID': 'journal-failure'},
+                                        json={'task_ids': [already, task_id]}).status_code
+            after_failure = set(feishu_api.user_state.completed('journal-failure'))
+            feishu_api.journal.append = append
+            retry_status = client.post('/api/user/checkin', headers={'X-User-ID': 'journal-failure'},
+                                       json={'task_ids': [task_id]}).status_code
+            after_retry = set(feishu_api.user_state.completed('journal-failure'))
+        feishu_api.close()
+    finally:
+        Config.JOURNAL_ENABLED = False
+        Config.MULTI_USER_ENABLED = False
+        stub.stop()
+
+    print(f'打卡次数: {args.checkins}, 并发: {args.concurrency}, 上游延迟: {args.latency * 1000:.0f} ms, '
+          f'写入日志模式的上游错误率: {args.error_rate:.0%}')
+    print(f'{"模式":<8} {"p50(ms)":>9} {"p95(ms)":>9} {"失败":>5} {"进度记录":>8} {"批量创建调用":>10} {"批量更新调用":>10}')
+    for mode, result in results.items():
+        print(f'{mode:<8} {percentile(result["latencies"], 50):>9.2f} {percentile(result["latencies"], 95):>9.2f} '
+              f'{result["failed"]:>5} {result["created"]:>8} {result["upstream"].get("batch_create", 0):>10} '
+              f'{result["upstream"].get("batch_update", 0):>10}')
+    journal = results['journal']
+    print(f'日志状态: {journal["status"]}')
+    checks = {
+        '打卡全部成功': journal['failed'] == 0 and results['sync']['failed'] == 0,
+        '日志全部回放': journal['replayed'] and journal['status']['pending'] == 0 and journal['status']['failed'] == 0,
+        '进度记录不丢失不重复': journal['created'] == journal['expected'],
+        '重复回放不产生新记录': journal['duplicates'] == 0,
+        '打卡任务已写入飞书': journal['marked'],
+        '日志写入失败时撤销本次完成状态': failed_status == 500 and after_failure == {already},
+        '日志写入失败后可以重新打卡': retry_status == 200 and after_retry == {already, task_id},
+    }
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_bulk(args):
+    """批量导入导出：对比逐条创建与 cli.py 的批量并发导入，并校验重复导入不产生重复记录、导出可以再次导入"""
+    import asyncio
+    import json
+
+    import cli
+    from async_feishu_api import AsyncFeishuAPI
+
+    stub = start_stub(task_count=0)
+    setup_logging(level='CRITICAL')
+    state_dir = tempfile.mkdtemp()
+    Config.LEDGER_DB_PATH = os.path.join(state_dir, 'star_ledger.db')
+    source = os.path.join(state_dir, 'tasks.json')
+    rows = [{'任务名称': f'任务{i}', '任务描述': '每天坚持完成任务', '任务类型': '学习任务', '星星数量': str(i % 3 + 1)}
+            for i in range(args.records)]
+    with open(source, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False)
+    table = stub.tables.setdefault(Config.TASK_TABLE_ID, {})
+    timings = {}
+    try:
+        async_api = AsyncFeishuAPI()
+        api = async_api.api
+        with contextlib.redirect_stdout(io.StringIO()):
+            api._get_access_token()
+            stub.latency = args.latency
+            # 旧的初始化脚本逐条创建，按前 sample 条的耗时估算全部记录
+            start = time.perf_counter()
+            for fields in rows[:args.sample]:
+                api.create_task(dict(fields, 任务名称=f'逐条{fields["任务名称"]}'))
+            timings['逐条创建(估算)'] = (time.perf_counter() - start) / args.sample * args.records
+            baseline = dict(table)
+            table.clear()
+
+            start = time.perf_counter()
+            first = asyncio.run(cli.upsert(async_api, 'tasks', cli.load_records(source)))
+            timings['批量导入'] = time.perf_counter() - start
+            start = time.perf_counter()
+            again = asyncio.run(cli.upsert(async_api, 'tasks', cli.load_records(source)))
+            timings['重复导入'] = time.perf_counter() - start
+
+            # 修改一部分记录后同步，只更新变化的记录；状态字段默认不覆盖
+            changed = rows[:args.records // 10]
+            for fields in changed:
+                fields['任务描述'] = '描述已修改'
+                fields['任务完成状态'] = '是'
+            result = asyncio.run(cli.upsert(async_api, 'tasks', rows))
+
+            exported = os.path.join(state_dir, 'export.json')
+            start = time.perf_counter()
+            count = cli.export_table(api, Config.TASK_TABLE_ID, exported)
+            timings['导出'] = time.perf_counter() - start
+            stub.latency = 0
+            with open(exported, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            round_trip = cli.plan_changes(list(table.values()), cli.load_records(exported), '任务名称')
+        async_api.close()
+    finally:
+        stub.stop()
+
+    print(f'记录数: {args.records}, 上游延迟: {args.latency * 1000:.0f} ms, 逐条创建采样: {args.sample} 条')
+    for name, elapsed in timings.items():
+        print(f'{name:<12} {elapsed:8.2f} s')
+    names = [record['fields']['任务名称'] for record in table.values()]
+    checks = {
+        '逐条创建的采样完成': len(baseline) == args.sample,
+        '批量导入全部创建': first is not None and first['created'] == args.records and not first['errors'],
+        '重复导入不产生重复记录': again is None and len(names) == len(set(names)) == args.records,
+        '只更新修改过的记录': result is not None and result['updated'] == len(changed) and result['created'] == 0,
+        '状态字段未被覆盖': all(record['fields'].get('任务完成状态') != '是' for record in table.values()),
+        '导出为快照格式': count == args.records and snapshot['code'] == 0 and len(snapshot['data']) == args.records,
+        '导出文件再次导入无差异': not round_trip['create'] and not round_trip['update'],
+    }
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_stale(args):
+    """上游变慢或不可用时的读接口：过期快照立即返回并在后台刷新，加载失败时返回最后一份快照，冷启动由磁盘快照预热；
+    写操作不使用旧数据，上游不可用时返回错误"""
+    import json
+
+    stub = start_stub(task_count=args.task_count)
+    stub.seed(Config.TASK_TABLE_ID, Config.REWARD_TABLE_ID, reward_count=5)
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    # 上游不可用时不重试，直接观察兜底的效果
+    Config.FEISHU_MAX_RETRIES = 0
+    state_dir = tempfile.mkdtemp()
+    Config.LEDGER_DB_PATH = os.path.join(state_dir, 'star_ledger.db')
+    Config.TABLE_CACHE_TTL = args.ttl
+    Config.TABLE_CACHE_STALE_TTL = args.stale_ttl
+    setup_logging(level='CRITICAL')
+    task_table = Config.TASK_TABLE_ID
+    url = '/api/all-data?format=raw'
+    rows = {}
+    apis = []
+
+    def request(name, flask_app):
+        start = time.perf_counter()
+        response = flask_app.test_client().get(url)
+        elapsed = (time.perf_counter() - start) * 1000
+        rows[name] = (elapsed, response.status_code, response.headers.get('X-Data-Stale', '-'), response.get_json())
+        return rows[name]
+
+    def new_app():
+        flask_app = create_app()
+        apis.append(flask_app.extensions['feishu_api'])
+        return flask_app
+
+    def task_name(body, record_id):
+        return next(task['fields']['任务名称'] for task in body['data']['tasks'] if task['record_id'] == record_id)
+
+    try:
+        from app import create_app
+        with contextlib.redirect_stdout(io.StringIO()):
+            flask_app = new_app()
+            cache = apis[0].cache
+            request('首次加载', flask_app)
+            with open(os.path.join(Config.SNAPSHOT_DIR, f'{task_table}.json'), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+
+            # 上游变慢：缓存过期后先返回旧数据，后台刷新完成后返回飞书中的修改
+            stub.latency = args.latency
+            record_id = next(iter(stub.tables[task_table]))
+            old_name = stub.tables[task_table][record_id]['fields']['任务名称']
+            stub.update_record(task_table, record_id, {'任务名称': '后台刷新后的名称'})
+            time.sleep(args.ttl)
+            request('过期后读取', flask_app)
+            deadline = time.monotonic() + args.latency * 10 + 5
+            while cache.freshness(task_table)['stale'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            request('刷新后读取', flask_app)
+            # 对照：关闭 stale-while-revalidate 时过期后的读取等待上游加载
+            cache.stale_ttl = 0
+            time.sleep(args.ttl)
+            request('过期后读取(关闭SWR)', flask_app)
+
+            # 上游不可用：加载失败时返回最后一份快照
+            stub.latency = 0
+            stub.error_rate = 1.0
+            time.sleep(args.ttl)
+            request('上游不可用', flask_app)
+            # 写操作不使用旧数据：由飞书重建进度在上游不可用时返回错误，而不是在快照上报告成功
+            rebuild_status = flask_app.test_client().post('/api/user/progress/rebuild').status_code
+            # 冷启动的新进程在上游不可用时由磁盘快照返回数据
+            request('冷启动+上游不可用', new_app())
+            Config.SNAPSHOT_ENABLED = False
+            request('冷启动+无快照(原行为)', new_app())
+            Config.SNAPSHOT_ENABLED = True
+
+            # 上游恢复但很慢：冷启动的新进程不等待第一次上游请求
+            stub.error_rate = 0
+            stub.latency = args.latency
+            request('冷启动+上游变慢', new_app())
+            stub.latency = 0
+    finally:
+        Config.SNAPSHOT_ENABLED = True
+        for api in apis:
+            api.close()
+        stub.stop()
+
+    print(f'上游延迟: {args.latency * 1000:.0f} ms, 缓存有效期: {args.ttl} s, 过期数据可返回: {args.stale_ttl} s')
+    print(f'{"场景":<20} {"耗时(ms)":>9} {"状态码":>6} {"X-Data-Stale":>13}')
+    for name, (elapsed, status, stale, _) in rows.items():
+        print(f'{name:<20} {elapsed:>9.1f} {status:>6} {stale:>13}')
+    fast = args.latency * 1000 / 2
+    checks = {
+        '快照为 tasks.json 格式': snapshot['code'] == 0 and len(snapshot['data']) == args.task_count,
+        '过期后立即返回旧数据': rows['过期后读取'][0] < fast and rows['过期后读取'][2] == 'true'
+                          and task_name(rows['过期后读取'][3], record_id) == old_name,
+        '后台刷新后返回新数据': rows['刷新后读取'][2] == 'false'
+                          and task_name(rows['刷新后读取'][3], record_id) == '后台刷新后的名称',
+        '上游不可用时返回快照并标明错误': rows['上游不可用'][1] == 200 and rows['上游不可用'][3]['stale']['error'] is not None,
+        '上游不可用时写操作返回错误': rebuild_status == 500,
+        '冷启动由磁盘快照返回数据': rows['冷启动+上游不可用'][1] == 200
+                              and rows['冷启动+上游不可用'][3]['stale']['source'] == 'snapshot',
+        '冷启动不等待上游': rows['冷启动+上游变慢'][1] == 200 and rows['冷启动+上游变慢'][0] < fast,
+    }
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def bench_history(args):
+    """打卡历史：按日汇总的查询耗时不随历史长度增长（对照扫描用户进度表），并校验去重、连续天数和由进度表导入的结果"""
+    from datetime import date, datetime, timedelta
+
+    from daily_reset import DailyResetScheduler
+    from feishu_api import FeishuAPI
+    from history import HabitHistory, parse_range
+
+    stub = start_stub(task_count=0)
+    Config.RESET_SCHEDULER_ENABLED = False
+    Config.MIRROR_ENABLED = False
+    Config.SLOW_REQUEST_THRESHOLD = 0
+    state_dir = tempfile.mkdtemp()
+    Config.LEDGER_DB_PATH = os.path.join(state_dir, 'star_ledger.db')
+    setup_logging(level='CRITICAL')
+    categories = ['学习任务', '生活任务', '纪律任务']
+    tasks = stub.add_records(Config.TASK_TABLE_ID, [
+        {'任务名称': f'任务{i}', '任务类型': categories[i % 3], '星星数量': str(i % 3 + 1), '任务完成状态': '否'}
+        for i in range(args.tasks_per_day)])
+    progress_table = stub.tables.setdefault(Config.PROGRESS_TABLE_ID, {})
+    sizes = [int(size) for size in args.days.split(',')]
+    rows = []
+    checks = {}
+    try:
+        api = FeishuAPI()
+        scheduler = DailyResetScheduler.from_config(api)
+        today = scheduler.business_date()
+
+        def business_date_of(ms):
+            return scheduler.business_date(datetime.fromtimestamp(ms / 1000, scheduler.tz))
+
+        for size in sizes:
+            # 用户 bench 连续打卡 size 天，每天完成全部任务，进度表中每个任务一行（创建时间为当天中午）
+            progress_table.clear()
+            records = stub.add_records(Config.PROGRESS_TABLE_ID, [
+                {'用户ID': 'bench', '任务ID': task['record_id'], '任务完成状态': '是'}
+                for _ in range(size) for task in tasks])
+            for index, record in enumerate(records):
+                day = date.fromisoformat(today) - timedelta(days=size - 1 - index // len(tasks))
+                noon = datetime(day.year, day.month, day.day, 12, tzinfo=scheduler.tz)
+                stub.meta[record['record_id']]['created_time'] = int(noon.timestamp() * 1000)
+
+            start = time.perf_counter()
+            list(api.iter_records(Config.PROGRESS_TABLE_ID, fields=['用户ID', '任务ID'], automatic_fields=True))
+            scan = time.perf_counter() - start
+            history = HabitHistory(os.path.join(state_dir, f'history-{size}.db'))
+            start = time.perf_counter()
+            read, added = history.backfill(api, business_date_of)
+            backfill = time.perf_counter() - start
+            again = history.backfill(api, business_date_of)[1]
+            start_date, end_date = parse_range(None, None, today, 30, 30)
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                result = history.history('bench', start_date, end_date)
+                streaks = history.streaks('bench', today)
+            query = (time.perf_counter() - start) / args.queries
+            rows.append((size, len(records), scan, backfill, query))
+            checks[f'{size}天: 导入全部打卡且重复导入不重复计数'] = added == len(records) and again == 0
+            checks[f'{size}天: 连续天数'] = streaks['current'] == streaks['longest'] == size and streaks['active_today']
+            checks[f'{size}天: 近30天每天完成全部任务'] = all(
+                item['completed'] == len(tasks) for item in result['days'][-min(size, 30):])
+            history.close()
+
+        # 连续天数和去重：打卡日为 今天-9..-7、今天-5..-1
+        history = HabitHistory(os.path.join(state_dir, 'history-streaks.db'))
+        day = lambda offset: (date.fromisoformat(today) - timedelta(days=offset)).isoformat()
+        done = [dict(task, fields=dict(task['fields'], 任务完成状态='是')) for task in tasks[:3]]
+        for offset in (9, 8, 7, 5, 4, 3, 2, 1):
+            history.record('u1', day(offset), done)
+        before_today = history.streaks('u1', today)
+        history.record('u1', today, done[:2])
+        repeated = history.record('u1', today, done)
+        after_today = history.streaks('u1', today)
+        # 补录较早的一天，两段连续打卡连成一段
+        history.record('u1', day(6), done)
+        merged = history.streaks('u1', today)
+        summary = history.history('u1', *parse_range(day(9), today, today, 30, 30))
+        history.close()
+        checks['今天未打卡时截至昨天的连续天数有效'] = before_today['current'] == 5 and before_today['longest'] == 5
+        checks['今天打卡后连续天数加一'] = after_today['current'] == 6 and after_today['longest'] == 6
+        checks['同一任务同一天只计一次'] = repeated == 1 and summary['days'][-1]['completed'] == 3
+        checks['补录较早的日期后重新计算'] = merged['current'] == merged['longest'] == 10
+        checks['按任务类型汇总星星数'] = sum(item['stars'] for item in summary['categories']) == summary['total']['stars'] \
+            == 10 * sum(int(task['fields']['星星数量']) for task in done)
+
+        # 接口：打卡后查询历史和连续天数
+        from app import create_app
+        with contextlib.redirect_stdout(io.StringIO()):
+            flask_app = create_app()
+            client = flask_app.test_client()
+            headers = {'X-User-ID': 'route-user'}
+            client.post('/api/user/checkin', headers=headers, json={'task_ids': [task['record_id'] for task in tasks[:2]]})
+            history_body = client.get('/api/user/history', headers=headers).get_json()
+            streaks_body = client.get('/api/user/streaks', headers=headers).get_json()
+            invalid = client.get('/api/user/history?from=2024-02-01&to=2024-01-01', headers=headers).status_code
+            flask_app.extensions['feishu_api'].close()
+        checks['接口返回今天的打卡'] = history_body['data']['days'][-1] == {'date': today, 'completed': 2, 'stars': 3}
+        checks['接口返回连续天数'] = streaks_body['data']['current'] == 1 and streaks_body['data']['active_today']
+        checks['日期范围错误返回 400'] = invalid == 400
+        api.close()
+    finally:
+        stub.stop()
+
+    print(f'每天任务数: {args.tasks_per_day}, 查询范围: 近30天, 每档查询次数: {args.queries}')
+    print(f'{"历史天数":>8} {"进度记录":>8} {"扫描进度表(ms)":>14} {"导入(ms)":>9} {"历史+连续天数查询(ms)":>20}')
+    for size, count, scan, backfill, query in rows:
+        print(f'{size:>8} {count:>8} {scan * 1000:>14.1f} {backfill * 1000:>9.1f} {query * 1000:>20.3f}')
+    smallest, largest = rows[0][4], rows[-1][4]
+    checks['查询耗时不随历史长度增长'] = largest < smallest * 3 + 0.0005
+    for name, ok in checks.items():
+        print(f'{name}: {"通过" if ok else "失败"}')
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FeishuAPI 离线性能测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pool = subparsers.add_parser('pool', help='连接池 vs 每次新建连接')
+    pool.add_argument('--requests', type=int, default=500)
+    pool.add_argument('--concurrency', type=int, default=4)
+    pool.set_defaults(func=bench_pool)
+
+    pagination = subparsers.add_parser('pagination', help='大表分页读取的完整性与内存占用')
+    pagination.add_argument('--records', type=int, default=5000)
+    pagination.add_argument('--page-size', type=int, default=500)
+    pagination.set_defaults(func=bench_pagination)
+
+    projection = subparsers.add_parser('projection', help='字段裁剪与服务端筛选的效果')
+    projection.add_argument('--records', type=int, default=2000)
+    projection.add_argument('--rounds', type=int, default=5)
+    projection.set_defaults(func=bench_projection)
+
+    async_parser = subparsers.add_parser('async', help='同步与异步客户端的墙钟耗时')
+    async_parser.add_argument('--latency', type=float, default=0.05)
+    async_parser.add_argument('--rounds', type=int, default=5)
+    async_parser.set_defaults(func=bench_async)
+
+    routes = subparsers.add_parser('routes', help='并发压测业务接口的延迟分位数和上游调用数')
+    routes.add_argument('--scenarios', help='逗号分隔: all-data,checkin,redeem,reset，默认全部')
+    routes.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    routes.add_argument('--concurrency', type=int, default=8)
+    routes.add_argument('--latency', type=float, default=0.02, help='桩服务器每个请求的注入延迟（秒）')
+    routes.add_argument('--error-rate', type=float, default=0, help='桩服务器随机返回限流错误的比例')
+    routes.add_argument('--tasks', help='从 tasks.json 格式的快照导入任务')
+    routes.add_argument('--task-count', type=int, default=9, help='任务表的记录数，快照不足时自动补足')
+    routes.add_argument('--reward-count', type=int, default=5)
+    routes.add_argument('--cache-ttl', type=float, help='覆盖 TABLE_CACHE_TTL，0 表示关闭表缓存')
+    routes.add_argument('--qps', type=float, help='覆盖 FEISHU_QPS 限流配额')
+    routes.set_defaults(func=bench_routes)
+
+    redeem = subparsers.add_parser('redeem', help='并发兑换的幂等性与星星账本一致性')
+    redeem.add_argument('--rewards', type=int, default=20)
+    redeem.add_argument('--tabs', type=int, default=3, help='同时兑换同一个奖励的标签页数（各自使用不同的幂等键）')
+    redeem.add_argument('--clicks', type=int, default=3, help='每个标签页重复提交的次数（使用相同的幂等键）')
+    redeem.add_argument('--users', type=int, default=2, help='标签页依次属于的用户数，检验不同用户同时兑换同一个奖励')
+    redeem.add_argument('--concurrency', type=int, default=16)
+    redeem.add_argument('--balance', type=int, help='初始星星数，默认为全部奖励所需星星的一半')
+    redeem.add_argument('--latency', type=float, default=0.02, help='桩服务器每个请求的注入延迟（秒）')
+    redeem.set_defaults(func=bench_redeem)
+
+    users = subparsers.add_parser('users', help='多用户模式下用户数增加时的延迟和用户之间的隔离')
+    users.add_argument('--users', default='100,1000,5000', help='逗号分隔的用户数档位')
+    users.add_argument('--requests', type=int, default=300, help='每档的请求数（打卡、进度、全部数据随机混合）')
+    users.add_argument('--concurrency', type=int, default=8)
+    users.add_argument('--task-count', type=int, default=30)
+    users.set_defaults(func=bench_users)
+
+    journal = subparsers.add_parser('journal', help='打卡写入日志的延迟与回放的正确性')
+    journal.add_argument('--checkins', type=int, default=200)
+    journal.add_argument('--concurrency', type=int, default=8)
+    journal.add_argument('--latency', type=float, default=0.05, help='桩服务器每个请求的注入延迟（秒）')
+    journal.add_argument('--error-rate', type=float, default=0.3, help='写入日志模式下桩服务器随机返回限流错误的比例')
+    journal.add_argument('--task-count', type=int, default=20)
+    journal.set_defaults(func=bench_journal)
+
+    bulk = subparsers.add_parser('bulk', help='批量导入导出与逐条创建的对比')
+    bulk.add_argument('--records', type=int, default=5000)
+    bulk.add_argument('--sample', type=int, default=50, help='逐条创建的采样条数，用于估算全部记录的耗时')
+    bulk.add_argument('--latency', type=float, default=0.05, help='桩服务器每个请求的注入延迟（秒）')
+    bulk.set_defaults(func=bench_bulk)
+
+    stale = subparsers.add_parser('stale', help='上游变慢或不可用时返回旧快照，冷启动由磁盘快照预热')
+    stale.add_argument('--latency', type=float, default=0.5, help='上游变慢时桩服务器每个请求的注入延迟（秒）')
+    stale.add_argument('--ttl', type=float, default=1, help='TABLE_CACHE_TTL')
+    stale.add_argument('--stale-ttl', type=float, default=60, help='TABLE_CACHE_STALE_TTL')
+    stale.add_argument('--task-count', type=int, default=20)
+    stale.set_defaults(func=bench_stale)
+
+    history = subparsers.add_parser('history', help='打卡历史和连续天数的查询耗时与正确性')
+    history.add_argument('--days', default='30,365,3650', help='逗号分隔的历史天数档位')
+    history.add_argument('--tasks-per-day', type=int, default=5)
+    history.add_argument('--queries', type=int, default=200, help='每档重复查询的次数')
+    history.set_defaults(func=bench_history)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
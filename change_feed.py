@@ -0,0 +1,128 @@
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class ChangeFeed:
+    """进程内的数据变更通知
+
+    写操作成功或镜像同步发现上游变化时发布事件，/api/stream 的每个连接按事件序号读取。
+    最近的 history 条事件保留在内存中，客户端断线重连后可以从上次收到的序号继续；
+    序号已经不在保留范围内时，调用方需要让客户端重新加载全部数据。
+
+    数据版本号和推送的事件ID都由进程标识和事件序号组成（见 version），数据接口的 ?since= 增量查询
+    和断线重连据此合并变更；来自其他进程或重启前进程的版本号无法识别，需要重新加载。
+
+    事件可以只属于某个用户（多用户模式下的任务完成状态和进度），读取时只返回公共事件和该用户的事件。
+    """
+
+    def __init__(self, history=1000):
+        # 进程启动时随机生成，进程重启后旧版本号自然失效
+        self.epoch = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._last_id = 0
+        self.published = 0
+        self.subscribers = 0
+        self.rejected = 0
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, kind, data, user=None):
+        """发布一个事件，返回事件序号；user 不为空时只有该用户能收到"""
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, kind, data, user))
+            self.published += 1
+            self._cond.notify_all()
+            return self._last_id
+
+    def wait(self, after, timeout, user=None):
+        """返回 (游标, 事件列表)：序号大于 after、对 user 可见的事件，没有时最多等待 timeout 秒
+
+        游标是已经检查过的最大序号（包括其他用户的事件），下次从游标继续读取。
+        返回 None 表示 after 之后的部分事件已被丢弃（或 after 来自重启前的进程），无法增量补齐。
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if after > self._last_id or (self._events and after < self._events[0][0] - 1):
+                return None
+            while True:
+                events = [(event_id, kind, data) for event_id, kind, data, owner in self._events
+                          if event_id > after and owner in (None, user)]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return self._last_id, events
+                self._cond.wait(remaining)
+
+    def version(self, event_id=None):
+        """事件序号对应的版本号（默认为当前版本号），客户端在下次请求时通过 ?since= 或 Last-Event-ID 传回"""
+        return f'{self.epoch}-{self._last_id if event_id is None else event_id}'
+
+    def sequence(self, version):
+        """解析版本号中的事件序号；不属于本进程的本次运行时返回 None"""
+        epoch, _, seq = str(version).partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def changes_since(self, version, user=None):
+        """合并 version 之后对 user 可见的各类数据的记录变更
+
+        返回 (当前版本号, {类型: {"records": [...], "removed": [...]}})；
+        版本号无法识别、变更已被丢弃或期间需要整体重新加载时返回 None。
+        """
+        seq = self.sequence(version)
+        if seq is None:
+            return None
+        with self._cond:
+            current = self.version()
+            result = self.wait(seq, timeout=0, user=user)
+        if result is None or any(kind == 'reload' for _, kind, _ in result[1]):
+            return None
+        events = result[1]
+        merged = {}
+        for _, kind, data in events:
+            if 'records' not in data:
+                continue
+            records, removed = merged.setdefault(kind, ({}, set()))
+            for record in data['records']:
+                record_id = record['record_id']
+                removed.discard(record_id)
+                records[record_id] = {**records.get(record_id, {}), **record.get('fields', {})}
+            for record_id in data.get('removed', ()):
+                records.pop(record_id, None)
+                removed.add(record_id)
+        return current, {
+            kind: {
+                'records': [{'record_id': record_id, 'fields': fields} for record_id, fields in records.items()],
+                'removed': sorted(removed)
+            }
+            for kind, (records, removed) in merged.items()
+        }
+
+    def subscribe(self, limit=0):
+        """登记一个推送连接；limit 大于 0 且连接数已达上限时返回 False"""
+        with self._cond:
+            if limit and self.subscribers >= limit:
+                self.rejected += 1
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'last_id': self._last_id,
+                'published': self.published,
+                'buffered': len(self._events),
+                'subscribers': self.subscribers,
+                'rejected': self.rejected
+            }
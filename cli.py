@@ -0,0 +1,250 @@
+"""任务和奖励的批量导入导出
+
+按自然键（任务名称 / 奖励名称）比对文件与数据表：表中没有的记录批量创建，字段不同的记录批量更新，
+重复执行不会产生重复记录。各批次并发提交，--dry-run 只输出差异不写入。
+
+用法:
+    python cli.py seed [--dry-run]                         导入内置的默认任务和奖励，只创建表中缺少的
+    python cli.py sync tasks tasks.json [--dry-run]        把文件中的任务同步到任务表（JSON 或 CSV）
+    python cli.py sync rewards rewards.csv [--dry-run]
+    python cli.py export tasks -o tasks.json               流式导出为 tasks.json 快照格式（-o - 输出到标准输出）
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import textwrap
+import time
+
+from config import Config
+from log_setup import setup_logging
+from serializers import text_value
+
+# 内置的默认任务
+DEFAULT_TASKS = [
+    # 学习任务
+    {"任务名称": "完成每日作业", "任务描述": "认真完成老师布置的所有作业", "任务类型": "学习任务", "星星数量": 3},
+    {"任务名称": "阅读课外书", "任务描述": "每天阅读30分钟课外书", "任务类型": "学习任务", "星星数量": 2},
+    {"任务名称": "复习今日课程", "任务描述": "复习今天学习的知识点", "任务类型": "学习任务", "星星数量": 2},
+    # 生活任务
+    {"任务名称": "整理房间", "任务描述": "整理床铺、书桌和玩具", "任务类型": "生活任务", "星星数量": 2},
+    {"任务名称": "刷牙洗脸", "任务描述": "早晚按时刷牙洗脸", "任务类型": "生活任务", "星星数量": 1},
+    {"任务名称": "收拾书包", "任务描述": "检查明天需要的课本和文具", "任务类型": "生活任务", "星星数量": 1},
+    # 纪律任务
+    {"任务名称": "按时起床", "任务描述": "每天按时起床，不赖床", "任务类型": "纪律任务", "星星数量": 2},
+    {"任务名称": "遵守课堂纪律", "任务描述": "上课认真听讲，不交头接耳", "任务类型": "纪律任务", "星星数量": 2},
+    {"任务名称": "按时就寝", "任务描述": "晚上按时睡觉，保证充足睡眠", "任务类型": "纪律任务", "星星数量": 2},
+]
+
+# 内置的默认奖励
+DEFAULT_REWARDS = [
+    # 娱乐奖励
+    {"奖励名称": "看一集喜欢的动画片", "所需星星数": 5, "奖励描述": "可以观看一集自己喜欢的动画片", "是否已兑换": "否"},
+    {"奖励名称": "玩手机游戏", "所需星星数": 8, "奖励描述": "可以玩一会儿手机游戏", "是否已兑换": "否"},
+    # 户外活动
+    {"奖励名称": "去公园玩", "所需星星数": 10, "奖励描述": "可以去公园玩耍和运动", "是否已兑换": "否"},
+    {"奖励名称": "骑自行车", "所需星星数": 8, "奖励描述": "可以骑自行车出去玩", "是否已兑换": "否"},
+    # 特殊奖励
+    {"奖励名称": "购买新玩具", "所需星星数": 30, "奖励描述": "可以购买一个心仪的新玩具", "是否已兑换": "否"},
+    {"奖励名称": "去游乐园", "所需星星数": 50, "奖励描述": "可以去游乐园玩一天", "是否已兑换": "否"},
+]
+
+# 数据表 -> (Config 中的数据表ID配置项, 自然键字段)；进度表没有自然键，只能导出
+TABLES = {
+    'tasks': ('TASK_TABLE_ID', '任务名称'),
+    'rewards': ('REWARD_TABLE_ID', '奖励名称'),
+    'progress': ('PROGRESS_TABLE_ID', None),
+}
+
+# 由飞书自动生成、不能写入的字段（导出的快照中会包含这些字段）
+READONLY_FIELDS = ('任务ID', '奖励ID', '创建时间', '最后更新时间')
+
+# 使用过程中变化的状态字段，同步时默认不覆盖表中的值（新建记录时照常写入）
+STATE_FIELDS = ('任务完成状态', '已完成', '是否已兑换')
+
+
+def plain(value):
+    """把飞书文本字段可能返回的富文本片段列表转换为字符串，用于比较"""
+    if isinstance(value, list) and all(isinstance(item, dict) and 'text' in item for item in value):
+        return text_value(value)
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        # 数字与数字字符串视为相同，避免 3 和 "3" 反复更新
+        return str(int(value)) if float(value).is_integer() else str(value)
+    return value
+
+
+def load_records(path):
+    """读取 JSON（tasks.json 快照、记录列表或字段字典列表）或 CSV（首行为字段名）文件，返回字段字典列表"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            return [{name: value for name, value in row.items() if name and value not in (None, '')}
+                    for row in csv.DictReader(f)]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    records = data.get('data', []) if isinstance(data, dict) else data
+    # 快照中的 data 可能是分页接口的 {"items": [...]} 结构
+    if isinstance(records, dict):
+        records = records.get('items', [])
+    return [record.get('fields', record) for record in records]
+
+
+def plan_changes(existing, incoming, key, create_only=False, include_state=False):
+    """比对表中的记录与导入的字段，返回需要创建、更新的记录和统计"""
+    current = {}
+    duplicates = {}
+    for record in existing:
+        name = plain(record.get('fields', {}).get(key))
+        if name in current:
+            duplicates.setdefault(name, [current[name]['record_id']]).append(record['record_id'])
+            continue
+        current[name] = record
+
+    wanted = {}
+    invalid = 0
+    for fields in incoming:
+        fields = {name: value for name, value in fields.items() if name not in READONLY_FIELDS}
+        name = plain(fields.get(key))
+        if not name:
+            invalid += 1
+            continue
+        # 同一个键出现多次时以最后一条为准
+        wanted[name] = fields
+
+    plan = {'create': [], 'update': [], 'unchanged': 0, 'duplicates': duplicates, 'invalid': invalid}
+    for name, fields in wanted.items():
+        record = current.get(name)
+        if record is None:
+            plan['create'].append(fields)
+            continue
+        if create_only:
+            plan['unchanged'] += 1
+            continue
+        old = record.get('fields', {})
+        changes = {field: (old.get(field), value) for field, value in fields.items()
+                   if (include_state or field not in STATE_FIELDS) and plain(old.get(field)) != plain(value)}
+        if changes:
+            plan['update'].append({'record_id': record['record_id'], 'key': name,
+                                   'fields': {field: new for field, (_, new) in changes.items()}, 'changes': changes})
+        else:
+            plan['unchanged'] += 1
+    return plan
+
+
+def print_plan(table, key, plan, limit=20):
+    print(f'{table}: 新增 {len(plan["create"])} 条, 更新 {len(plan["update"])} 条, 不变 {plan["unchanged"]} 条'
+          + (f', 缺少{key}而跳过 {plan["invalid"]} 条' if plan['invalid'] else ''))
+    for fields in plan['create'][:limit]:
+        print(f'  + {fields[key]}')
+    for update in plan['update'][:limit]:
+        changes = ', '.join(f'{field}: {old!r} -> {new!r}' for field, (old, new) in update['changes'].items())
+        print(f'  ~ {update["key"]} ({changes})')
+    hidden = max(len(plan['create']) - limit, 0) + max(len(plan['update']) - limit, 0)
+    if hidden:
+        print(f'  ... 另有 {hidden} 条')
+    for name, record_ids in plan['duplicates'].items():
+        print(f'  ! 表中有 {len(record_ids)} 条同名记录 "{name}"，只更新第一条: {", ".join(record_ids)}')
+
+
+async def apply_plan(async_api, table_id, plan):
+    """并发提交创建和更新，返回 {'created': 条数, 'updated': 条数, 'errors': [...]}"""
+    created, updated = await asyncio.gather(
+        async_api.batch_create_records(table_id, plan['create']),
+        async_api.batch_update_records(table_id, [
+            {'record_id': update['record_id'], 'fields': update['fields']} for update in plan['update']]))
+    return {
+        'created': len(created['records']),
+        'updated': len(updated['records']),
+        'errors': created['errors'] + updated['errors']
+    }
+
+
+async def upsert(async_api, table, incoming, dry_run=False, create_only=False, include_state=False):
+    """把 incoming 按自然键同步到数据表，返回执行结果（dry_run 时为 None）"""
+    config_name, key = TABLES[table]
+    table_id = getattr(Config, config_name)
+    # 在工作线程中一次读完，不必每条记录切换一次线程
+    records = await async_api._call(list, async_api.api.iter_records(table_id))
+    plan = plan_changes(records, incoming, key, create_only=create_only, include_state=include_state)
+    print_plan(table, key, plan)
+    if dry_run or not (plan['create'] or plan['update']):
+        return None
+    result = await apply_plan(async_api, table_id, plan)
+    print(f'{table}: 已创建 {result["created"]} 条, 已更新 {result["updated"]} 条, 失败 {len(result["errors"])} 条')
+    for error in result['errors'][:5]:
+        print(f'  失败: {error.get("record_id") or error["fields"].get(key)} - {error["error"]}')
+    return result
+
+
+def export_table(api, table_id, output):
+    """把数据表逐条写成 tasks.json 快照格式（{"code": 0, "data": [记录...]}），返回记录数
+
+    记录边读边写，内存占用与表的大小无关；输出到文件时先写临时文件，完成后再替换。
+    """
+    target = sys.stdout if output == '-' else open(f'{output}.tmp', 'w', encoding='utf-8')
+    count = 0
+    try:
+        target.write('{\n  "code": 0,\n  "data": [')
+        for record in api.iter_records(table_id):
+            target.write(',' if count else '')
+            target.write('\n' + textwrap.indent(json.dumps(record, indent=2), '    '))
+            count += 1
+        target.write('\n  ]\n}\n' if count else ']\n}\n')
+    finally:
+        if target is not sys.stdout:
+            target.close()
+    if target is not sys.stdout:
+        os.replace(f'{output}.tmp', output)
+    return count
+
+
+def main():
+    from async_feishu_api import AsyncFeishuAPI
+
+    parser = argparse.ArgumentParser(description='任务和奖励的批量导入导出')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    seed = subparsers.add_parser('seed', help='导入内置的默认任务和奖励，只创建表中缺少的')
+    seed.add_argument('--dry-run', action='store_true', help='只输出差异，不写入')
+    sync = subparsers.add_parser('sync', help='按名称把文件中的记录新增或更新到数据表')
+    sync.add_argument('table', choices=['tasks', 'rewards'])
+    sync.add_argument('path', help='JSON（tasks.json 快照或记录列表）或 CSV 文件')
+    sync.add_argument('--dry-run', action='store_true', help='只输出差异，不写入')
+    sync.add_argument('--include-state', action='store_true', help='同时覆盖任务完成状态、是否已兑换等状态字段')
+    export = subparsers.add_parser('export', help='流式导出为 tasks.json 快照格式')
+    export.add_argument('table', choices=list(TABLES))
+    export.add_argument('-o', '--output', default='-', help='输出文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    # 导出到标准输出时日志不能混入输出内容，日志写到标准错误
+    setup_logging(stream=sys.stderr)
+    Config.validate_config()
+    async_api = AsyncFeishuAPI()
+    start = time.perf_counter()
+    try:
+        if args.command == 'export':
+            count = export_table(async_api.api, getattr(Config, TABLES[args.table][0]), args.output)
+            print(f'已导出 {count} 条记录，耗时 {time.perf_counter() - start:.2f} 秒', file=sys.stderr)
+            return
+
+        async def run():
+            if args.command == 'seed':
+                return await asyncio.gather(
+                    upsert(async_api, 'tasks', [dict(fields, 任务完成状态='否') for fields in DEFAULT_TASKS],
+                           dry_run=args.dry_run, create_only=True),
+                    upsert(async_api, 'rewards', DEFAULT_REWARDS, dry_run=args.dry_run, create_only=True))
+            return [await upsert(async_api, args.table, load_records(args.path), dry_run=args.dry_run,
+                                 include_state=args.include_state)]
+
+        results = asyncio.run(run())
+        print(f'耗时 {time.perf_counter() - start:.2f} 秒')
+        if any(result and result['errors'] for result in results):
+            raise SystemExit(1)
+    finally:
+        async_api.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""响应压缩
+
+根据请求的 Accept-Encoding 压缩JSON和文本响应：客户端支持且安装了 brotli 时优先使用 br，否则使用 gzip。
+流式响应（变更推送）和 send_file 返回的静态文件不压缩。
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/html', 'text/css', 'text/plain')
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress_response(response, accept_encodings, min_size=1024, level=6):
+    """按客户端支持的编码压缩响应，返回同一个响应对象"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    if encoding == 'br':
+        # 5级在压缩率和CPU耗时之间比较均衡，适合每次请求实时压缩
+        body = brotli.compress(body, quality=5)
+    else:
+        body = gzip.compress(body, compresslevel=level, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的字节与原始内容不同，ETag 改为弱校验，条件请求仍按内容匹配
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
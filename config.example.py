@@ -1,31 +1,133 @@
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 class Config:
     # 飞书应用配置
     FEISHU_APP_ID = os.getenv('FEISHU_APP_ID')  # 在此填入你的飞书应用ID
     FEISHU_APP_SECRET = os.getenv('FEISHU_APP_SECRET')  # 在此填入你的飞书应用密钥
     
+    # Web应用配置
+    SECRET_KEY = os.getenv('SECRET_KEY')  # session签名密钥，多进程部署时必须设置为固定值
+    DEBUG = os.getenv('DEBUG', 'false').lower() in ('1', 'true', 'yes')  # 仅用于 python app.py 启动的开发服务器
+    # 多个工作进程共享状态（访问令牌、表缓存版本号、锁文件）的目录，为空时只在进程内共享
+    SHARED_STATE_DIR = os.getenv('SHARED_STATE_DIR', '')
+    
     # 多维表格配置
     BASE_ID = os.getenv('BASE_ID')  # 在此填入你的多维表格ID
     TASK_TABLE_ID = os.getenv('TASK_TABLE_ID')  # 在此填入你的任务表ID
     REWARD_TABLE_ID = os.getenv('REWARD_TABLE_ID')  # 在此填入你的奖励表ID
     PROGRESS_TABLE_ID = os.getenv('PROGRESS_TABLE_ID')  # 在此填入你的用户进度表ID
     
+    # 访问令牌配置
+    TOKEN_REFRESH_AHEAD = float(os.getenv('TOKEN_REFRESH_AHEAD', '1500'))  # 剩余有效期少于该值时提前在后台刷新（秒）
+    TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', '')  # 多进程部署时共享令牌的缓存文件，为空时使用 SHARED_STATE_DIR 下的文件
+    
+    # 多用户模式：任务完成状态按用户（请求头 X-User-ID）保存在本地SQLite中，不再使用任务表的全局完成状态列
+    MULTI_USER_ENABLED = os.getenv('MULTI_USER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    USER_STATE_DB_PATH = os.getenv('USER_STATE_DB_PATH', '')  # 为空时使用 SHARED_STATE_DIR 下的 user_state.db
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))  # 内存中缓存完成状态的最大用户数
+    
+    # 打卡写入日志：打卡先写入本地SQLite日志后立即返回，由后台线程批量回放到飞书
+    JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    JOURNAL_DB_PATH = os.getenv('JOURNAL_DB_PATH', '')  # 为空时使用 SHARED_STATE_DIR 下的 write_journal.db
+    JOURNAL_FLUSH_INTERVAL = float(os.getenv('JOURNAL_FLUSH_INTERVAL', '5'))  # 没有新打卡时检查待回放条目的间隔，也是重试退避的基数（秒）
+    JOURNAL_BATCH_WINDOW = float(os.getenv('JOURNAL_BATCH_WINDOW', '0.2'))  # 收到打卡后等待合并批次的时间（秒）
+    JOURNAL_MAX_ATTEMPTS = int(os.getenv('JOURNAL_MAX_ATTEMPTS', '10'))  # 超过该次数仍失败的条目标记为 failed
+    
+    # 星星收支账本（SQLite），为空时使用 SHARED_STATE_DIR 下的 star_ledger.db，未配置共享目录时使用当前目录
+    LEDGER_DB_PATH = os.getenv('LEDGER_DB_PATH', '')
+    
+    # 打卡历史的按日汇总（SQLite），为空时使用 SHARED_STATE_DIR 下的 history.db，未配置共享目录时使用当前目录
+    HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', '')
+    HISTORY_DEFAULT_DAYS = int(os.getenv('HISTORY_DEFAULT_DAYS', '30'))  # /api/user/history 未指定起始日期时返回的天数
+    HISTORY_MAX_DAYS = int(os.getenv('HISTORY_MAX_DAYS', '366'))  # 单次查询的最大天数
+    
+    # 飞书开放接口地址（可指向本地桩服务器进行离线测试）
+    FEISHU_API_BASE = os.getenv('FEISHU_API_BASE', 'https://open.feishu.cn/open-apis')
+    
+    # HTTP连接池配置
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))  # 每个主机保留的keep-alive连接数
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3'))  # 建立连接超时（秒）
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))  # 读取响应超时（秒）
+    
+    # 请求调度：限流、重试与熔断
+    FEISHU_QPS = float(os.getenv('FEISHU_QPS', '20'))  # 应用的QPS配额
+    FEISHU_BURST = int(os.getenv('FEISHU_BURST', '20'))  # 令牌桶容量，允许的瞬时突发请求数
+    FEISHU_MAX_RETRIES = int(os.getenv('FEISHU_MAX_RETRIES', '3'))  # 限流/5xx/网络错误的最大重试次数
+    FEISHU_BACKOFF_BASE = float(os.getenv('FEISHU_BACKOFF_BASE', '0.5'))  # 首次重试的退避时间（秒）
+    FEISHU_BACKOFF_MAX = float(os.getenv('FEISHU_BACKOFF_MAX', '8'))  # 单次退避的上限（秒）
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # 连续失败多少次后熔断
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))  # 熔断后多久放行探测请求（秒）
+    
+    # 任务表/奖励表快照缓存的有效期（秒）
+    TABLE_CACHE_TTL = float(os.getenv('TABLE_CACHE_TTL', '30'))
+    # 过期后不超过该时间（秒）的快照直接返回，同时在后台刷新；0 表示过期后等待重新加载
+    TABLE_CACHE_STALE_TTL = float(os.getenv('TABLE_CACHE_STALE_TTL', '300'))
+    # 把最后一次成功加载的任务表/奖励表保存为 tasks.json 格式的快照，启动时预热缓存，飞书不可用时返回快照
+    SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '')  # 为空时使用 SHARED_STATE_DIR 下的 snapshots 目录，未配置共享目录时使用当前目录
+    
+    # 分页读取记录时预取下一页的后台线程数
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '4'))
+    
+    # 异步客户端并发调用上游接口的线程数
+    ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', '16'))
+    
+    # 处理时间超过该值的请求输出每次上游调用的明细（秒），0 表示关闭慢请求日志
+    SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', '1'))
+    
+    # /api/stream 没有变更时发送心跳的间隔（秒）
+    STREAM_HEARTBEAT_INTERVAL = float(os.getenv('STREAM_HEARTBEAT_INTERVAL', '15'))
+    # 每个工作进程同时保持的推送连接数上限（0 表示不限制）；每个连接占用一个请求线程，应小于 WEB_THREADS
+    STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', '4'))
+    # 连接数已满时浏览器重新连接的等待时间（秒）
+    STREAM_BUSY_RETRY = float(os.getenv('STREAM_BUSY_RETRY', '60'))
+    
+    # 响应压缩：小于该大小（字节）的响应不压缩，gzip 压缩级别 1-9
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+    
+    # 静态资源：源文件目录和 python static_assets.py build 的输出目录（相对于项目目录）
+    STATIC_DIR = os.getenv('STATIC_DIR', 'static')
+    ASSET_BUILD_DIR = os.getenv('ASSET_BUILD_DIR', 'static/dist')
+    ASSET_MAX_AGE = int(os.getenv('ASSET_MAX_AGE', str(365 * 86400)))  # 带哈希的资源的缓存时间（秒）
+    
+    # 日志配置
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG 时输出每个请求和上游调用的过程日志
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text 或 json（每行一个JSON对象，便于日志系统采集）
+    
+    # 每日重置任务状态
+    RESET_SCHEDULER_ENABLED = os.getenv('RESET_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')  # 由独立进程 daily_reset.py 负责时设为false
+    RESET_TIME = os.getenv('RESET_TIME', '00:00')  # 每天重置的本地时间
+    RESET_TIMEZONE = os.getenv('RESET_TIMEZONE', 'Asia/Shanghai')
+    RESET_DATE_FILE = os.getenv('RESET_DATE_FILE', 'last_reset_date.txt')  # 记录上次重置日期的文件
+    
+    # 本地SQLite镜像配置（可选）
+    MIRROR_ENABLED = os.getenv('MIRROR_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    MIRROR_DB_PATH = os.getenv('MIRROR_DB_PATH', 'mirror.db')
+    MIRROR_SYNC_INTERVAL = float(os.getenv('MIRROR_SYNC_INTERVAL', '10'))  # 增量同步间隔（秒）
+    MIRROR_MAX_STALENESS = float(os.getenv('MIRROR_MAX_STALENESS', '60'))  # 超过该时间未同步则回退到飞书（秒）
+    MIRROR_FULL_SYNC_INTERVAL = float(os.getenv('MIRROR_FULL_SYNC_INTERVAL', '3600'))  # 全量同步间隔，用于清理已删除的记录（秒）
+    # 数据表中"最后更新时间"类型字段的名称，按它只拉取变更的记录；数据表中没有该字段时自动改为全量同步，设为空则总是全量同步
+    MIRROR_MODIFIED_FIELD = os.getenv('MIRROR_MODIFIED_FIELD', '最后更新时间')
+    
     @staticmethod
     def validate_config():
         """验证配置是否完整"""
-        print('开始验证配置...')
+        logger.debug('开始验证配置')
         required_vars = ['FEISHU_APP_ID', 'FEISHU_APP_SECRET', 'BASE_ID', 
                         'TASK_TABLE_ID', 'REWARD_TABLE_ID', 'PROGRESS_TABLE_ID']
         for var in required_vars:
             value = getattr(Config, var)
-            print(f'检查配置 {var}: {"已设置" if value else "未设置"}')
+            logger.debug('检查配置 %s: %s', var, '已设置' if value else '未设置')
         
         missing_vars = [var for var in required_vars if not getattr(Config, var)]
         
         if missing_vars:
             error_msg = f'缺少必要的环境变量: {", ".join(missing_vars)}'
-            print(f'配置验证失败: {error_msg}')
+            logger.error('配置验证失败: %s', error_msg)
             raise ValueError(error_msg)
         
-        print('配置验证完成')
\ No newline at end of file
+        logger.debug('配置验证完成')
\ No newline at end of file
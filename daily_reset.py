@@ -0,0 +1,140 @@
+"""每日任务状态重置
+
+在配置的本地时间（默认零点）把所有任务的完成状态重置为"否"。
+可以随应用进程在后台线程中运行，也可以作为独立的工作进程运行:
+    python daily_reset.py          持续运行，每天定时重置
+    python daily_reset.py --once   如果今天还没有重置则立即重置一次后退出
+多个进程同时运行时通过文件锁互斥，同一天只会重置一次。
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8 及以下
+    from pytz import timezone as ZoneInfo
+
+from config import Config
+from file_lock import FileLock, write_atomic
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+class DailyResetScheduler:
+    """按本地时间每天执行一次任务重置"""
+
+    # 两次检查之间的最长等待时间（秒），防止系统休眠或时钟调整后错过重置
+    MAX_SLEEP = 300
+
+    def __init__(self, api, reset_time, timezone, date_file):
+        self.api = api
+        hour, minute = (int(part) for part in reset_time.split(':'))
+        self.reset_offset = timedelta(hours=hour, minutes=minute)
+        self.tz = ZoneInfo(timezone)
+        self.date_file = date_file
+        self.lock_path = f'{date_file}.lock'
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_result = None
+
+    @classmethod
+    def from_config(cls, api):
+        return cls(api, Config.RESET_TIME, Config.RESET_TIMEZONE, Config.RESET_DATE_FILE)
+
+    def business_date(self, now=None):
+        """当前所属的"任务日"：重置时间之前仍算作前一天"""
+        now = now or datetime.now(self.tz)
+        return (now - self.reset_offset).strftime('%Y-%m-%d')
+
+    def seconds_until_next_reset(self, now=None):
+        now = now or datetime.now(self.tz)
+        next_day = datetime.strptime(self.business_date(now), '%Y-%m-%d') + timedelta(days=1)
+        target = now.replace(year=next_day.year, month=next_day.month, day=next_day.day,
+                             hour=0, minute=0, second=0, microsecond=0) + self.reset_offset
+        return max((target - now).total_seconds(), 0)
+
+    def get_last_reset_date(self):
+        """从文件中获取上次重置日期"""
+        try:
+            if os.path.exists(self.date_file):
+                with open(self.date_file, 'r') as f:
+                    return f.read().strip()
+            return None
+        except Exception as e:
+            logger.warning('读取上次重置日期失败: %s', e)
+            return None
+
+    def run_if_due(self):
+        """今天还没有重置时执行重置，返回重置的任务数；已经重置过则返回 None"""
+        today = self.business_date()
+        # 在文件锁内检查并更新重置日期，多个进程不会重复重置
+        with FileLock(self.lock_path):
+            last_reset_date = self.get_last_reset_date()
+            if last_reset_date == today:
+                return None
+            logger.info('检测到新的一天，上次重置日期: %s, 当前日期: %s', last_reset_date, today)
+            reset_count = self.api.reset_tasks_status()
+            write_atomic(self.date_file, today)
+            logger.info('已重置 %d 个任务的状态，已保存重置日期: %s', reset_count, today)
+            self.last_result = {'date': today, 'reset_count': reset_count,
+                                'finished_at': datetime.now(self.tz).isoformat()}
+            return reset_count
+
+    def start(self):
+        """启动后台线程：启动时补做当天的重置，之后每天定时重置"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='daily-reset', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_if_due()
+            except Exception as e:
+                logger.error('重置任务状态失败: %s', e)
+                self._stop.wait(60)
+                continue
+            self._stop.wait(min(self.seconds_until_next_reset(), self.MAX_SLEEP))
+
+    def status(self):
+        return {
+            'last_reset_date': self.get_last_reset_date(),
+            'business_date': self.business_date(),
+            'next_reset_in': round(self.seconds_until_next_reset()),
+            'last_result': self.last_result
+        }
+
+
+def main():
+    from feishu_api import FeishuAPI
+
+    parser = argparse.ArgumentParser(description='每日任务状态重置')
+    parser.add_argument('--once', action='store_true', help='如果今天还没有重置则立即重置一次后退出')
+    args = parser.parse_args()
+
+    setup_logging()
+    Config.validate_config()
+    scheduler = DailyResetScheduler.from_config(FeishuAPI())
+    if args.once:
+        result = scheduler.run_if_due()
+        print('今天已经重置过' if result is None else f'已重置 {result} 个任务')
+        return
+    logger.info('每日重置进程已启动，重置时间 %s (%s)', Config.RESET_TIME, Config.RESET_TIMEZONE)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+if __name__ == '__main__':
+    main()
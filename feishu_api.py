@@ -1,342 +1,1022 @@
 import os
+import contextvars
+import logging
+import random
+import threading
+import time
+import uuid
 import requests
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from datetime import datetime
 from config import Config
+from table_cache import SharedGenerations, TableCache, TableSnapshots
+from token_manager import TenantTokenManager
+from tracing import Tracer
+from change_feed import ChangeFeed
+from progress import ProgressAggregator, is_completed, star_count, summarize
+from ledger import StarLedger
+from history import HabitHistory
+
+logger = logging.getLogger(__name__)
+
+def build_filter(*conditions, conjunction="and"):
+    """构造查询接口的筛选条件
+
+    每个条件为 (字段名, 运算符, 值) 三元组，例如 ('任务完成状态', 'is', '是')；
+    运算符取值见飞书文档（is、isNot、contains、isGreater、isLess、isEmpty 等）。
+    """
+    return {
+        "conjunction": conjunction,
+        "conditions": [
+            {
+                "field_name": field_name,
+                "operator": operator,
+                "value": [] if value is None else [str(v) for v in (value if isinstance(value, (list, tuple)) else [value])]
+            }
+            for field_name, operator, value in conditions
+        ]
+    }
+
+
+# 任务表中表示完成状态的字段
+COMPLETION_FIELDS = ('任务完成状态', '已完成')
+
+# 已打卡任务的筛选条件
+COMPLETED_FILTER = build_filter(('任务完成状态', 'is', '是'))
+
+
+def checkin_key(user_id, business_date, task_id):
+    """一次打卡在星星账本中的幂等键：同一用户的同一任务在同一个任务日只计一次"""
+    return f'checkin:{user_id}:{business_date}:{task_id}'
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发送到飞书"""
+
+
+class RequestScheduler:
+    """飞书请求调度器
+
+    - 令牌桶限流：按应用的QPS配额发放请求许可，超出时在本地排队等待
+    - 重试：遇到限流、5xx和网络错误时按带随机抖动的指数退避重试
+    - 熔断：连续失败达到阈值后打开熔断器，冷却期内直接拒绝请求，冷却结束后放行一个探测请求
+    """
+
+    # 飞书表示限流或服务暂时不可用的错误码
+    RETRYABLE_CODES = {
+        99991400,  # 应用请求频率超限
+        1254290,   # 多维表格请求过于频繁
+        1254291,   # 多维表格写冲突
+        1254607,   # 数据未就绪
+        1255040,   # 请求超时
+    }
+
+    def __init__(self, qps, burst, max_retries, backoff_base, backoff_max,
+                 failure_threshold, reset_timeout):
+        self.qps = qps
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        # 熔断器状态: closed / open / half_open
+        self._state = 'closed'
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._probing = False
+        # 统计指标
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.throttle_wait = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.breaker_opens = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(Config.FEISHU_QPS, Config.FEISHU_BURST, Config.FEISHU_MAX_RETRIES,
+                   Config.FEISHU_BACKOFF_BASE, Config.FEISHU_BACKOFF_MAX,
+                   Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_TIMEOUT)
+
+    def execute(self, send):
+        """执行一次上游调用
+
+        send() 发送请求并返回 (HTTP状态码, 响应JSON, 响应头)。
+        可重试的失败在重试次数用完后原样返回最后一次响应，由调用方按错误码处理；
+        网络错误在重试次数用完后抛出。
+        """
+        self._before_request()
+        attempt = 0
+        while True:
+            self._acquire()
+            error = None
+            try:
+                status, response_data, headers = send()
+                retryable = status == 429 or status >= 500 or response_data.get("code") in self.RETRYABLE_CODES
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, headers, retryable = e, {}, True
+            except Exception:
+                # 非网络类异常不计入熔断，但要释放半开状态下的探测名额
+                with self._lock:
+                    self._probing = False
+                raise
+            
+            if not retryable:
+                self._record_success()
+                return status, response_data, headers
+            
+            self._record_failure()
+            if attempt >= self.max_retries or self._state == 'open':
+                if error:
+                    raise error
+                return status, response_data, headers
+            
+            time.sleep(self._backoff(attempt, headers))
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+
+    def _backoff(self, attempt, headers):
+        """计算第 attempt 次重试前的等待时间，优先遵循飞书返回的限流重置时间"""
+        reset = headers.get('x-ogw-ratelimit-reset') if headers else None
+        if reset:
+            try:
+                return min(float(reset), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def _acquire(self):
+        """从令牌桶获取一个请求许可，没有可用许可时排队等待"""
+        start = time.monotonic()
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.qps)
+                    self._refilled_at = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.qps
+                time.sleep(wait)
+        finally:
+            waited = time.monotonic() - start
+            with self._lock:
+                self.queue_depth -= 1
+                self.requests += 1
+                if waited > 0.001:
+                    self.throttled += 1
+                    self.throttle_wait += waited
+
+    def _before_request(self):
+        """熔断器打开时拒绝请求；冷却结束后只放行一个探测请求"""
+        with self._lock:
+            if self._state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError('飞书服务暂时不可用，请稍后重试')
+                self._state = 'half_open'
+                self._probing = False
+            if self._state == 'half_open':
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError('飞书服务正在恢复中，请稍后重试')
+                self._probing = True
+
+    def _record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._state = 'closed'
+            self._probing = False
+
+    def _record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if self._state == 'half_open' or self._consecutive_failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self.breaker_opens += 1
+                    logger.warning('飞书请求连续失败 %d 次，熔断器打开', self._consecutive_failures)
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'qps': self.qps,
+                'requests': self.requests,
+                'failures': self.failures,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+                'throttle_wait_seconds': round(self.throttle_wait, 3),
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'breaker_state': self._state,
+                'breaker_opens': self.breaker_opens
+            }
+
 
 class FeishuAPI:
+    # 多维表格批量接口单次最多处理的记录数
+    BATCH_RECORD_LIMIT = 1000
+    # 记录列表接口单页最多返回的记录数
+    PAGE_SIZE_LIMIT = 500
+    # 表示访问令牌无效或缺失的错误码，收到后强制刷新令牌并重试一次
+    TOKEN_INVALID_CODES = {99991661, 99991663}
+    # 一次变更涉及的记录超过该数量时，只通知客户端重新加载，不推送记录明细
+    CHANGE_DETAIL_LIMIT = 200
+    
     def __init__(self):
         self.app_id = Config.FEISHU_APP_ID
         self.app_secret = Config.FEISHU_APP_SECRET
         self.base_id = Config.BASE_ID
         self.table_id = Config.TASK_TABLE_ID
         self.progress_table_id = Config.PROGRESS_TABLE_ID
-        self.access_token = None
-        self.token_expires_at = None
-        print(f'FeishuAPI初始化完成，使用BASE_ID: {self.base_id}, TASK_TABLE_ID: {self.table_id}, PROGRESS_TABLE_ID: {self.progress_table_id}')
+        # 访问令牌：单飞刷新、提前刷新，可通过磁盘文件在多个进程间共享
+        shared_dir = Config.SHARED_STATE_DIR
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        token_cache_path = Config.TOKEN_CACHE_PATH or (
+            os.path.join(shared_dir, 'feishu_token.json') if shared_dir else '')
+        self.token_manager = TenantTokenManager(self._fetch_access_token, Config.TOKEN_REFRESH_AHEAD,
+                                                token_cache_path)
+        # 所有接口共享同一个带连接池的会话，复用与飞书之间的TCP/TLS连接
+        self.api_base = Config.FEISHU_API_BASE.rstrip('/')
+        self.timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        self.session = self._create_session(Config.HTTP_POOL_SIZE)
+        # 所有上游请求经过统一的限流、重试和熔断
+        self.scheduler = RequestScheduler.from_config()
+        # 记录每一次上游调用的耗时和响应大小，并归属到发起它的入站请求
+        self.tracer = Tracer.from_config()
+        # 任务表和奖励表快照的读穿缓存
+        # 多进程部署时通过共享的版本号让其他进程写入后本进程的缓存失效
+        snapshots = TableSnapshots(Config.SNAPSHOT_DIR or os.path.join(shared_dir or '.', 'snapshots')) \
+            if Config.SNAPSHOT_ENABLED else None
+        self.cache = TableCache(Config.TABLE_CACHE_TTL,
+                                SharedGenerations(os.path.join(shared_dir, 'cache')) if shared_dir else None,
+                                stale_ttl=Config.TABLE_CACHE_STALE_TTL, snapshots=snapshots)
+        # 由上次保存的快照预热，冷启动时不必等待第一次上游请求；飞书不可用时也能返回旧数据
+        self.cache.preload([self.table_id, Config.REWARD_TABLE_ID])
+        # 写操作和镜像同步发现的变更，推送给 /api/stream 的订阅者
+        self.changes = ChangeFeed()
+        # 进度汇总，随任务表缓存的加载和写入增量更新
+        self.progress = ProgressAggregator()
+        # 服务器端的星星收支账本，多进程部署时放在共享目录中
+        self.ledger = StarLedger(Config.LEDGER_DB_PATH or (
+            os.path.join(shared_dir, 'star_ledger.db') if shared_dir else 'star_ledger.db'))
+        # 按用户、按任务日的打卡汇总，供历史和连续天数查询
+        self.history = HabitHistory.from_config()
+        # 可选的本地SQLite镜像，由 attach_mirror 设置
+        self.mirror = None
+        # 多用户模式下按用户保存的任务完成状态，由 attach_user_state 设置
+        self.user_state = None
+        # 可选的打卡写入日志（write-behind），由 attach_journal 设置
+        self.journal = None
+        # 分页读取时用于预取下一页的后台线程
+        self._executor = ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix='feishu-prefetch')
+        logger.info('FeishuAPI初始化完成，使用BASE_ID: %s, TASK_TABLE_ID: %s, PROGRESS_TABLE_ID: %s',
+                    self.base_id, self.table_id, self.progress_table_id)
         
+    def _create_session(self, pool_size):
+        """创建保持连接的HTTP会话
+
+        requests.Session 的连接池由 urllib3 管理，可以在多个线程之间安全共享；
+        pool_size 决定同一主机最多保留多少条空闲的keep-alive连接。
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Content-Type': 'application/json'})
+        return session
+
+    def _request(self, method, path, auth=True, timeout=None, **kwargs):
+        """通过共享会话发送请求并返回解析后的JSON
+
+        令牌被飞书判定为无效时，强制刷新一次令牌后重试。
+        """
+        url = f"{self.api_base}{path}"
+        headers = kwargs.pop('headers', {})
+        token = None
+        if auth:
+            token = self._get_access_token()
+            headers['Authorization'] = f'Bearer {token}'
+        
+        def send():
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=headers,
+                                                timeout=timeout or self.timeout, **kwargs)
+            except requests.RequestException:
+                self.tracer.record_upstream(method, path, 'error', None, 0, time.perf_counter() - start)
+                raise
+            try:
+                response_data = response.json()
+            except ValueError:
+                response_data = {"code": -1, "msg": f"HTTP {response.status_code}: {response.text[:200]}"}
+            self.tracer.record_upstream(method, path, response.status_code, response_data.get("code"),
+                                        len(response.content), time.perf_counter() - start)
+            return response.status_code, response_data, response.headers
+        
+        status, response_data, _ = self.scheduler.execute(send)
+        
+        if auth and (status == 401 or response_data.get("code") in self.TOKEN_INVALID_CODES):
+            logger.info('访问令牌已失效，刷新后重试')
+            headers['Authorization'] = f'Bearer {self.token_manager.invalidate(token)}'
+            status, response_data, _ = self.scheduler.execute(send)
+        return response_data
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+        self.ledger.close()
+        self.history.close()
+        if self.user_state is not None:
+            self.user_state.close()
+        if self.journal is not None:
+            self.journal.close()
+
     def _get_access_token(self):
         """获取飞书访问令牌"""
-        if self.access_token and self.token_expires_at and datetime.now() < self.token_expires_at:
-            print('使用缓存的访问令牌')
-            return self.access_token
-            
-        print('开始获取新的访问令牌...')
-        url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
-        headers = {"Content-Type": "application/json"}
+        return self.token_manager.get_token()
+    
+    def _fetch_access_token(self):
+        """向飞书请求新的访问令牌，返回 (令牌, 有效期秒数)"""
+        logger.debug('开始获取新的访问令牌')
         data = {
             "app_id": self.app_id,
             "app_secret": self.app_secret
         }
         
-        response = requests.post(url, headers=headers, json=data)
-        response_data = response.json()
-        print(f'获取访问令牌响应: {response_data}')
+        response_data = self._request('POST', '/auth/v3/tenant_access_token/internal', auth=False, json=data)
         
         if response_data.get("code") == 0:
-            self.access_token = response_data.get("tenant_access_token")
-            self.token_expires_at = datetime.now() + timedelta(seconds=response_data.get("expire", 7200))
-            print(f'成功获取访问令牌，有效期至: {self.token_expires_at}')
-            return self.access_token
+            expire = response_data.get("expire", 7200)
+            logger.info('成功获取访问令牌，有效期 %s 秒', expire)
+            return response_data.get("tenant_access_token"), expire
         else:
-            error_msg = f"获取访问令牌失败: {response_data}"
-            print(f'错误: {error_msg}')
+            # 只记录错误码和说明，不输出完整响应
+            error_msg = f"获取访问令牌失败: code={response_data.get('code')}, msg={response_data.get('msg')}"
+            logger.error(error_msg)
             raise Exception(error_msg)
     
     def get_tables(self, app_token):
         """获取多维表格中的所有数据表"""
-        print('开始获取数据表列表...')
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{app_token}/tables"
-        headers = {
-            'Authorization': f'Bearer {self._get_access_token()}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.get(url, headers=headers)
-        response_data = response.json()
-        print(f'获取数据表响应: {response_data}')
+        logger.debug('开始获取数据表列表')
+        response_data = self._request('GET', f"/bitable/v1/apps/{app_token}/tables")
         
         if response_data.get("code") == 0:
             tables = response_data.get("data", {}).get("items", [])
-            print(f'成功获取数据表列表，共{len(tables)}个数据表')
+            logger.debug('成功获取数据表列表，共%d个数据表', len(tables))
             return tables
         else:
             error_msg = f"获取数据表列表失败: {response_data}"
-            print(f'错误: {error_msg}')
+            logger.error(error_msg)
             raise Exception(error_msg)
     
-    def get_tasks(self):
-        """获取任务列表"""
-        print('开始获取任务列表...')
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{self.table_id}/records"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.get(url, headers=headers)
-        response_data = response.json()
+    def attach_mirror(self, mirror):
+        """启用本地镜像：镜像数据足够新时读操作由镜像提供，写操作成功后同步到镜像"""
+        self.mirror = mirror
+        self.cache.invalidate()
+    
+    def attach_user_state(self, store):
+        """启用多用户模式：任务完成状态按用户保存在 store（UserCompletionStore）中，不再读写任务表的完成状态列"""
+        self.user_state = store
+    
+    def attach_journal(self, journal):
+        """启用打卡写入日志：打卡先写入本地日志（WriteJournal）后立即返回，由后台线程回放到飞书"""
+        self.journal = journal
+    
+    def _mirror_fresh(self, table_id):
+        return self.mirror is not None and self.mirror.is_fresh(table_id)
+    
+    def _record_updated(self, table_id, record_id, fields):
+        """写入成功后同步缓存、进度汇总和镜像中的记录"""
+        generation = self.cache.patch_record(table_id, record_id, fields)
+        if table_id == self.table_id:
+            self.progress.apply([{'record_id': record_id, 'fields': fields}], generation)
+        if self.mirror is not None:
+            self.mirror.patch_record(table_id, record_id, fields)
+    
+    def _record_created(self, table_id, record):
+        """创建成功后把新记录加入缓存、进度汇总和镜像"""
+        generation = self.cache.add_record(table_id, record)
+        if table_id == self.table_id and record:
+            self.progress.apply([record], generation)
+        if self.mirror is not None and record and table_id in self.mirror.table_ids:
+            self.mirror.upsert_records(table_id, [record])
+    
+    def _publish_changes(self, table_id, records, removed=(), snapshot=None):
+        """把一次写入或同步中变化的记录发布到变更通知
+
+        任务表的变化会附带最新的进度；只有存在订阅者时才读取，
+        在缓存加载过程中调用时必须传入 snapshot（完整的任务列表），不能再读缓存。
+        """
+        kind = {self.table_id: 'tasks', Config.REWARD_TABLE_ID: 'rewards'}.get(table_id)
+        if kind is None or not (records or removed):
+            return
+        if kind == 'tasks' and self.user_state is not None:
+            # 多用户模式下任务表的完成状态列不代表任何用户，只推送其他字段的变化；
+            # 各用户的完成状态和进度由 set_user_completed 单独推送
+            records = [
+                {'record_id': record['record_id'], 'fields': fields}
+                for record in records
+                for fields in [{name: value for name, value in record.get('fields', {}).items()
+                                if name not in COMPLETION_FIELDS}]
+                if fields
+            ]
+            if not (records or removed):
+                return
+        if len(records) + len(removed) > self.CHANGE_DETAIL_LIMIT:
+            self.changes.publish('reload', {'table': kind})
+        else:
+            self.changes.publish(kind, {
+                'records': [{'record_id': record['record_id'], 'fields': record.get('fields', {})}
+                            for record in records],
+                'removed': list(removed)
+            })
+        if kind == 'tasks' and self.user_state is None and self.changes.subscribers:
+            try:
+                self.changes.publish('progress', self.current_progress(snapshot))
+            except Exception as e:
+                logger.warning('计算变更后的进度失败: %s', e)
+    
+    def _publish_reload_diff(self, table_id, previous, generation, records):
+        """缓存过期重新加载时，把与上一份快照相比发生变化的记录发布出去
+
+        用于发现在飞书中直接修改的数据；本进程的写入已经在写入时发布过，快照中已包含这些修改。
+        加载期间发生过写入时，加载结果可能早于写入，不发布。
+        """
+        if previous is None or self.cache.generation(table_id) != generation:
+            return
+        old = {record['record_id']: record.get('fields', {}) for record in previous}
+        changed = [record for record in records if old.pop(record['record_id'], None) != record.get('fields', {})]
+        # 在缓存加载过程中调用，进度必须基于新快照计算，不能再读缓存
+        self._publish_changes(table_id, changed, sorted(old), snapshot=records)
+    
+    def get_tasks(self, allow_stale=False):
+        """获取任务列表（优先读取缓存）
+
+        allow_stale 为 True 时上游变慢或不可用时可以返回旧数据，只用于只读接口，写操作需要看到加载失败。
+        """
+        return self.cache.get(self.table_id, self._fetch_tasks, allow_stale)
+    
+    def _fetch_tasks(self):
+        """获取任务列表，镜像数据足够新时直接读取镜像，否则请求飞书"""
+        if self._mirror_fresh(self.table_id):
+            generation = self.cache.generation(self.table_id)
+            tasks = self._overlay_journal(self.mirror.get_records(self.table_id))
+            self.progress.rebuild(tasks, generation)
+            return tasks
+        logger.debug('开始获取任务列表')
+        previous, generation = self.cache.peek(self.table_id), self.cache.generation(self.table_id)
+        try:
+            tasks = list(self.iter_records(self.table_id))
+        except Exception as e:
+            error_msg = f"获取任务列表失败: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
         
-        if response_data.get("code") == 0:
-            tasks = response_data.get("data", {}).get("items", [])
-            print(f'成功获取任务列表，共{len(tasks)}个任务')
+        logger.debug('成功获取任务列表，共%d个任务', len(tasks))
+        tasks = self._overlay_journal(tasks)
+        # 加载期间发生写入时 generation 已落后于缓存，读取进度时会再次重建
+        self.progress.rebuild(tasks, generation)
+        self._publish_reload_diff(self.table_id, previous, generation, tasks)
+        return tasks
+    
+    def _overlay_journal(self, tasks):
+        """把日志中还未回放到飞书的任务状态覆盖到加载结果上，避免回放完成前重新加载时打卡状态被还原"""
+        pending = self.journal.pending_fields() if self.journal is not None else None
+        if not pending:
             return tasks
+        return [{**task, 'fields': {**task.get('fields', {}), **pending[task['record_id']]}}
+                if task['record_id'] in pending else task for task in tasks]
+    
+    def iter_records(self, table_id, page_size=PAGE_SIZE_LIMIT, fields=None, filter=None, prefetch=True,
+                     automatic_fields=False):
+        """逐条遍历数据表中的记录
+
+        按页向飞书请求数据，调用方消费到哪一页才会请求到哪一页，内存中最多同时保留两页记录。
+        prefetch 为 True 时，在返回当前页记录的同时于后台线程请求下一页。
+        fields 为需要返回的字段名列表，filter 为 build_filter 构造的筛选条件；
+        指定任一项时改用查询接口，由飞书服务端完成字段裁剪和筛选。
+        automatic_fields 为 True 时额外返回 created_time/last_modified_time。
+        """
+        page_size = min(page_size, self.PAGE_SIZE_LIMIT)
+        query = None
+        if fields or filter or automatic_fields:
+            query = {}
+            if fields:
+                query["field_names"] = list(fields)
+            if filter:
+                query["filter"] = filter
+            if automatic_fields:
+                query["automatic_fields"] = True
+        
+        page = self._list_page(table_id, page_size, query, None)
+        while page is not None:
+            items, has_more, page_token = page[:3]
+            next_page = None
+            if has_more and page_token:
+                if prefetch:
+                    # 在调用方的上下文中预取，上游调用仍归属到同一个入站请求
+                    next_page = self._executor.submit(contextvars.copy_context().run, self._list_page,
+                                                      table_id, page_size, query, page_token)
+                else:
+                    next_page = page_token
+            
+            yield from items
+            
+            if next_page is None:
+                page = None
+            elif prefetch:
+                page = next_page.result()
+            else:
+                page = self._list_page(table_id, page_size, query, next_page)
+    
+    def count_records(self, table_id, filter=None):
+        """统计满足筛选条件的记录数，查询接口只需返回一条记录即可带回总数"""
+        query = {"filter": filter} if filter else {}
+        return self._list_page(table_id, 1, query, None)[3]
+    
+    def _list_page(self, table_id, page_size, query, page_token):
+        """请求记录列表的一页，返回 (记录, 是否还有下一页, 下一页标记, 记录总数)
+
+        query 为 None 时使用记录列表接口，否则把 query 作为请求体发给查询接口。
+        """
+        params = {"page_size": page_size}
+        if page_token:
+            params["page_token"] = page_token
+        path = f"/bitable/v1/apps/{self.base_id}/tables/{table_id}/records"
+        if query is None:
+            response_data = self._request('GET', path, params=params)
         else:
-            error_msg = f"获取任务列表失败: {response_data}"
-            print(f'错误: {error_msg}')
-            raise Exception(error_msg)
+            response_data = self._request('POST', f"{path}/search", params=params, json=query)
+        
+        if response_data.get("code") != 0:
+            raise Exception(f"获取记录列表失败: {response_data}")
+        
+        data = response_data.get("data", {})
+        return data.get("items") or [], data.get("has_more", False), data.get("page_token"), data.get("total", 0)
     
     def update_task(self, record_id, fields, is_progress=False):
         """更新任务状态或进度"""
         table_id = self.progress_table_id if is_progress else self.table_id
-        print(f'开始更新记录 {record_id} 的状态...')
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{table_id}/records/{record_id}"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json"
-        }
+        # 只记录字段名，不输出字段值
+        logger.debug('开始更新记录 %s，字段: %s', record_id, list(fields))
         data = {"fields": fields}
-        print(f'更新数据: {data}')
         
-        response = requests.put(url, headers=headers, json=data)
-        response_data = response.json()
+        response_data = self._request('PUT', f"/bitable/v1/apps/{self.base_id}/tables/{table_id}/records/{record_id}", json=data)
         
         if response_data.get("code") == 0:
-            print(f'成功更新任务 {record_id}')
+            logger.debug('成功更新任务 %s', record_id)
+            self._record_updated(table_id, record_id, fields)
+            self._publish_changes(table_id, [{'record_id': record_id, 'fields': fields}])
             return response_data.get("data", {}).get("record")
         else:
             error_msg = f"更新任务状态失败: {response_data}"
-            print(f'错误: {error_msg}')
+            logger.error(error_msg)
             raise Exception(error_msg)
     
     def create_task(self, fields):
         """创建新任务"""
-        print(f'开始创建任务: {fields.get("任务名称")}...')
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{self.table_id}/records"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json"
-        }
+        logger.debug('开始创建任务: %s', fields.get("任务名称"))
         data = {"fields": fields}
         
-        response = requests.post(url, headers=headers, json=data)
-        response_data = response.json()
+        # client_token 保证重试时不会重复创建
+        response_data = self._request('POST', f"/bitable/v1/apps/{self.base_id}/tables/{self.table_id}/records",
+                                      params={"client_token": str(uuid.uuid4())}, json=data)
         
         if response_data.get("code") == 0:
-            print(f'成功创建任务: {fields.get("任务名称")}')
-            return response_data.get("data", {}).get("record")
+            logger.info('成功创建任务: %s', fields.get("任务名称"))
+            record = response_data.get("data", {}).get("record")
+            self._record_created(self.table_id, record)
+            if record:
+                self._publish_changes(self.table_id, [record])
+            return record
         else:
             error_msg = f"创建任务失败: {response_data}"
-            print(f'错误: {error_msg}')
+            logger.error(error_msg)
             raise Exception(error_msg)
     
-    def get_rewards(self):
-        """获取奖励列表"""
-        print('开始获取奖励列表...')
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{Config.REWARD_TABLE_ID}/records"
-        headers = {
-            "Authorization": f"Bearer {self._get_access_token()}",
-            "Content-Type": "application/json"
-        }
+    def batch_update_records(self, table_id, records):
+        """批量更新记录
+
+        records 为 [{"record_id": ..., "fields": {...}}, ...]，超过单次上限时自动分批提交。
+        返回 {"records": 成功更新的记录, "errors": [{"record_id", "fields", "error"}]}，
+        某一批失败时该批中的每条记录都会出现在 errors 中，其余批次照常提交。
+        """
+        logger.debug('开始批量更新 %d 条记录', len(records))
+        result = {"records": [], "errors": []}
+        path = f"/bitable/v1/apps/{self.base_id}/tables/{table_id}/records/batch_update"
         
-        response = requests.get(url, headers=headers)
-        response_data = response.json()
+        for chunk in self._chunks(records):
+            response_data = self._request('POST', path, json={"records": chunk})
+            
+            if response_data.get("code") == 0:
+                result["records"].extend(response_data.get("data", {}).get("records", []))
+                for record in chunk:
+                    self._record_updated(table_id, record["record_id"], record["fields"])
+                self._publish_changes(table_id, chunk)
+            else:
+                error_msg = f"批量更新记录失败: {response_data}"
+                logger.error(error_msg)
+                result["errors"].extend(
+                    {"record_id": record["record_id"], "fields": record["fields"], "error": error_msg}
+                    for record in chunk
+                )
         
-        if response_data.get("code") == 0:
-            rewards = response_data.get("data", {}).get("items", [])
-            print(f'成功获取奖励列表，共{len(rewards)}个奖励')
-            return rewards
-        else:
-            error_msg = f"获取奖励列表失败: {response_data}"
-            print(f'错误: {error_msg}')
+        logger.debug('批量更新完成: 成功 %d 条, 失败 %d 条', len(result["records"]), len(result["errors"]))
+        return result
+    
+    def batch_create_records(self, table_id, fields_list, client_token=None):
+        """批量创建记录
+
+        fields_list 为每条新记录的字段字典，超过单次上限时自动分批提交，返回格式同 batch_update_records。
+        client_token 由调用方持久化时，用相同的 client_token 重新提交同一批记录不会重复创建。
+        """
+        logger.debug('开始批量创建 %d 条记录', len(fields_list))
+        result = {"records": [], "errors": []}
+        path = f"/bitable/v1/apps/{self.base_id}/tables/{table_id}/records/batch_create"
+        
+        for index, chunk in enumerate(self._chunks(fields_list)):
+            # client_token 保证重试时不会重复创建；调用方指定时每批由它派生出固定的值
+            token = str(uuid.uuid5(uuid.UUID(client_token), str(index))) if client_token else str(uuid.uuid4())
+            response_data = self._request('POST', path, params={"client_token": token},
+                                          json={"records": [{"fields": fields} for fields in chunk]})
+            
+            if response_data.get("code") == 0:
+                created = response_data.get("data", {}).get("records", [])
+                result["records"].extend(created)
+                for record in created:
+                    self._record_created(table_id, record)
+                self._publish_changes(table_id, created)
+            else:
+                error_msg = f"批量创建记录失败: {response_data}"
+                logger.error(error_msg)
+                result["errors"].extend({"fields": fields, "error": error_msg} for fields in chunk)
+        
+        logger.debug('批量创建完成: 成功 %d 条, 失败 %d 条', len(result["records"]), len(result["errors"]))
+        return result
+    
+    def _chunks(self, items):
+        """按批量接口的单次记录上限切分"""
+        for start in range(0, len(items), self.BATCH_RECORD_LIMIT):
+            yield items[start:start + self.BATCH_RECORD_LIMIT]
+    
+    def get_rewards(self, allow_stale=False):
+        """获取奖励列表（优先读取缓存），allow_stale 同 get_tasks"""
+        return self.cache.get(Config.REWARD_TABLE_ID, self._fetch_rewards, allow_stale)
+    
+    def _fetch_rewards(self):
+        """获取奖励列表，镜像数据足够新时直接读取镜像，否则请求飞书"""
+        if self._mirror_fresh(Config.REWARD_TABLE_ID):
+            return self.mirror.get_records(Config.REWARD_TABLE_ID)
+        logger.debug('开始获取奖励列表')
+        previous, generation = self.cache.peek(Config.REWARD_TABLE_ID), self.cache.generation(Config.REWARD_TABLE_ID)
+        try:
+            rewards = list(self.iter_records(Config.REWARD_TABLE_ID))
+        except Exception as e:
+            error_msg = f"获取奖励列表失败: {str(e)}"
+            logger.error(error_msg)
             raise Exception(error_msg)
+        
+        logger.debug('成功获取奖励列表，共%d个奖励', len(rewards))
+        self._publish_reload_diff(Config.REWARD_TABLE_ID, previous, generation, rewards)
+        return rewards
+
+    def get_all_data(self, user_id=None, allow_stale=False):
+        """获取所有数据（任务、进度和奖励）
 
-    def get_all_data(self):
-        """获取所有数据（任务、进度和奖励）"""
-        print('开始获取所有数据...')
+        同步版本依次读取任务表和奖励表，两者并发读取见 AsyncFeishuAPI.get_all_data。
+        多用户模式下传入 user_id，任务完成状态和进度按该用户计算；allow_stale 同 get_tasks。
+        """
+        logger.debug('开始获取所有数据')
         try:
-            # 并行获取任务和奖励数据
-            tasks = self.get_tasks()
-            rewards = self.get_rewards()
-            
-            # 计算进度数据 - 同时检查两种完成状态字段
-            completed_tasks = [task for task in tasks if task['fields'].get('已完成', False) or task['fields'].get('任务完成状态') == '是']
-            total_tasks = len(tasks)
-            completed_count = len(completed_tasks)
-            
-            # 计算当前等级（每完成3个任务提升一级）
-            current_level = (completed_count // 3) + 1
-            
-            # 计算总星星数 - 累加每个已完成任务的星星数量
-            total_stars = sum(int(task['fields'].get('星星数量', 1)) for task in completed_tasks)
-            
-            progress_data = {
-                'current_level': current_level,
-                'total_stars': total_stars,
-                'completed_tasks': completed_count,
-                'total_tasks': total_tasks
-            }
-            
-            # 组合所有数据
-            all_data = {
-                'tasks': tasks,
-                'progress': progress_data,
-                'rewards': rewards
-            }
-            
-            print(f'成功获取所有数据: 任务({len(tasks)}), 奖励({len(rewards)})')
-            return all_data
+            generation = self.cache.generation(self.table_id)
+            tasks = self.get_tasks(allow_stale)
+            rewards = self.get_rewards(allow_stale)
+            if self.user_state is not None and user_id:
+                return self.compose_all_data(self.tasks_for_user(user_id, tasks), rewards,
+                                             self.user_progress(user_id, allow_stale))
+            return self.compose_all_data(tasks, rewards, self.progress.current(generation, tasks))
         except Exception as e:
             error_msg = f"获取所有数据失败: {str(e)}"
-            print(f'错误: {error_msg}')
+            logger.error(error_msg)
             raise Exception(error_msg)
     
+    @staticmethod
+    def compose_all_data(tasks, rewards, progress_data):
+        """由任务、奖励和进度组合出完整数据"""
+        # 组合所有数据
+        all_data = {
+            'tasks': tasks,
+            'progress': progress_data,
+            'rewards': rewards
+        }
+        
+        logger.debug('成功获取所有数据: 任务(%d), 奖励(%d)', len(tasks), len(rewards))
+        return all_data
+    
+    def get_progress(self):
+        """获取当前进度（由进度汇总提供）"""
+        return self.current_progress()
+    
+    def current_progress(self, snapshot=None, allow_stale=False):
+        """返回与任务表缓存一致的进度
+
+        先读取任务表（缓存命中时不请求飞书，并能发现其他进程的写入和过期），汇总与缓存版本一致时直接返回；
+        snapshot 为缓存加载过程中的完整任务列表，传入时不再读缓存。allow_stale 同 get_tasks。
+        """
+        generation = self.cache.generation(self.table_id)
+        tasks = self.get_tasks(allow_stale) if snapshot is None else snapshot
+        return self.progress.current(generation, tasks)
+    
+    def user_progress(self, user_id, allow_stale=False):
+        """用户的进度；未启用多用户模式时所有用户共用任务表中的完成状态，allow_stale 同 get_tasks"""
+        if self.user_state is None:
+            return self.current_progress(allow_stale=allow_stale)
+        # 先让进度汇总与任务表缓存一致，再按用户的完成集合计算，耗时与用户总数无关
+        self.current_progress(allow_stale=allow_stale)
+        return self.progress.summarize_subset(self.user_state.completed(user_id))
+    
+    def tasks_for_user(self, user_id, tasks):
+        """把用户自己的完成状态覆盖到任务列表上；未启用多用户模式时原样返回"""
+        if self.user_state is None:
+            return tasks
+        completed = self.user_state.completed(user_id)
+        return [{
+            **task,
+            'fields': {
+                **{name: value for name, value in task.get('fields', {}).items() if name not in COMPLETION_FIELDS},
+                '任务完成状态': '是' if task['record_id'] in completed else '否'
+            }
+        } for task in tasks]
+    
+    def set_user_completed(self, user_id, task_ids, completed=True):
+        """多用户模式下设置用户的任务完成状态，变化只推送给该用户，返回状态发生变化的任务ID"""
+        changed = self.user_state.set_completed(user_id, task_ids, completed)
+        if changed:
+            value = '是' if completed else '否'
+            self.changes.publish('tasks', {
+                'records': [{'record_id': task_id, 'fields': {'任务完成状态': value}} for task_id in changed],
+                'removed': []
+            }, user=user_id)
+            if self.changes.subscribers:
+                self.changes.publish('progress', self.user_progress(user_id), user=user_id)
+        return changed
+    
+    def rebuild_progress(self):
+        """丢弃任务表缓存，由飞书中的最新数据重建进度汇总"""
+        self.cache.invalidate(self.table_id)
+        return self.current_progress()
+    
+    def query_progress(self):
+        """不经过缓存，只向飞书查询已完成任务的星星数量和任务总数来计算进度"""
+        logger.debug('开始获取进度数据')
+        try:
+            completed_tasks = list(self.iter_records(self.table_id, fields=['星星数量'], filter=COMPLETED_FILTER))
+            total_tasks = self.count_records(self.table_id)
+            progress_data = self.calculate_progress(completed_tasks, total_tasks)
+            logger.debug('成功获取进度数据: %s', progress_data)
+            return progress_data
+        except Exception as e:
+            error_msg = f"获取进度数据失败: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+    
+    @staticmethod
+    def calculate_progress(completed_tasks, total_tasks):
+        """根据已完成任务计算等级和星星数"""
+        return summarize(len(completed_tasks), sum(star_count(task['fields']) for task in completed_tasks), total_tasks)
+    
     def update_user_progress(self, user_id, tasks, progress_data):
         """更新用户进度表"""
-        print(f'开始更新用户 {user_id} 的进度数据...')
+        logger.debug('开始更新用户 %s 的进度数据', user_id)
+        fields_list = self.progress_fields(user_id, tasks, progress_data)
+        result = self.batch_create_records(Config.PROGRESS_TABLE_ID, fields_list)
         
+        if not result["records"] and result["errors"]:
+            error_msg = f"更新用户进度失败: {result['errors'][0]['error']}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        # 部分记录失败时不中断流程，失败明细随结果返回
+        for error in result["errors"]:
+            logger.warning('创建任务进度记录失败: %s - %s', error["fields"].get("任务ID"), error["error"])
+        
+        logger.info('成功更新用户 %s 的进度数据，创建了 %d 条记录', user_id, len(result["records"]))
+        return result["records"]
+    
+    def checkin_deferred(self, user_id, task_ids):
+        """打卡写入本地日志后立即返回，由日志的后台线程回放到飞书，返回 (打卡任务, 打卡后的进度)
+
+        本地缓存、进度汇总和变更推送随即更新；日志写入失败时撤销本地的修改（多用户模式下恢复
+        本次新完成的任务为未完成，否则丢弃任务表缓存）并抛出异常，用户可以重新打卡。
+        """
+        entries = []
+        changed = []
+        if self.user_state is not None:
+            changed = self.set_user_completed(user_id, task_ids)
+        else:
+            updates = [{'record_id': task_id, 'fields': {'任务完成状态': '是'}} for task_id in task_ids]
+            for update in updates:
+                self._record_updated(self.table_id, update['record_id'], update['fields'])
+            self._publish_changes(self.table_id, updates)
+            entries = [('task_status', update) for update in updates]
+        try:
+            selected = set(task_ids)
+            tasks = [task for task in self.tasks_for_user(user_id, self.get_tasks()) if task['record_id'] in selected]
+            progress_data = self.user_progress(user_id)
+            entries.append(('progress', {'fields_list': self.progress_fields(user_id, tasks, progress_data)}))
+            self.journal.append(user_id, entries)
+        except Exception as e:
+            if self.user_state is None:
+                self.cache.invalidate(self.table_id)
+            elif changed:
+                # 只撤销本次新完成的任务，之前已经完成的保持不变；撤销同样推送给该用户
+                self.set_user_completed(user_id, changed, completed=False)
+            error_msg = f"写入打卡日志失败: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        logger.info('用户 %s 的打卡已写入日志，%d 条待回放', user_id, len(entries))
+        return tasks, progress_data
+    
+    @staticmethod
+    def progress_fields(user_id, tasks, progress_data):
+        """本次打卡要写入用户进度表的记录字段"""
         # 检查两种可能的完成状态字段：'已完成'和'任务完成状态'
-        completed_tasks = []
-        for task in tasks:
-            if task['fields'].get('已完成', False) or task['fields'].get('任务完成状态') == '是':
-                completed_tasks.append(task)
+        completed_tasks = [task for task in tasks if is_completed(task['fields'])]
         
         # 如果没有已完成的任务，仍然创建一条基本进度记录
         if not completed_tasks:
-            print('没有已完成的任务，创建基本进度记录')
-            url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{Config.PROGRESS_TABLE_ID}/records"
-            headers = {
-                "Authorization": f"Bearer {self._get_access_token()}",
-                "Content-Type": "application/json"
-            }
-            
-            # 准备基本字段数据
-            fields = {
+            logger.debug('没有已完成的任务，创建基本进度记录')
+            fields_list = [{
                 "用户ID": user_id,
                 "累计星星数": progress_data['total_stars'],
                 "当前等级": progress_data['current_level']
-            }
-            
-            data = {"fields": fields}
-            print(f'更新基本数据: {data}')
-            
-            response = requests.post(url, headers=headers, json=data)
-            response_data = response.json()
-            
-            if response_data.get("code") == 0:
-                print(f'成功更新用户 {user_id} 的基本进度数据')
-                return response_data.get("data", {}).get("record")
-            else:
-                error_msg = f"更新用户进度失败: {response_data}"
-                print(f'错误: {error_msg}')
-                raise Exception(error_msg)
-        
-        # 为每个已完成的任务创建单独的记录
-        print(f'为 {len(completed_tasks)} 个已完成任务创建单独记录')
-        created_records = []
-        
-        for task in completed_tasks:
-            url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{Config.PROGRESS_TABLE_ID}/records"
-            headers = {
-                "Authorization": f"Bearer {self._get_access_token()}",
-                "Content-Type": "application/json"
-            }
-            
-            # 准备单个任务的字段数据
-            fields = {
+            }]
+        else:
+            # 为每个已完成的任务创建单独的记录，通过批量接口一次提交
+            logger.debug('为 %d 个已完成任务创建单独记录', len(completed_tasks))
+            fields_list = [{
                 "用户ID": user_id,
                 "累计星星数": progress_data['total_stars'],
                 "当前等级": progress_data['current_level'],
                 "任务ID": task['record_id'],
                 "任务完成状态": "是"
-            }
-            
-            data = {"fields": fields}
-            print(f'创建任务进度记录: {task["record_id"]} - {fields.get("任务名称")}')
-            
-            response = requests.post(url, headers=headers, json=data)
-            response_data = response.json()
-            
-            if response_data.get("code") == 0:
-                print(f'成功创建任务进度记录: {task["record_id"]}')
-                created_records.append(response_data.get("data", {}).get("record"))
-            else:
-                error_msg = f"创建任务进度记录失败: {response_data}"
-                print(f'错误: {error_msg}')
-                # 继续处理其他任务，不中断流程
-                print("继续处理其他任务...")
-        
-        print(f'成功更新用户 {user_id} 的进度数据，创建了 {len(created_records)} 条记录')
-        return created_records
+            } for task in completed_tasks]
+        return fields_list
     
     def reset_tasks_status(self):
         """重置所有任务的完成状态为"否"""
-        print('开始重置所有任务的完成状态...')
+        logger.debug('开始重置所有任务的完成状态')
         try:
-            # 获取所有任务
-            tasks = self.get_tasks()
-            reset_count = 0
+            # 只向飞书查询状态为"是"的任务的记录ID，一次批量提交
+            updates = [
+                {'record_id': task['record_id'], 'fields': {'任务完成状态': '否'}}
+                for task in self.iter_records(self.table_id, fields=['任务完成状态'], filter=COMPLETED_FILTER)
+            ]
+            if not updates:
+                logger.info('没有需要重置的任务')
+                return 0
             
-            # 遍历所有任务并重置状态
-            for task in tasks:
-                record_id = task['record_id']
-                # 只有当任务状态为"是"才需要重置
-                if task['fields'].get('任务完成状态') == '是':
-                    fields = {'任务完成状态': '否'}
-                    self.update_task(record_id, fields, is_progress=False)
-                    reset_count += 1
+            result = self.batch_update_records(self.table_id, updates)
+            if result["errors"]:
+                raise Exception(f'{len(result["errors"])} 个任务重置失败: {result["errors"][0]["error"]}')
             
-            print(f'成功重置 {reset_count} 个任务的完成状态')
+            reset_count = len(updates)
+            logger.info('成功重置 %d 个任务的完成状态', reset_count)
             return reset_count
         except Exception as e:
             error_msg = f"重置任务状态失败: {str(e)}"
-            print(f'错误: {error_msg}')
+            logger.error(error_msg)
             raise Exception(error_msg)
             
-    def redeem_reward(self, reward_id, user_id, current_stars):
-        """兑换奖励"""
-        print(f'开始兑换奖励 {reward_id}...')
+    def star_account(self, user_id, business_date):
+        """用户的星星账户（余额、累计获得、累计消耗）
+
+        账本中还没有该用户时先开户，以当前进度中的星星数作为期初余额。期初余额包含的是任务日
+        business_date 已完成的任务，这些任务记为该任务日已计入，当天再次打卡不会重复获得星星。
+        """
+        if not self.ledger.has_user(user_id):
+            tasks = self.tasks_for_user(user_id, self.get_tasks())
+            opening = self.user_progress(user_id)['total_stars']
+            covered = [(task['record_id'], checkin_key(user_id, business_date, task['record_id']))
+                       for task in tasks if is_completed(task['fields'])]
+            self.ledger.open_account(user_id, opening, covered)
+        return self.ledger.summary(user_id)
+    
+    def credit_checkin(self, user_id, tasks, business_date):
+        """打卡完成的任务计入星星账本，同一任务在同一个任务日只计一次，返回本次新增的星星数"""
+        earned = 0
+        for task in tasks:
+            stars = star_count(task['fields'])
+            _, created = self.ledger.record(user_id, 'earn', stars, ref=task['record_id'],
+                                            key=checkin_key(user_id, business_date, task['record_id']))
+            if created:
+                earned += stars
+        return earned
+    
+    def record_history(self, user_id, tasks, business_date):
+        """打卡完成的任务计入按日汇总，同一任务在同一个任务日只计一次，返回本次新计入的任务数"""
+        return self.history.record(user_id, business_date, tasks)
+    
+    def user_history(self, user_id, start, end):
+        """用户在 start 到 end（date，包含两端）之间每天的打卡汇总和按任务类型的星星数，耗时只与日期范围有关"""
+        return self.history.history(user_id, start, end)
+    
+    def user_streaks(self, user_id, today):
+        """用户当前和最长的连续打卡天数"""
+        return self.history.streaks(user_id, today)
+    
+    def _find_reward(self, reward_id):
+        """从奖励表缓存中查找奖励，缓存中没有时（例如刚在飞书中新增）再单独请求"""
+        for reward in self.get_rewards():
+            if reward.get('record_id') == reward_id:
+                return reward
+        path = f"/bitable/v1/apps/{self.base_id}/tables/{Config.REWARD_TABLE_ID}/records/{reward_id}"
+        response_data = self._request('GET', path)
+        if response_data.get("code") != 0:
+            raise Exception(f"获取奖励信息失败: {response_data}")
+        return response_data.get("data", {}).get("record", {})
+    
+    def redeem_reward(self, reward_id, user_id, idempotency_key=None):
+        """兑换奖励
+
+        星星余额以服务器端账本为准（调用前需要先通过 star_account 开户）。同一用户的兑换串行执行，同一奖励的兑换（不论哪个用户）也串行执行，
+        已兑换状态的检查和写入之间不会有其他用户兑换同一奖励；带相同 idempotency_key 的重复请求
+        （重复点击、网络重试）直接返回第一次兑换的结果，不会再次扣除星星或写入飞书。
+        """
+        logger.debug('开始兑换奖励 %s', reward_id)
+        key = f'redeem:{user_id}:{idempotency_key or uuid.uuid4()}'
         try:
-            # 获取奖励信息
-            url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{self.base_id}/tables/{Config.REWARD_TABLE_ID}/records/{reward_id}"
-            headers = {
-                "Authorization": f"Bearer {self._get_access_token()}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.get(url, headers=headers)
-            response_data = response.json()
-            
-            if response_data.get("code") != 0:
-                raise Exception(f"获取奖励信息失败: {response_data}")
+            with self.ledger.user_lock(user_id), self.ledger.reward_lock(reward_id):
+                previous = self.ledger.find(key)
+                if previous is not None:
+                    if previous['status'] != 'committed' or previous['ref'] != reward_id:
+                        raise Exception('该兑换请求已提交，请勿重复提交')
+                    logger.info('重复的兑换请求，返回已有结果: %s', reward_id)
+                    return previous['result']
                 
-            reward = response_data.get("data", {}).get("record", {})
-            required_stars = int(reward.get("fields", {}).get("所需星星数", 0))
-            
-            # 检查星星是否足够
-            if current_stars < required_stars:
-                raise Exception(f"星星不足，需要{required_stars}颗星星，当前只有{current_stars}颗")
-            
-            # 更新奖励状态
-            fields = {
-                "是否已兑换": "是",
-                "兑换用户": user_id,
-                "兑换时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            response = requests.put(url, headers=headers, json={"fields": fields})
-            response_data = response.json()
-            
-            if response_data.get("code") == 0:
-                print(f'成功兑换奖励 {reward_id}')
-                return {
-                    "reward": reward,
-                    "stars_spent": required_stars,
-                    "remaining_stars": current_stars - required_stars
+                balance = self.ledger.balance(user_id)
+                # 奖励信息来自缓存，本进程和其他进程的兑换都会同步更新或失效缓存
+                reward = self._find_reward(reward_id)
+                if reward.get("fields", {}).get("是否已兑换") == "是":
+                    raise Exception("该奖励已经兑换过了")
+                required_stars = star_count({"星星数量": reward.get("fields", {}).get("所需星星数", 0)})
+                
+                # 检查星星是否足够
+                if balance < required_stars:
+                    raise Exception(f"星星不足，需要{required_stars}颗星星，当前只有{balance}颗")
+                
+                # 先预扣星星，写入飞书失败时撤销；进程在两步之间退出时星星保持预扣，不会被重复使用
+                entry_id, _ = self.ledger.record(user_id, 'spend', -required_stars, ref=reward_id,
+                                                 key=key, status='pending')
+                fields = {
+                    "是否已兑换": "是",
+                    "兑换用户": user_id,
+                    "兑换时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 }
-            else:
-                raise Exception(f"更新奖励状态失败: {response_data}")
+                path = f"/bitable/v1/apps/{self.base_id}/tables/{Config.REWARD_TABLE_ID}/records/{reward_id}"
+                try:
+                    response_data = self._request('PUT', path, json={"fields": fields})
+                    if response_data.get("code") != 0:
+                        raise Exception(f"更新奖励状态失败: {response_data}")
+                except Exception:
+                    self.ledger.cancel(entry_id)
+                    raise
                 
+                result = {
+                    "reward": {**reward, "fields": {**reward.get("fields", {}), **fields}},
+                    "stars_spent": required_stars,
+                    "remaining_stars": balance - required_stars
+                }
+                self.ledger.commit(entry_id, result)
+                # 释放锁之前更新缓存，下一个兑换同一奖励的请求读到的已经是已兑换状态
+                self._record_updated(Config.REWARD_TABLE_ID, reward_id, fields)
+            
+            logger.info('成功兑换奖励 %s', reward_id)
+            self._publish_changes(Config.REWARD_TABLE_ID, [{'record_id': reward_id, 'fields': fields}])
+            return result
         except Exception as e:
             error_msg = str(e)
-            print(f'兑换奖励失败: {error_msg}')
+            logger.error('兑换奖励失败: %s', error_msg)
             raise Exception(error_msg)
 
@@ -0,0 +1,363 @@
+"""飞书多维表格接口的本地桩服务器
+
+只实现 FeishuAPI 用到的接口，数据保存在内存中，用于离线调试和性能测试。
+服务器使用 HTTP/1.1，支持keep-alive，便于对比连接复用的效果。
+
+用法:
+    python feishu_stub.py --port 8765 --tasks tasks.json --latency 0.05 --error-rate 0.01
+然后将 FEISHU_API_BASE 设置为 http://127.0.0.1:8765/open-apis
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FeishuStub:
+    """内存中的多维表格桩服务"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.tables = {}
+        # 记录的创建/修改时间（毫秒），查询接口指定 automatic_fields 时返回
+        self.meta = {}
+        self.call_count = 0
+        self.calls_by_route = {}
+        self.bytes_sent = 0
+        self.tokens = set()
+        self.token_expire = 7200
+        # 每个请求的注入延迟（秒），用于模拟真实网络往返
+        self.latency = 0
+        # 按该比例随机返回限流错误，用于测试重试与熔断
+        self.error_rate = 0
+        self.error_status = 429
+        self.error_code = 99991400
+        self._client_tokens = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/open-apis'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_records(self, table_id, fields_list):
+        """向指定数据表写入一批记录，返回新记录"""
+        table = self.tables.setdefault(table_id, {})
+        created = []
+        with self._lock:
+            for fields in fields_list:
+                record_id = 'rec' + uuid.uuid4().hex[:12]
+                record = {'fields': dict(fields), 'id': record_id, 'record_id': record_id}
+                table[record_id] = record
+                now_ms = int(time.time() * 1000)
+                self.meta[record_id] = {'created_time': now_ms, 'last_modified_time': now_ms}
+                created.append(record)
+        return created
+
+    def load_snapshot(self, table_id, path):
+        """从 tasks.json 格式的快照（{"code": 0, "data": [记录...]}）导入记录，保留原记录ID"""
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        records = snapshot.get('data', []) if isinstance(snapshot, dict) else snapshot
+        table = self.tables.setdefault(table_id, {})
+        with self._lock:
+            for record in records:
+                record_id = record.get('record_id') or record.get('id') or 'rec' + uuid.uuid4().hex[:12]
+                table[record_id] = {'fields': dict(record.get('fields', {})), 'id': record_id, 'record_id': record_id}
+                created = record.get('fields', {}).get('创建时间') or int(time.time() * 1000)
+                self.meta[record_id] = {'created_time': created, 'last_modified_time': created}
+        return len(records)
+
+    def seed(self, task_table, reward_table, snapshot=None, task_count=0, reward_count=0):
+        """准备演示数据：从快照导入任务并按需补足到 task_count 条，再生成 reward_count 个奖励"""
+        loaded = self.load_snapshot(task_table, snapshot) if snapshot else 0
+        self.add_records(task_table, [
+            {'任务名称': f'任务{i}', '任务描述': '每天坚持完成任务', '任务类别': '日任务',
+             '任务类型': '学习任务', '星星数量': str(i % 3 + 1), '任务完成状态': '否'}
+            for i in range(loaded, task_count)
+        ])
+        self.add_records(reward_table, [
+            {'奖励名称': f'奖励{i}', '所需星星数': str(i % 5 + 1), '是否已兑换': '否'}
+            for i in range(reward_count)
+        ])
+        return self
+
+    def update_record(self, table_id, record_id, fields):
+        """修改记录字段并刷新修改时间"""
+        with self._lock:
+            record = self.tables[table_id][record_id]
+            record['fields'].update(fields)
+            self.meta[record_id]['last_modified_time'] = int(time.time() * 1000)
+            return record
+
+    def revoke_tokens(self):
+        """作废已下发的所有令牌，之后携带旧令牌的请求返回令牌无效"""
+        with self._lock:
+            self.tokens.clear()
+
+    def reset_counters(self):
+        with self._lock:
+            self.call_count = 0
+            self.calls_by_route = {}
+            self.bytes_sent = 0
+
+    def _count(self, route):
+        with self._lock:
+            self.call_count += 1
+            self.calls_by_route[route] = self.calls_by_route.get(route, 0) + 1
+
+
+# 批量接口单次最多处理的记录数
+BATCH_LIMIT = 1000
+
+_RECORDS = r'/open-apis/bitable/v1/apps/(?P<app>[^/]+)/tables/(?P<table>[^/]+)/records'
+_ROUTES = [
+    ('POST', re.compile(r'^/open-apis/auth/v3/tenant_access_token/internal$'), 'token'),
+    ('GET', re.compile(r'^/open-apis/bitable/v1/apps/(?P<app>[^/]+)/tables$'), 'list_tables'),
+    ('GET', re.compile(f'^{_RECORDS}$'), 'list_records'),
+    ('POST', re.compile(f'^{_RECORDS}$'), 'create_record'),
+    ('POST', re.compile(f'^{_RECORDS}/search$'), 'search_records'),
+    ('POST', re.compile(f'^{_RECORDS}/batch_create$'), 'batch_create'),
+    ('POST', re.compile(f'^{_RECORDS}/batch_update$'), 'batch_update'),
+    ('GET', re.compile(f'^{_RECORDS}/(?P<record>[^/]+)$'), 'get_record'),
+    ('PUT', re.compile(f'^{_RECORDS}/(?P<record>[^/]+)$'), 'update_record'),
+]
+
+
+# 与飞书一致：未指定 page_size 时每页返回20条，最多500条
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+
+# 桩服务器中视为"最后更新时间"类型的字段名，筛选时取记录的修改时间
+MODIFIED_FIELD = '最后更新时间'
+
+_FORMULA = re.compile(r'^CurrentValue\.\[(?P<field>[^\]]+)\]\s*=\s*"(?P<value>[^"]*)"$')
+
+
+def _match_formula(record, formula):
+    """只支持 CurrentValue.[字段]="值" 形式的筛选公式"""
+    match = _FORMULA.match(formula.strip())
+    if not match:
+        return True
+    return str(record['fields'].get(match.group('field'), '')) == match.group('value')
+
+
+def _match_condition(record, condition, meta):
+    if condition['field_name'] == MODIFIED_FIELD:
+        value = meta.get(record['record_id'], {}).get('last_modified_time')
+    else:
+        value = record['fields'].get(condition['field_name'])
+    expected = condition.get('value') or []
+    operator = condition.get('operator', 'is')
+    if operator == 'isEmpty':
+        return value in (None, '', [])
+    if operator == 'isNotEmpty':
+        return value not in (None, '', [])
+    target = expected[0] if expected else ''
+    if operator == 'is':
+        return str(value) == target
+    if operator == 'isNot':
+        return str(value) != target
+    if operator == 'contains':
+        return any(v in str(value) for v in expected)
+    if operator == 'doesNotContain':
+        return not any(v in str(value) for v in expected)
+    if operator in ('isGreater', 'isLess'):
+        try:
+            left, right = float(value), float(expected[-1])
+        except (TypeError, ValueError):
+            return False
+        return left > right if operator == 'isGreater' else left < right
+    return True
+
+
+def _match_filter(record, filter, meta):
+    """按查询接口的 filter 结构筛选记录"""
+    results = [_match_condition(record, condition, meta) for condition in filter.get('conditions', [])]
+    if not results:
+        return True
+    return all(results) if filter.get('conjunction', 'and') == 'and' else any(results)
+
+
+def _page(records, query, field_names=None):
+    """按 page_size/page_token 对记录分页，page_token 即下一页的起始偏移"""
+    page_size = min(int(query.get('page_size', [DEFAULT_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+    offset = int(query.get('page_token', ['0'])[0] or 0)
+    items = records[offset:offset + page_size]
+    if field_names is not None:
+        items = [
+            {**record, 'fields': {name: record['fields'][name] for name in field_names if name in record['fields']}}
+            for record in items
+        ]
+    has_more = offset + page_size < len(records)
+    data = {'items': items, 'has_more': has_more, 'total': len(records)}
+    if has_more:
+        data['page_token'] = str(offset + page_size)
+    return {'code': 0, 'data': data}
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 响应头和响应体分两次写出，关闭Nagle算法避免keep-alive连接上的延迟确认等待
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def do_PUT(self):
+            self._dispatch('PUT')
+
+        def _dispatch(self, method):
+            if stub.latency:
+                time.sleep(stub.latency)
+            parsed = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            for route_method, pattern, name in _ROUTES:
+                match = pattern.match(parsed.path)
+                if route_method == method and match:
+                    stub._count(name)
+                    if stub.error_rate and random.random() < stub.error_rate:
+                        self._send({'code': stub.error_code, 'msg': 'request trigger frequency limit'},
+                                   status=stub.error_status)
+                        return
+                    if name != 'token' and self.headers.get('Authorization', '')[len('Bearer '):] not in stub.tokens:
+                        self._send({'code': 99991663, 'msg': 'Invalid access token for authorization.'}, status=401)
+                        return
+                    query = parse_qs(parsed.query)
+                    client_token = query.get('client_token', [None])[0]
+                    # 与飞书一致：相同 client_token 的创建请求只执行一次
+                    if client_token and client_token in stub._client_tokens:
+                        self._send(stub._client_tokens[client_token])
+                        return
+                    handler = getattr(self, f'_{name}')
+                    result = handler(body=body, query=query, **match.groupdict())
+                    if client_token and result.get('code') == 0:
+                        stub._client_tokens[client_token] = result
+                    self._send(result)
+                    return
+            self._send({'code': 404, 'msg': 'not found'}, status=404)
+
+        def _send(self, payload, status=200):
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            with stub._lock:
+                stub.bytes_sent += len(data)
+
+        def _token(self, body, query):
+            token = 't-' + uuid.uuid4().hex
+            with stub._lock:
+                stub.tokens.add(token)
+            return {'code': 0, 'msg': 'ok', 'tenant_access_token': token, 'expire': stub.token_expire}
+
+        def _list_tables(self, body, query, app):
+            items = [{'table_id': table_id, 'name': table_id} for table_id in stub.tables]
+            return {'code': 0, 'data': {'items': items, 'has_more': False, 'total': len(items)}}
+
+        def _list_records(self, body, query, app, table):
+            records = list(stub.tables.get(table, {}).values())
+            if 'filter' in query:
+                records = [record for record in records if _match_formula(record, query['filter'][0])]
+            field_names = json.loads(query['field_names'][0]) if 'field_names' in query else None
+            return _page(records, query, field_names)
+
+        def _create_record(self, body, query, app, table):
+            record = stub.add_records(table, [body.get('fields', {})])[0]
+            return {'code': 0, 'data': {'record': record}}
+
+        def _search_records(self, body, query, app, table):
+            records = list(stub.tables.get(table, {}).values())
+            if body.get('filter'):
+                records = [record for record in records if _match_filter(record, body['filter'], stub.meta)]
+            result = _page(records, query, body.get('field_names'))
+            if body.get('automatic_fields'):
+                result['data']['items'] = [
+                    {**record, **stub.meta.get(record['record_id'], {})} for record in result['data']['items']
+                ]
+            return result
+
+        def _batch_create(self, body, query, app, table):
+            records = body.get('records', [])
+            if len(records) > BATCH_LIMIT:
+                return {'code': 1254104, 'msg': 'RecordAddOnceExceedLimit'}
+            created = stub.add_records(table, [record.get('fields', {}) for record in records])
+            return {'code': 0, 'data': {'records': created}}
+
+        def _batch_update(self, body, query, app, table):
+            records = body.get('records', [])
+            if len(records) > BATCH_LIMIT:
+                return {'code': 1254104, 'msg': 'RecordAddOnceExceedLimit'}
+            existing = stub.tables.get(table, {})
+            # 与飞书一致：同一批中任一记录不存在，整批失败
+            if any(record.get('record_id') not in existing for record in records):
+                return {'code': 1254043, 'msg': 'RecordIdNotFound'}
+            for record in records:
+                stub.update_record(table, record['record_id'], record.get('fields', {}))
+            return {'code': 0, 'data': {'records': [existing[record['record_id']] for record in records]}}
+
+        def _get_record(self, body, query, app, table, record):
+            found = stub.tables.get(table, {}).get(record)
+            if found is None:
+                return {'code': 1254043, 'msg': 'RecordIdNotFound'}
+            return {'code': 0, 'data': {'record': found}}
+
+        def _update_record(self, body, query, app, table, record):
+            found = stub.tables.get(table, {}).get(record)
+            if found is None:
+                return {'code': 1254043, 'msg': 'RecordIdNotFound'}
+            return {'code': 0, 'data': {'record': stub.update_record(table, record, body.get('fields', {}))}}
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='飞书多维表格本地桩服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tasks', help='从 tasks.json 格式的快照导入任务')
+    parser.add_argument('--task-count', type=int, default=0, help='任务表的记录数，快照不足时自动补足')
+    parser.add_argument('--reward-count', type=int, default=5, help='奖励表的记录数')
+    parser.add_argument('--task-table', default='tbl_tasks')
+    parser.add_argument('--reward-table', default='tbl_rewards')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的注入延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0, help='随机返回限流错误的比例')
+    args = parser.parse_args()
+    stub = FeishuStub(args.host, args.port)
+    stub.latency = args.latency
+    stub.error_rate = args.error_rate
+    stub.seed(args.task_table, args.reward_table, args.tasks, args.task_count, args.reward_count).start()
+    print(f'桩服务器已启动: {stub.url}')
+    print(f'任务表 {args.task_table}: {len(stub.tables.get(args.task_table, {}))} 条, '
+          f'奖励表 {args.reward_table}: {len(stub.tables.get(args.reward_table, {}))} 条')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,77 @@
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """基于锁文件的跨进程互斥锁
+
+    同一台机器上的多个工作进程通过对同一个锁文件加排他锁实现互斥，
+    进程退出时操作系统会自动释放锁。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """获取锁；blocking 为 False 时拿不到锁立即返回 False"""
+        self._file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(self._file.fileno(), flags)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            if blocking:
+                raise
+            return False
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def write_atomic(path, data, mode=None):
+    """先写临时文件再替换，读取方不会看到写了一半的内容
+
+    mode 不为空时临时文件在创建时就使用该权限（例如 0o600），写入内容前不会被其他用户读到。
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    if mode is None:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    else:
+        # 上次异常退出残留的临时文件可能权限更宽，删除后重新独占创建
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,29 @@
+"""gunicorn 配置
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+每个工作进程在 fork 之后各自创建应用（不使用 preload_app），令牌刷新、每日重置和镜像同步等
+后台线程在每个工作进程中运行；进程之间通过 SHARED_STATE_DIR 下的文件共享访问令牌、
+表缓存版本号和文件锁。
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# 每个工作进程内用线程并发处理请求，等待飞书响应时不会阻塞其他请求
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+# /api/stream 的每个连接在打开期间一直占用一个线程，最多用掉一半线程，其余留给接口请求
+os.environ.setdefault('STREAM_MAX_CONNECTIONS', str(max(threads // 2, 1)))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+# 后台线程无法跨越 fork，必须在工作进程中创建应用
+preload_app = False
+accesslog = os.getenv('ACCESS_LOG', '-')
+
+# 多个工作进程共享访问令牌和缓存版本号
+os.environ.setdefault('SHARED_STATE_DIR', '.shared_state')
+# 飞书的QPS配额按应用计算，平均分给各个工作进程
+os.environ.setdefault('FEISHU_QPS', str(float(os.getenv('FEISHU_QPS_TOTAL', '20')) / workers))
@@ -0,0 +1,321 @@
+"""打卡历史的按日汇总
+
+用户进度表每次打卡为每个完成的任务追加一行，按用户查看历史需要扫描整张表。HabitHistory 在本地SQLite中
+维护按用户、按任务日的汇总，打卡时增量更新：
+- daily           每个用户每个任务日完成的任务数和获得的星星数
+- daily_category  同上，按任务类型分列
+- streaks         每个用户当前连续打卡的起始日期、最后打卡日期和最长连续天数
+- checkins        (用户ID, 任务日, 任务ID) 去重，同一任务在同一个任务日重复打卡只计一次
+
+按日期范围查询只读取范围内的汇总行，连续天数直接读取 streaks，耗时与历史总长度无关。
+与进度表一样只记录打卡，取消完成不会从历史中扣除。
+
+已有的进度表记录可以按创建时间归入任务日导入，重复导入不会重复计数:
+    python history.py backfill
+    python history.py show default_user --days 30
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from config import Config
+from progress import is_completed, star_count
+from serializers import text_value
+
+# 任务没有填写类型时归入的类别
+UNCATEGORIZED = '未分类'
+
+
+def task_category(fields):
+    return text_value(fields.get('任务类型')) or UNCATEGORIZED
+
+
+def parse_range(start, end, today, default_days, max_days):
+    """解析查询的日期范围（YYYY-MM-DD，包含两端），默认为截至今天的 default_days 天
+
+    格式错误、起始日期晚于结束日期或超过 max_days 天时抛出 ValueError。
+    """
+    try:
+        end_date = date.fromisoformat(end or today)
+        start_date = date.fromisoformat(start) if start else end_date - timedelta(days=default_days - 1)
+    except ValueError:
+        raise ValueError('日期格式应为 YYYY-MM-DD')
+    if start_date > end_date:
+        raise ValueError('起始日期不能晚于结束日期')
+    if (end_date - start_date).days + 1 > max_days:
+        raise ValueError(f'查询范围不能超过 {max_days} 天')
+    return start_date, end_date
+
+
+class HabitHistory:
+    """按用户、按任务日的打卡汇总"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS checkins (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                category TEXT NOT NULL,
+                stars INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (user_id, day, task_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS daily (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                completed INTEGER NOT NULL,
+                stars INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS daily_category (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                category TEXT NOT NULL,
+                completed INTEGER NOT NULL,
+                stars INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day, category)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS streaks (
+                user_id TEXT PRIMARY KEY,
+                current_start TEXT NOT NULL,
+                last_day TEXT NOT NULL,
+                longest INTEGER NOT NULL,
+                longest_start TEXT NOT NULL
+            ) WITHOUT ROWID;
+        ''')
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls):
+        path = Config.HISTORY_DB_PATH or (
+            os.path.join(Config.SHARED_STATE_DIR, 'history.db') if Config.SHARED_STATE_DIR else 'history.db')
+        return cls(path)
+
+    def record(self, user_id, business_date, tasks):
+        """把一次打卡中已完成的任务计入 business_date 的汇总，返回新计入的任务数"""
+        rows = [(task['record_id'], task_category(task.get('fields', {})), star_count(task.get('fields', {})))
+                for task in tasks if is_completed(task.get('fields', {}))]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            added, new_day = self._add(user_id, business_date, rows)
+            if new_day:
+                self._extend_streak(user_id, business_date)
+        return added
+
+    def import_rows(self, rows):
+        """批量导入 (用户ID, 任务日, 任务ID, 类型, 星星数)，已计入的任务跳过，返回新计入的条数
+
+        导入的日期可能早于已有的历史，导入后重新计算涉及用户的连续天数。
+        """
+        grouped = {}
+        for user_id, day, task_id, category, stars in rows:
+            grouped.setdefault((user_id, day), []).append((task_id, category, stars))
+        added = 0
+        with self._lock, self._conn:
+            for (user_id, day), day_rows in grouped.items():
+                added += self._add(user_id, day, day_rows)[0]
+            for user_id in {user_id for user_id, _ in grouped}:
+                self._rebuild_streak(user_id)
+        return added
+
+    def _add(self, user_id, day, rows):
+        """写入一个用户一个任务日的打卡（调用方持有锁并处于事务中），返回 (新计入的任务数, 是否为新的打卡日)"""
+        now = time.time()
+        new_day = self._conn.execute('SELECT 1 FROM daily WHERE user_id = ? AND day = ?',
+                                     (user_id, day)).fetchone() is None
+        categories = {}
+        for task_id, category, stars in rows:
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO checkins (user_id, day, task_id, category, stars, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (user_id, day, task_id, category, stars, now))
+            if cursor.rowcount:
+                completed, total = categories.get(category, (0, 0))
+                categories[category] = (completed + 1, total + stars)
+        if not categories:
+            return 0, False
+        added = sum(completed for completed, _ in categories.values())
+        self._conn.execute('''
+            INSERT INTO daily (user_id, day, completed, stars) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                completed = completed + excluded.completed, stars = stars + excluded.stars
+        ''', (user_id, day, added, sum(stars for _, stars in categories.values())))
+        self._conn.executemany('''
+            INSERT INTO daily_category (user_id, day, category, completed, stars) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day, category) DO UPDATE SET
+                completed = completed + excluded.completed, stars = stars + excluded.stars
+        ''', [(user_id, day, category, completed, stars) for category, (completed, stars) in categories.items()])
+        return added, new_day
+
+    def _extend_streak(self, user_id, day):
+        """新的打卡日按顺序到来时顺延连续天数；早于最后打卡日的日期重新计算"""
+        row = self._conn.execute('SELECT current_start, last_day, longest, longest_start FROM streaks '
+                                 'WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            self._conn.execute('INSERT INTO streaks VALUES (?, ?, ?, 1, ?)', (user_id, day, day, day))
+            return
+        current_start, last_day, longest, longest_start = row
+        gap = (date.fromisoformat(day) - date.fromisoformat(last_day)).days
+        if gap <= 0:
+            self._rebuild_streak(user_id)
+            return
+        if gap > 1:
+            current_start = day
+        length = (date.fromisoformat(day) - date.fromisoformat(current_start)).days + 1
+        if length > longest:
+            longest, longest_start = length, current_start
+        self._conn.execute('UPDATE streaks SET current_start = ?, last_day = ?, longest = ?, longest_start = ? '
+                           'WHERE user_id = ?', (current_start, day, longest, longest_start, user_id))
+
+    def _rebuild_streak(self, user_id):
+        """由该用户全部的打卡日重新计算连续天数，只在导入或补录较早的日期时使用"""
+        current_start = last_day = longest_start = None
+        longest = 0
+        for (day,) in self._conn.execute('SELECT day FROM daily WHERE user_id = ? ORDER BY day', (user_id,)):
+            if last_day is None or (date.fromisoformat(day) - date.fromisoformat(last_day)).days > 1:
+                current_start = day
+            last_day = day
+            length = (date.fromisoformat(day) - date.fromisoformat(current_start)).days + 1
+            if length > longest:
+                longest, longest_start = length, current_start
+        if last_day is None:
+            return
+        self._conn.execute('INSERT OR REPLACE INTO streaks VALUES (?, ?, ?, ?, ?)',
+                           (user_id, current_start, last_day, longest, longest_start))
+
+    def history(self, user_id, start, end):
+        """start 到 end（date，包含两端）每天的完成数和星星数（没有打卡的日期为 0），以及按任务类型的汇总"""
+        start, end = start.isoformat(), end.isoformat()
+        with self._lock:
+            days = dict((row[0], row[1:]) for row in self._conn.execute(
+                'SELECT day, completed, stars FROM daily WHERE user_id = ? AND day BETWEEN ? AND ?',
+                (user_id, start, end)))
+            categories = self._conn.execute(
+                'SELECT category, SUM(completed), SUM(stars) FROM daily_category '
+                'WHERE user_id = ? AND day BETWEEN ? AND ? GROUP BY category ORDER BY SUM(stars) DESC, category',
+                (user_id, start, end)).fetchall()
+        daily = []
+        day = date.fromisoformat(start)
+        while day <= date.fromisoformat(end):
+            completed, stars = days.get(day.isoformat(), (0, 0))
+            daily.append({'date': day.isoformat(), 'completed': completed, 'stars': stars})
+            day += timedelta(days=1)
+        return {
+            'from': start,
+            'to': end,
+            'days': daily,
+            'categories': [{'type': category, 'completed': completed, 'stars': stars}
+                           for category, completed, stars in categories],
+            'total': {
+                'completed': sum(item['completed'] for item in daily),
+                'stars': sum(item['stars'] for item in daily),
+                'active_days': len(days)
+            }
+        }
+
+    def streaks(self, user_id, today):
+        """用户的连续打卡天数；today 为当前任务日，今天还没打卡时截至昨天的连续天数仍然有效"""
+        with self._lock:
+            row = self._conn.execute('SELECT current_start, last_day, longest, longest_start FROM streaks '
+                                     'WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return {'current': 0, 'longest': 0, 'current_start': None, 'longest_start': None,
+                    'longest_end': None, 'last_active': None, 'active_today': False}
+        current_start, last_day, longest, longest_start = row
+        alive = (date.fromisoformat(today) - date.fromisoformat(last_day)).days <= 1
+        return {
+            'current': (date.fromisoformat(last_day) - date.fromisoformat(current_start)).days + 1 if alive else 0,
+            'longest': longest,
+            'current_start': current_start if alive else None,
+            'longest_start': longest_start,
+            'longest_end': (date.fromisoformat(longest_start) + timedelta(days=longest - 1)).isoformat(),
+            'last_active': last_day,
+            'active_today': last_day == today
+        }
+
+    def backfill(self, api, business_date_of, batch_size=1000):
+        """从用户进度表导入已有的打卡记录，返回 (读取的记录数, 新计入的条数)
+
+        business_date_of(创建时间毫秒) 返回记录所属的任务日；类型和星星数取自任务表中的当前值。
+        """
+        tasks = {task['record_id']: task.get('fields', {}) for task in api.get_tasks()}
+        read = added = 0
+        batch = []
+        for record in api.iter_records(Config.PROGRESS_TABLE_ID, fields=['用户ID', '任务ID'], automatic_fields=True):
+            read += 1
+            fields = record.get('fields', {})
+            task_id = text_value(fields.get('任务ID'))
+            user_id = text_value(fields.get('用户ID'))
+            if not task_id or not user_id or not record.get('created_time'):
+                # 没有完成任务时创建的基本进度记录
+                continue
+            task = tasks.get(task_id, {})
+            batch.append((user_id, business_date_of(record['created_time']), task_id,
+                          task_category(task), star_count(task)))
+            if len(batch) >= batch_size:
+                added += self.import_rows(batch)
+                batch = []
+        if batch:
+            added += self.import_rows(batch)
+        return read, added
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': self._conn.execute('SELECT COUNT(*) FROM streaks').fetchone()[0],
+                'days': self._conn.execute('SELECT COUNT(*) FROM daily').fetchone()[0],
+                'checkins': self._conn.execute('SELECT COUNT(*) FROM checkins').fetchone()[0]
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    from daily_reset import DailyResetScheduler
+    from feishu_api import FeishuAPI
+    from log_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description='打卡历史的按日汇总')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('backfill', help='从用户进度表导入已有的打卡记录，重复导入不会重复计数')
+    show = subparsers.add_parser('show', help='输出用户的打卡历史和连续天数')
+    show.add_argument('user_id')
+    show.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_logging()
+    Config.validate_config()
+    api = FeishuAPI()
+    scheduler = DailyResetScheduler.from_config(api)
+    try:
+        if args.command == 'backfill':
+            start = time.perf_counter()
+            read, added = api.history.backfill(
+                api, lambda ms: scheduler.business_date(datetime.fromtimestamp(ms / 1000, scheduler.tz)))
+            print(f'读取 {read} 条进度记录，新计入 {added} 条打卡，耗时 {time.perf_counter() - start:.2f} 秒')
+            print(json.dumps(api.history.stats(), ensure_ascii=False))
+        else:
+            today = scheduler.business_date()
+            start_date, end_date = parse_range(None, today, today, args.days, args.days)
+            print(json.dumps({
+                'history': api.history.history(args.user_id, start_date, end_date),
+                'streaks': api.history.streaks(args.user_id, today)
+            }, ensure_ascii=False, indent=2))
+    finally:
+        api.close()
+
+
+if __name__ == '__main__':
+    main()
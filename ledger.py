@@ -0,0 +1,138 @@
+"""用户星星账本
+
+星星的收支记录保存在本地SQLite中，余额由服务器计算，兑换奖励时不再信任客户端传来的星星数：
+- opening  开户：账本中首次出现该用户时，以当时进度中的星星数作为期初余额；
+           期初余额中已经包含的当天打卡同时以 0 颗星记入，同一任务日内再次打卡不会重复计入
+- earn     打卡获得：每个任务在每个任务日只计一次
+- spend    兑换消耗：兑换开始时先以 pending 状态预扣，写入飞书成功后确认，失败则撤销
+
+每条记录带唯一的幂等键，重复提交同一个键时返回第一次的结果。
+同一用户的兑换、同一奖励的兑换分别通过文件锁串行执行，多个工作进程共用 SHARED_STATE_DIR 下的同一个账本文件。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from file_lock import FileLock
+
+
+class StarLedger:
+    """基于SQLite的星星收支账本"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 多个进程同时写入时等待对方的事务完成，而不是立即报错
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                ref TEXT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL DEFAULT 'committed',
+                result TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_user ON entries (user_id);
+        ''')
+        self._conn.commit()
+
+    def user_lock(self, user_id):
+        """同一用户的跨进程互斥锁，每次调用返回新的锁对象，同一进程的多个线程之间同样互斥"""
+        return self._file_lock(str(user_id))
+
+    def reward_lock(self, reward_id):
+        """同一奖励的跨进程互斥锁；奖励的已兑换状态对所有用户共用，需要与 user_lock 同时持有时先取 user_lock"""
+        return self._file_lock(f'reward:{reward_id}')
+
+    def _file_lock(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        return FileLock(f'{self.db_path}.{digest}.lock')
+
+    def record(self, user_id, kind, amount, key, ref=None, status='committed'):
+        """写入一条收支记录（支出的 amount 为负数），返回 (记录ID, 是否新写入)
+
+        幂等键已存在时不重复写入，返回已有记录的ID。
+        """
+        with self._lock:
+            try:
+                with self._conn:
+                    cursor = self._conn.execute(
+                        'INSERT INTO entries (user_id, kind, amount, ref, idempotency_key, status, created_at) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (user_id, kind, int(amount), ref, key, status, time.time()))
+                return cursor.lastrowid, True
+            except sqlite3.IntegrityError:
+                row = self._conn.execute('SELECT id FROM entries WHERE idempotency_key = ?', (key,)).fetchone()
+                return row['id'], False
+
+    def open_account(self, user_id, amount, covered=()):
+        """开户：写入期初余额，返回是否新开户
+
+        covered 为期初余额中已经包含的打卡 [(任务ID, 幂等键)]，以 0 颗星与期初余额在同一个事务中写入，
+        之后用相同幂等键计入的打卡不会重复增加星星。账户已存在时不做任何修改。
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO entries (user_id, kind, amount, ref, idempotency_key, created_at) '
+                    "VALUES (?, 'opening', ?, NULL, ?, ?)",
+                    (user_id, int(amount), f'opening:{user_id}', now))
+                if cursor.rowcount == 0:
+                    return False
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO entries (user_id, kind, amount, ref, idempotency_key, created_at) '
+                    "VALUES (?, 'earn', 0, ?, ?, ?)",
+                    [(user_id, ref, key, now) for ref, key in covered])
+        return True
+
+    def commit(self, entry_id, result=None):
+        """确认预扣的记录，result 为重复请求时返回的结果"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE entries SET status = 'committed', result = ? WHERE id = ?",
+                               (json.dumps(result, ensure_ascii=False) if result is not None else None, entry_id))
+
+    def cancel(self, entry_id):
+        """撤销预扣的记录"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE id = ? AND status = 'pending'", (entry_id,))
+
+    def find(self, key):
+        """按幂等键查找记录，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM entries WHERE idempotency_key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry['result'] = json.loads(entry['result']) if entry['result'] else None
+        return entry
+
+    def has_user(self, user_id):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM entries WHERE user_id = ? LIMIT 1', (user_id,)).fetchone() is not None
+
+    def balance(self, user_id):
+        """当前余额，预扣中的支出也计算在内"""
+        return self.summary(user_id)['balance']
+
+    def summary(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COALESCE(SUM(amount), 0) AS balance, '
+                'COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0) AS earned, '
+                'COALESCE(-SUM(CASE WHEN amount < 0 THEN amount END), 0) AS spent, '
+                "COUNT(CASE WHEN status = 'pending' THEN 1 END) AS pending "
+                'FROM entries WHERE user_id = ?', (user_id,)).fetchone()
+        return dict(row)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
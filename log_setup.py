@@ -0,0 +1,65 @@
+"""日志配置
+
+所有模块通过 logging.getLogger(__name__) 输出日志。setup_logging 在根日志器上安装
+QueueHandler：业务线程只把日志记录放入内存队列，由 QueueListener 的后台线程负责格式化和写出，
+请求路径上不会因为写标准输出而阻塞。
+
+日志消息使用 %s 占位符延迟格式化，级别未启用时不会拼接字符串。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from config import Config
+
+# 日志记录的标准属性，其余属性视为通过 extra 传入的结构化字段
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，extra 传入的字段原样附加"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RESERVED})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """安装队列日志处理器，重复调用时直接返回"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if (fmt or Config.LOG_FORMAT) == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel((level or Config.LOG_LEVEL).upper())
+    # urllib3 在调试级别会逐条输出连接日志，上游调用的明细已由请求追踪记录
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    # 进程退出前把队列中剩余的日志写完
+    atexit.register(_listener.stop)
+    return _listener
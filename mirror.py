@@ -0,0 +1,345 @@
+"""多维表格的本地SQLite镜像
+
+后台线程定期从飞书增量拉取任务表和奖励表的变更，读接口直接查询本地镜像。
+镜像超过 MIRROR_MAX_STALENESS 秒未成功同步时视为过期，读操作自动回退到飞书。
+用户进度表只追加、不断增长，且没有读操作使用它的镜像，不参与同步。
+
+用法:
+    python mirror.py sync [--full]   立即同步一次
+    python mirror.py check [--repair] 对比镜像与飞书数据是否一致
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from config import Config
+from feishu_api import build_filter
+from file_lock import FileLock
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+class TableMirror:
+    """本地SQLite镜像与增量同步器"""
+
+    # 增量同步时向前多取的时间（毫秒），避免时间精度导致漏掉边界上的修改
+    CURSOR_OVERLAP_MS = 1000
+
+    def __init__(self, api, db_path, table_ids, sync_interval, max_staleness,
+                 full_sync_interval, modified_field=None):
+        self.api = api
+        self.table_ids = list(table_ids)
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.full_sync_interval = full_sync_interval
+        self.modified_field = modified_field
+        self._lock = threading.Lock()
+        # 多个工作进程共用同一个镜像文件时，同一时间只有一个进程执行后台同步
+        self._sync_lock_path = f'{db_path}.sync.lock'
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                table_id TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                modified_at INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (table_id, record_id)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                table_id TEXT PRIMARY KEY,
+                cursor INTEGER,
+                synced_at REAL,
+                full_synced_at REAL
+            );
+        ''')
+        self._conn.commit()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+        # table_id -> 增量查询失败的时间，之后一个全量同步周期内改为全量同步
+        self._incremental_failed_at = {}
+
+    @classmethod
+    def from_config(cls, api):
+        return cls(
+            api,
+            Config.MIRROR_DB_PATH,
+            [Config.TASK_TABLE_ID, Config.REWARD_TABLE_ID],
+            Config.MIRROR_SYNC_INTERVAL,
+            Config.MIRROR_MAX_STALENESS,
+            Config.MIRROR_FULL_SYNC_INTERVAL,
+            Config.MIRROR_MODIFIED_FIELD
+        )
+
+    # ---- 读取 ----
+
+    def get_records(self, table_id):
+        """读取镜像中的全部记录，格式与飞书接口返回的记录一致"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT record_id, fields FROM records WHERE table_id = ? ORDER BY rowid',
+                (table_id,)
+            ).fetchall()
+        return [_to_record(record_id, fields) for record_id, fields in rows]
+
+    def is_fresh(self, table_id):
+        """镜像是否在允许的过期时间内完成过同步"""
+        state = self._state(table_id)
+        return bool(state and state[1] and time.time() - state[1] <= self.max_staleness)
+
+    def status(self):
+        """各数据表的同步状态"""
+        now = time.time()
+        result = {}
+        with self._lock:
+            for table_id in self.table_ids:
+                count = self._conn.execute(
+                    'SELECT COUNT(*) FROM records WHERE table_id = ?', (table_id,)).fetchone()[0]
+                state = self._conn.execute(
+                    'SELECT cursor, synced_at FROM sync_state WHERE table_id = ?', (table_id,)).fetchone()
+                synced_at = state[1] if state else None
+                result[table_id] = {
+                    'records': count,
+                    'cursor': state[0] if state else None,
+                    'age': round(now - synced_at, 3) if synced_at else None,
+                    'fresh': bool(synced_at and now - synced_at <= self.max_staleness)
+                }
+        return {'tables': result, 'last_error': self.last_error}
+
+    # ---- 写入 ----
+
+    def upsert_records(self, table_id, records, modified_at=None):
+        """写入记录；只有修改时间不早于镜像中已有版本时才会覆盖"""
+        now_ms = int(time.time() * 1000)
+        rows = [
+            (table_id, record['record_id'], json.dumps(record.get('fields', {}), ensure_ascii=False),
+             record.get('last_modified_time') or modified_at or now_ms)
+            for record in records
+        ]
+        with self._lock:
+            self._conn.executemany('''
+                INSERT INTO records (table_id, record_id, fields, modified_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (table_id, record_id) DO UPDATE
+                SET fields = excluded.fields, modified_at = excluded.modified_at
+                WHERE excluded.modified_at >= records.modified_at
+            ''', rows)
+            self._conn.commit()
+
+    def patch_record(self, table_id, record_id, fields):
+        """把写入飞书成功的字段合并到镜像记录中"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fields FROM records WHERE table_id = ? AND record_id = ?',
+                (table_id, record_id)
+            ).fetchone()
+            if row is None:
+                return
+            merged = {**json.loads(row[0]), **fields}
+            self._conn.execute(
+                'UPDATE records SET fields = ?, modified_at = ? WHERE table_id = ? AND record_id = ?',
+                (json.dumps(merged, ensure_ascii=False), int(time.time() * 1000), table_id, record_id)
+            )
+            self._conn.commit()
+
+    # ---- 同步 ----
+
+    def sync_table(self, table_id, full=False):
+        """同步一张数据表，返回发生变化的记录数
+
+        按修改时间字段（默认"最后更新时间"）只拉取上次同步之后修改过的记录；
+        没有配置该字段、增量查询失败（例如数据表中没有该字段）或者 full 为 True 时拉取全表，
+        并删除飞书中已不存在的记录。增量查询失败后的一个全量同步周期内不再尝试增量。
+        """
+        state = self._state(table_id)
+        cursor = state[0] if state else None
+        failed_at = self._incremental_failed_at.get(table_id)
+        incremental = (not full and self.modified_field and cursor is not None
+                       and (failed_at is None or time.time() - failed_at >= self.full_sync_interval))
+        if not incremental:
+            return self._pull(table_id, cursor, None)
+        filter = build_filter(
+            (self.modified_field, 'isGreater', ['ExactDate', max(cursor - self.CURSOR_OVERLAP_MS, 0)]))
+        try:
+            changed = self._pull(table_id, cursor, filter)
+        except Exception as e:
+            self._incremental_failed_at[table_id] = time.time()
+            logger.warning('数据表 %s 按"%s"增量同步失败，改为全量同步: %s', table_id, self.modified_field, e)
+            return self._pull(table_id, cursor, None)
+        self._incremental_failed_at.pop(table_id, None)
+        return changed
+
+    def _pull(self, table_id, cursor, filter):
+        """拉取记录写入镜像；filter 为 None 时为全量同步，同时删除已不存在的记录"""
+        incremental = filter is not None
+        seen = set()
+        changed = 0
+        # 只保留足够判断是否推送明细的变化记录，全量同步时内存占用仍然有界
+        details = []
+        new_cursor = cursor or 0
+        batch = []
+        for record in self.api.iter_records(table_id, filter=filter, automatic_fields=True):
+            seen.add(record['record_id'])
+            new_cursor = max(new_cursor, record.get('last_modified_time') or 0)
+            batch.append(record)
+            if len(batch) >= self.api.PAGE_SIZE_LIMIT:
+                applied = self._apply(table_id, batch)
+                changed += len(applied)
+                details = (details + applied)[:self.api.CHANGE_DETAIL_LIMIT + 1]
+                batch = []
+        applied = self._apply(table_id, batch)
+        changed += len(applied)
+        details = (details + applied)[:self.api.CHANGE_DETAIL_LIMIT + 1]
+        removed = set()
+
+        now = time.time()
+        with self._lock:
+            if not incremental:
+                existing = {row[0] for row in self._conn.execute(
+                    'SELECT record_id FROM records WHERE table_id = ?', (table_id,))}
+                removed = existing - seen
+                self._conn.executemany(
+                    'DELETE FROM records WHERE table_id = ? AND record_id = ?',
+                    [(table_id, record_id) for record_id in removed])
+            self._conn.execute('''
+                INSERT INTO sync_state (table_id, cursor, synced_at, full_synced_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (table_id) DO UPDATE SET cursor = excluded.cursor, synced_at = excluded.synced_at,
+                    full_synced_at = COALESCE(excluded.full_synced_at, sync_state.full_synced_at)
+            ''', (table_id, new_cursor, now, None if incremental else now))
+            self._conn.commit()
+
+        if changed or removed:
+            # 镜像发生变化，进程内的表快照需要重新加载，并通知订阅变更的客户端
+            self.api.cache.invalidate(table_id)
+            self.api._publish_changes(table_id, details, sorted(removed))
+        return changed + len(removed)
+
+    def _apply(self, table_id, records):
+        """写入一批同步到的记录，返回内容发生变化的记录"""
+        if not records:
+            return []
+        with self._lock:
+            placeholders = ','.join('?' * len(records))
+            existing = dict(self._conn.execute(
+                f'SELECT record_id, fields FROM records WHERE table_id = ? AND record_id IN ({placeholders})',
+                [table_id] + [record['record_id'] for record in records]
+            ).fetchall())
+        changed = [
+            record for record in records
+            if record['record_id'] not in existing
+            or json.loads(existing[record['record_id']]) != record.get('fields', {})
+        ]
+        self.upsert_records(table_id, changed)
+        return changed
+
+    def sync_all(self, full=False):
+        """同步所有数据表，返回 {table_id: 变化记录数}"""
+        results = {}
+        for table_id in self.table_ids:
+            state = self._state(table_id)
+            due_full = full or not state or not state[2] or time.time() - state[2] >= self.full_sync_interval
+            results[table_id] = self.sync_table(table_id, full=due_full)
+        return results
+
+    def _state(self, table_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT cursor, synced_at, full_synced_at FROM sync_state WHERE table_id = ?',
+                (table_id,)
+            ).fetchone()
+
+    def start(self):
+        """启动后台同步线程"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mirror-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            sync_lock = FileLock(self._sync_lock_path)
+            # 其他进程正在同步时跳过本轮，同步结果写入同一个数据库，本进程直接读取即可
+            if sync_lock.acquire(blocking=False):
+                try:
+                    changes = self.sync_all()
+                    self.last_error = None
+                    if any(changes.values()):
+                        logger.info('镜像同步完成: %s', changes)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.warning('镜像同步失败: %s', e)
+                finally:
+                    sync_lock.release()
+            self._stop.wait(self.sync_interval)
+
+    # ---- 一致性检查 ----
+
+    def check(self, table_id):
+        """逐条对比镜像与飞书的数据，返回差异"""
+        upstream = {record['record_id']: record.get('fields', {}) for record in self.api.iter_records(table_id)}
+        local = {record['record_id']: record['fields'] for record in self.get_records(table_id)}
+        return {
+            'missing': sorted(set(upstream) - set(local)),
+            'extra': sorted(set(local) - set(upstream)),
+            'different': sorted(
+                record_id for record_id in set(upstream) & set(local)
+                if upstream[record_id] != local[record_id]
+            )
+        }
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._conn.close()
+
+
+def _to_record(record_id, fields):
+    return {'fields': json.loads(fields), 'id': record_id, 'record_id': record_id}
+
+
+def main():
+    from feishu_api import FeishuAPI
+
+    parser = argparse.ArgumentParser(description='多维表格本地镜像')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync = subparsers.add_parser('sync', help='立即同步一次')
+    sync.add_argument('--full', action='store_true', help='拉取全表而不是增量')
+    check = subparsers.add_parser('check', help='检查镜像与飞书数据是否一致')
+    check.add_argument('--repair', action='store_true', help='发现差异时执行一次全量同步')
+    args = parser.parse_args()
+
+    setup_logging()
+    Config.validate_config()
+    mirror = TableMirror.from_config(FeishuAPI())
+
+    if args.command == 'sync':
+        print(f'同步完成: {mirror.sync_all(full=args.full)}')
+        return
+
+    consistent = True
+    for table_id in mirror.table_ids:
+        diff = mirror.check(table_id)
+        ok = not any(diff.values())
+        consistent = consistent and ok
+        print(f'{table_id}: {"一致" if ok else "不一致"} '
+              f'(缺失 {len(diff["missing"])}, 多余 {len(diff["extra"])}, 不同 {len(diff["different"])})')
+        if not ok and args.repair:
+            print(f'{table_id}: 已全量同步，变化 {mirror.sync_table(table_id, full=True)} 条记录')
+    if not consistent and not args.repair:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
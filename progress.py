@@ -0,0 +1,118 @@
+"""任务进度的增量汇总
+
+进度（完成数、等级、星星数）由任务表中各任务的完成状态和星星数量决定。ProgressAggregator
+保存每个任务对进度的贡献和汇总值：写入任务时只按变化的字段调整汇总，读取进度是 O(1) 的，
+不再在每个请求中遍历全部任务并转换星星数量。
+
+汇总与表缓存通过本进程的缓存版本号（TableCache.generation）对齐：
+- 任务表加载（首次加载、过期重新加载、其他进程写入后重新加载）时由完整列表重建
+- 本进程写入任务时按版本号逐次增量更新；版本号不连续（并发写入、缓存失效）时标记为过期
+- 读取时版本号不一致则由当前的任务列表重建一次
+"""
+import threading
+
+
+def is_completed(fields):
+    """同时检查两种完成状态字段：'已完成'和'任务完成状态'"""
+    return bool(fields.get('已完成', False)) or fields.get('任务完成状态') == '是'
+
+
+def star_count(fields):
+    """任务的星星数量，飞书中可能是字符串，未填写时按1颗计算"""
+    try:
+        return int(float(fields.get('星星数量', 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def summarize(completed_count, total_stars, total_tasks):
+    return {
+        # 每完成3个任务提升一级
+        'current_level': (completed_count // 3) + 1,
+        'total_stars': total_stars,
+        'completed_tasks': completed_count,
+        'total_tasks': total_tasks
+    }
+
+
+class ProgressAggregator:
+    """按任务维护的进度汇总"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 任务ID -> (是否完成, 星星数量)
+        self._tasks = {}
+        self._completed = 0
+        self._stars = 0
+        # 汇总对应的缓存版本号，None 表示需要重建
+        self.generation = None
+        self.rebuilds = 0
+        self.updates = 0
+
+    def rebuild(self, tasks, generation=None):
+        """由完整的任务列表重建汇总，返回进度"""
+        with self._lock:
+            self._tasks.clear()
+            self._completed = self._stars = 0
+            for task in tasks:
+                fields = task.get('fields', {})
+                self._put(task['record_id'], is_completed(fields), star_count(fields))
+            self.generation = generation
+            self.rebuilds += 1
+            return self._snapshot()
+
+    def apply(self, records, generation):
+        """把一次写入的字段变化计入汇总，generation 为写入后的缓存版本号
+
+        汇总不是紧接着上一个版本时无法保证正确，标记为过期，下次读取时重建。
+        """
+        with self._lock:
+            if self.generation is None or self.generation != generation - 1:
+                self.generation = None
+                return False
+            for record in records:
+                fields = record.get('fields', {})
+                completed, stars = self._tasks.get(record['record_id'], (False, 1))
+                if '已完成' in fields or '任务完成状态' in fields:
+                    completed = is_completed(fields)
+                if '星星数量' in fields:
+                    stars = star_count(fields)
+                self._put(record['record_id'], completed, stars)
+            self.generation = generation
+            self.updates += 1
+            return True
+
+    def current(self, generation, tasks):
+        """返回与缓存版本 generation 对应的进度；汇总已过期时由 tasks 重建"""
+        with self._lock:
+            if self.generation is not None and self.generation == generation:
+                return self._snapshot()
+        return self.rebuild(tasks, generation)
+
+    def summarize_subset(self, task_ids):
+        """按给定的已完成任务计算进度（多用户模式下每个用户的完成集合），耗时只与集合大小有关"""
+        with self._lock:
+            stars = [self._tasks[task_id][1] for task_id in task_ids if task_id in self._tasks]
+            return summarize(len(stars), sum(stars), len(self._tasks))
+
+    def _put(self, record_id, completed, stars):
+        previous = self._tasks.get(record_id)
+        if previous is not None and previous[0]:
+            self._completed -= 1
+            self._stars -= previous[1]
+        if completed:
+            self._completed += 1
+            self._stars += stars
+        self._tasks[record_id] = (completed, stars)
+
+    def _snapshot(self):
+        return summarize(self._completed, self._stars, len(self._tasks))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'generation': self.generation,
+                'tasks': len(self._tasks),
+                'rebuilds': self.rebuilds,
+                'updates': self.updates
+            }
@@ -0,0 +1,121 @@
+"""数据接口的紧凑响应格式
+
+飞书返回的记录包含 id/record_id 两份ID、全部列以及嵌套的文本片段数组，页面只用到其中几个字段。
+这里把任务和奖励记录映射为扁平、带类型的结构，星星数等数字字段在服务端转换一次：
+    任务: {"id", "name", "description", "type", "stars", "completed"}
+    奖励: {"id", "name", "description", "stars_required", "redeemed"}
+增量数据（?since= 和变更推送）中的记录只包含变化的字段，页面按 id 合并。
+
+FastJSONProvider 在安装了 orjson 时用它序列化响应，否则回退到标准库 json；
+两者都直接输出UTF-8中文，不再转义为 \\uXXXX。
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+_MISSING = object()
+
+
+def text_value(value):
+    """飞书文本字段可能是字符串，也可能是 [{"type": "text", "text": ...}] 片段数组"""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ''.join(part.get('text', '') if isinstance(part, dict) else str(part) for part in value)
+    return str(value)
+
+
+def _int(value):
+    try:
+        return int(float(text_value(value) or 0))
+    except ValueError:
+        return 0
+
+
+def _yes(value):
+    # 完成/兑换状态是"是/否"单选，旧数据中也有布尔类型的"已完成"字段
+    return value is True or text_value(value) == '是'
+
+
+# (输出字段, 依次尝试的飞书字段名, 转换函数, 缺省值)
+TASK_FIELDS = (
+    ('name', ('任务名称',), text_value, ''),
+    ('description', ('任务描述',), text_value, ''),
+    ('type', ('任务类型',), text_value, ''),
+    ('stars', ('星星数量',), _int, 0),
+    ('completed', ('任务完成状态', '已完成'), _yes, False),
+)
+
+REWARD_FIELDS = (
+    ('name', ('奖励名称', 'reward_name'), text_value, ''),
+    ('description', ('奖励描述', 'reward_description'), text_value, ''),
+    ('stars_required', ('所需星星数', 'stars_required'), _int, 0),
+    ('redeemed', ('是否已兑换',), _yes, False),
+)
+
+
+def _project(record, schema, partial):
+    fields = record.get('fields') or {}
+    item = {'id': record.get('record_id') or record.get('id')}
+    for key, names, convert, default in schema:
+        value = next((fields[name] for name in names if name in fields), _MISSING)
+        if value is not _MISSING:
+            item[key] = convert(value)
+        elif not partial:
+            item[key] = default
+    return item
+
+
+def compact_task(record, partial=False):
+    """任务记录的紧凑格式；partial 为 True 时只包含记录中出现的字段"""
+    return _project(record, TASK_FIELDS, partial)
+
+
+def compact_reward(record, partial=False):
+    """奖励记录的紧凑格式；partial 为 True 时只包含记录中出现的字段"""
+    return _project(record, REWARD_FIELDS, partial)
+
+
+SERIALIZERS = {
+    'tasks': compact_task,
+    'rewards': compact_reward,
+}
+
+
+def compact_records(kind, records):
+    return [SERIALIZERS[kind](record) for record in records]
+
+
+def compact_changes(kind, data):
+    """变更数据 {"records": [...], "removed": [...]} 的紧凑格式；进度等其他类型原样返回"""
+    serializer = SERIALIZERS.get(kind)
+    if serializer is None or 'records' not in data:
+        return data
+    return {
+        **data,
+        'records': [serializer(record, partial=True) for record in data['records']],
+        'removed': list(data.get('removed', ()))
+    }
+
+
+def compact_all_data(all_data):
+    return {
+        'tasks': compact_records('tasks', all_data['tasks']),
+        'progress': all_data['progress'],
+        'rewards': compact_records('rewards', all_data['rewards'])
+    }
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """使用 orjson 序列化的JSON提供者，未安装时与 Flask 默认行为一致（但不转义中文）"""
+
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        # orjson 输出紧凑格式，忽略调试模式下的缩进参数
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
@@ -12,6 +12,17 @@ const STORAGE_KEYS = {
 // 缓存过期时间（毫秒）
 const CACHE_EXPIRY = 5 * 60 * 1000; // 5分钟
 
+// 缓存数据的格式版本，接口响应格式变化时递增，旧格式的缓存会被丢弃
+const DATA_FORMAT_VERSION = '2';
+if (localStorage.getItem('data_format') !== DATA_FORMAT_VERSION) {
+    ['all_data', STORAGE_KEYS.TASKS, STORAGE_KEYS.LAST_FETCH_TIME].forEach(key => {
+        localStorage.removeItem(key);
+        localStorage.removeItem(`etag:${key}`);
+        localStorage.removeItem(`version:${key}`);
+    });
+    localStorage.setItem('data_format', DATA_FORMAT_VERSION);
+}
+
 // 网络状态
 let isOnline = navigator.onLine;
 
@@ -117,7 +128,11 @@ function showToast(message) {
     }, 2000);
 }
 
-// 通用数据获取函数，支持缓存
+// 已解析的缓存数据，避免重复解析 localStorage 中的JSON
+const parsedCache = {};
+
+// 通用数据获取函数，支持缓存、条件请求和增量合并
+// processData(缓存数据, 增量) 返回合并后的数据，默认按记录列表合并
 async function fetchData(url, storageKey, processData) {
     if (!isOnline) {
         const cachedData = localStorage.getItem(storageKey);
@@ -148,13 +163,46 @@ async function fetchData(url, storageKey, processData) {
     }
     
     try {
-        const response = await fetch(url);
+        // 条件请求：数据未变化时服务器返回304，不再传输和解析响应体
+        const headers = {};
+        const etag = localStorage.getItem(`etag:${storageKey}`);
+        if (cachedData && etag) {
+            headers['If-None-Match'] = etag;
+        }
+        // 增量请求：带上次的数据版本号，服务器只返回之后变化的记录
+        const version = localStorage.getItem(`version:${storageKey}`);
+        const requestUrl = cachedData && version
+            ? `${url}${url.includes('?') ? '&' : '?'}since=${encodeURIComponent(version)}`
+            : url;
+        
+        const response = await fetch(requestUrl, { headers });
+        const newVersion = response.headers.get('X-Data-Version');
+        if (newVersion) {
+            localStorage.setItem(`version:${storageKey}`, newVersion);
+        }
+        if (response.status === 304) {
+            localStorage.setItem(STORAGE_KEYS.LAST_FETCH_TIME, now.toString());
+            return parsedCache[storageKey] || JSON.parse(cachedData);
+        }
+        
         const result = await response.json();
         if (result.code === 0) {
+            let data = result.data;
+            if (data && data.delta) {
+                // 将增量合并到缓存数据上
+                const base = parsedCache[storageKey] || JSON.parse(cachedData);
+                data = (processData || mergeRecords)(base, data);
+            } else {
+                const newEtag = response.headers.get('ETag');
+                if (newEtag) {
+                    localStorage.setItem(`etag:${storageKey}`, newEtag);
+                }
+            }
             // 更新缓存
-            localStorage.setItem(storageKey, JSON.stringify(result.data));
+            parsedCache[storageKey] = data;
+            localStorage.setItem(storageKey, JSON.stringify(data));
             localStorage.setItem(STORAGE_KEYS.LAST_FETCH_TIME, now.toString());
-            return result.data;
+            return data;
         } else {
             throw new Error(result.message || '请求失败');
         }
@@ -195,10 +243,11 @@ async function fetchUserProgress() {
 }
 
 // 更新进度显示
-function updateProgressDisplay(progress) {
+// stars 为服务器端账本的星星账户，有账户数据时显示可用余额，否则显示今日获得的星星
+function updateProgressDisplay(progress, stars) {
     document.querySelector('.level-value').textContent = progress.current_level;
     document.querySelector('.level:nth-child(2) .level-value').textContent = 
-        progress.total_stars;
+        stars ? stars.balance : progress.total_stars;
 }
 
 // 更新任务状态
@@ -366,7 +415,7 @@ function updateTasksDisplay(tasks) {
 
     // 按任务类型分组
     const tasksByType = tasks.reduce((acc, task) => {
-        const type = task.fields['任务类型'] || '其他';
+        const type = task.type || '其他';
         if (!acc[type]) acc[type] = [];
         acc[type].push(task);
         return acc;
@@ -435,21 +484,21 @@ function updateTasksDisplay(tasks) {
         typeTasks.forEach(task => {
             const taskElement = document.createElement('div');
             taskElement.className = 'task';
-            taskElement.dataset.taskId = task.record_id;
+            taskElement.dataset.taskId = task.id;
             
             // 检查任务是否已被选中
-            const isSelected = selectedTaskIds.includes(task.record_id);
+            const isSelected = selectedTaskIds.includes(task.id);
             
             // 检查任务完成状态
-            const isCompleted = task.fields['任务完成状态'] === '是' || task.fields['已完成'];
+            const isCompleted = task.completed;
             
-            const stars = '💎'.repeat(task.fields['星星数量'] || 0);
+            const stars = '💎'.repeat(task.stars || 0);
             taskElement.innerHTML = `
                 <div class="checkbox ${isSelected ? 'selected' : ''} ${isCompleted ? 'checked disabled' : ''}"></div>
                 <div class="task-content">
                     <div class="task-text">
-                        <span class="task-name">${task.fields['任务名称']}</span>
-                        ${task.fields['任务描述'] ? `<span class="task-description"> - ${task.fields['任务描述']}</span>` : ''}
+                        <span class="task-name">${task.name}</span>
+                        ${task.description ? `<span class="task-description"> - ${task.description}</span>` : ''}
                         ${isCompleted ? '<span class="task-completed">（已打卡）</span>' : ''}
                     </div>
                 </div>
@@ -461,7 +510,7 @@ function updateTasksDisplay(tasks) {
             if (!isCompleted) { // 只有未完成的任务才能被选中
                 checkbox.addEventListener('click', () => {
                     // 切换选中状态
-                    const taskId = task.record_id;
+                    const taskId = task.id;
                     if (selectedTaskIds.includes(taskId)) {
                         // 取消选中
                         selectedTaskIds = selectedTaskIds.filter(id => id !== taskId);
@@ -489,7 +538,7 @@ function updateTasksDisplay(tasks) {
     });
 
     // 更新进度条
-    const completedTasks = tasks.filter(task => task.fields['任务完成状态'] === '是' || task.fields['已完成']);
+    const completedTasks = tasks.filter(task => task.completed);
     const completionRate = tasks.length > 0 ? (completedTasks.length / tasks.length) * 100 : 0;
     document.querySelector('.progress').style.width = `${completionRate}%`;
     document.querySelector('.progress-container p').textContent = 
@@ -648,15 +697,19 @@ async function fetchAllData() {
     try {
         const allData = await fetchData(
             `${API_BASE_URL}/all-data`,
-            'all_data'
+            'all_data',
+            mergeAllData
         );
         
         if (allData) {
+            // 保存当前数据，变更推送的增量基于它合并
+            currentData = allData;
+            
             // 更新任务列表
             updateTasksDisplay(allData.tasks);
             
             // 更新进度信息
-            updateProgressDisplay(allData.progress);
+            updateProgressDisplay(allData.progress, allData.stars);
             
             // 如果有奖励数据，可以在这里处理
             if (allData.rewards && allData.rewards.length > 0) {
@@ -691,13 +744,13 @@ function updateRewardsDisplay(rewards) {
     
     rewards.forEach(reward => {
         // 获取奖励所需星星数
-        const requiredStars = parseInt(reward.fields['所需星星数'] || reward.fields['stars_required'] || 0);
+        const requiredStars = reward.stars_required || 0;
         // 检查是否已兑换
-        const isRedeemed = reward.fields['是否已兑换'] === '是';
+        const isRedeemed = reward.redeemed;
         // 检查星星是否足够
         const hasEnoughStars = currentStars >= requiredStars;
         // 获取奖励描述
-        const rewardDescription = reward.fields['奖励描述'] || reward.fields['reward_description'] || '暂无描述';
+        const rewardDescription = reward.description || '暂无描述';
         
         const rewardItem = document.createElement('div');
         rewardItem.className = 'reward-item';
@@ -713,7 +766,7 @@ function updateRewardsDisplay(rewards) {
         
         // 根据奖励名称选择合适的图标
         let rewardIcon = '🎁';
-        const rewardName = reward.fields['奖励名称'] || reward.fields['reward_name'] || '';
+        const rewardName = reward.name || '';
         
         // 娱乐奖励图标
         if (rewardName.includes('动画片')) {
@@ -759,8 +812,8 @@ function showRedeemConfirmation(reward, currentStars) {
     const confirmDialog = document.createElement('div');
     confirmDialog.className = 'confirm-dialog';
     
-    const rewardName = reward.fields['奖励名称'] || reward.fields['reward_name'] || '未命名奖励';
-    const requiredStars = parseInt(reward.fields['所需星星数'] || reward.fields['stars_required'] || 0);
+    const rewardName = reward.name || '未命名奖励';
+    const requiredStars = reward.stars_required || 0;
     
     confirmDialog.innerHTML = `
         <div class="confirm-content">
@@ -788,6 +841,11 @@ function showRedeemConfirmation(reward, currentStars) {
         document.body.removeChild(confirmDialog);
     });
     
+    // 同一个确认对话框内的重复提交使用同一个幂等键，服务器只兑换一次
+    const idempotencyKey = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    
     // 确认按钮
     confirmButton.addEventListener('click', async () => {
         // 禁用按钮，防止重复点击
@@ -795,7 +853,7 @@ function showRedeemConfirmation(reward, currentStars) {
         confirmButton.textContent = '兑换中...';
         
         try {
-            await redeemReward(reward.record_id, currentStars);
+            await redeemReward(reward.id, idempotencyKey);
             document.body.removeChild(confirmDialog);
         } catch (error) {
             // 恢复按钮状态
@@ -807,7 +865,7 @@ function showRedeemConfirmation(reward, currentStars) {
 }
 
 // 兑换奖励API调用
-async function redeemReward(rewardId, currentStars) {
+async function redeemReward(rewardId, idempotencyKey) {
     if (!isOnline) {
         throw new Error('网络已断开，无法兑换奖励');
     }
@@ -816,11 +874,11 @@ async function redeemReward(rewardId, currentStars) {
         const response = await fetch(`${API_BASE_URL}/rewards/redeem`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey
             },
             body: JSON.stringify({
-                reward_id: rewardId,
-                current_stars: currentStars
+                reward_id: rewardId
             })
         });
         
@@ -960,5 +1018,104 @@ function startSmartRefresh() {
     }, REFRESH_INTERVAL);
 }
 
-// 启动智能刷新
-startSmartRefresh();
\ No newline at end of file
+// 停止轮询（变更推送连接正常时不需要轮询）
+function stopSmartRefresh() {
+    if (refreshInterval) {
+        clearInterval(refreshInterval);
+        refreshInterval = null;
+    }
+}
+
+// 变更推送：服务器在数据变化时推送增量，能收到全部变更时停止轮询，断开期间回退到轮询
+let changeStream = null;
+let currentData = null;
+
+// 将推送的记录增量合并到记录列表（增量只包含变化的字段，按记录ID合并，removed 中的记录被删除）
+function mergeRecords(records, changes) {
+    const byId = new Map(records.map(record => [record.id, record]));
+    changes.records.forEach(change => {
+        byId.set(change.id, { ...byId.get(change.id), ...change });
+    });
+    (changes.removed || []).forEach(recordId => byId.delete(recordId));
+    return Array.from(byId.values());
+}
+
+// 将 /all-data 的增量合并到完整数据
+function mergeAllData(base, delta) {
+    return {
+        ...base,
+        tasks: mergeRecords(base.tasks || [], delta.tasks),
+        rewards: mergeRecords(base.rewards || [], delta.rewards),
+        progress: delta.progress || base.progress,
+        stars: delta.stars || base.stars
+    };
+}
+
+// 应用一条变更事件并更新页面和本地缓存
+function applyChange(kind, data) {
+    if (!currentData) return;
+    
+    if (kind === 'tasks') {
+        currentData.tasks = mergeRecords(currentData.tasks || [], data);
+        updateTasksDisplay(currentData.tasks);
+    } else if (kind === 'rewards') {
+        currentData.rewards = mergeRecords(currentData.rewards || [], data);
+        updateRewardsDisplay(currentData.rewards);
+    } else if (kind === 'progress') {
+        currentData.progress = data;
+        updateProgressDisplay(data, currentData.stars);
+        // 奖励是否可兑换取决于当前星星数
+        updateRewardsDisplay(currentData.rewards || []);
+    }
+    
+    parsedCache['all_data'] = currentData;
+    localStorage.setItem('all_data', JSON.stringify(currentData));
+    localStorage.setItem(STORAGE_KEYS.LAST_FETCH_TIME, Date.now().toString());
+}
+
+// 丢弃缓存并重新加载全部数据
+function reloadAllData() {
+    delete parsedCache['all_data'];
+    localStorage.removeItem('all_data');
+    localStorage.removeItem('version:all_data');
+    localStorage.removeItem(STORAGE_KEYS.LAST_FETCH_TIME);
+    refreshAllData();
+}
+
+// 连接变更推送，浏览器不支持时使用轮询
+function startChangeStream() {
+    if (!window.EventSource) {
+        startSmartRefresh();
+        return;
+    }
+    
+    changeStream = new EventSource(`${API_BASE_URL}/stream`);
+    // 多个工作进程时其他进程处理的写入不会推送到本连接（complete 为 false），需要继续轮询
+    changeStream.addEventListener('ready', event => {
+        if (JSON.parse(event.data).complete) {
+            stopSmartRefresh();
+        } else if (!refreshInterval) {
+            startSmartRefresh();
+        }
+    });
+    ['tasks', 'rewards', 'progress'].forEach(kind => {
+        changeStream.addEventListener(kind, event => applyChange(kind, JSON.parse(event.data)));
+    });
+    // 服务器无法增量补齐断线期间的变更
+    changeStream.addEventListener('reload', reloadAllData);
+    // 服务器推送连接数已满，浏览器稍后自动重连，期间轮询
+    changeStream.addEventListener('busy', () => {
+        if (!refreshInterval) {
+            startSmartRefresh();
+        }
+    });
+    changeStream.addEventListener('error', () => {
+        // 浏览器会自动重连，重连成功前回退到轮询
+        if (!refreshInterval) {
+            startSmartRefresh();
+        }
+    });
+}
+
+// 启动变更推送
+startChangeStream();
\ No newline at end of file
@@ -0,0 +1,383 @@
+"""静态资源的构建与发送
+
+页面、脚本、样式和图片的源文件都放在 STATIC_DIR（默认 static/）中，应用只从该目录和构建目录发送文件，
+仓库根目录下的 Python 源码、tasks.json 等文件不再能通过 URL 读取。
+
+python static_assets.py build 生成 ASSET_BUILD_DIR（默认 static/dist/）：
+- 脚本和样式去掉注释和多余空白；安装了 rjsmin / rcssmin 时使用它们
+- 文件名带内容哈希（script.3f9c2a1b7e.js），内容变化后 URL 随之变化，可以长期缓存
+- 文本文件预先压缩为 .gz，安装了 brotli 时同时生成 .br，请求时按 Accept-Encoding 直接发送压缩好的文件
+- 样式引用的图片在安装了 Pillow 时按显示宽度生成 1x/2x 的 WebP（支持时还有 AVIF）和缩小后的 PNG，样式中改用 image-set
+- 重写 index.html，引用带哈希的文件
+
+/assets/ 下带哈希的文件按 immutable 长期缓存；首页和源文件每次都向服务器验证（ETag）。
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+from io import BytesIO
+
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+
+from config import Config
+from log_setup import setup_logging
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:  # 可选依赖
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:  # 可选依赖
+    rjsmin = None
+
+try:
+    from PIL import Image, features
+except ImportError:  # 可选依赖，未安装时图片只复制并加上哈希
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 构建后由 /assets/ 发送的文件的URL前缀
+ASSET_URL_PREFIX = '/assets/'
+MANIFEST_NAME = 'manifest.json'
+# 需要预压缩的文件类型
+PRECOMPRESS_SUFFIXES = ('.html', '.js', '.css', '.svg', '.json')
+RASTER_SUFFIXES = ('.png', '.jpg', '.jpeg')
+# 预压缩文件与 Accept-Encoding 中编码的对应关系，按优先顺序排列
+ENCODING_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+# ---- 发送 ----
+
+def send_asset(directory, filename, accept_encodings, max_age=None):
+    """发送 directory 中的文件
+
+    存在预压缩的 .br / .gz 文件且客户端支持时直接发送压缩文件；支持 ETag 条件请求和 Range 请求。
+    max_age 为 None 时每次使用前都要向服务器验证，否则按 immutable 长期缓存。
+    """
+    directory = os.path.join(current_app.root_path, directory)
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    variants = [(encoding, suffix) for encoding, suffix in ENCODING_SUFFIXES if os.path.isfile(path + suffix)]
+    encoding = accept_encodings.best_match([encoding for encoding, _ in variants])
+    suffix = dict(variants).get(encoding, '')
+
+    response = send_file(path + suffix, mimetype=mimetype, conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if variants:
+        response.vary.add('Accept-Encoding')
+    if max_age is None:
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+    else:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = True
+    return response
+
+
+def built_index(build_dir):
+    """构建目录中存在 index.html 时返回构建目录，否则返回 None"""
+    directory = os.path.join(current_app.root_path, build_dir)
+    return build_dir if os.path.isfile(os.path.join(directory, 'index.html')) else None
+
+
+# ---- 压缩与哈希 ----
+
+def _scan_string(text, start):
+    """返回从 start 处的引号开始的字符串字面量的结束位置（不含），模板字符串中的 ${...} 可以嵌套"""
+    quote = text[start]
+    index = start + 1
+    while index < len(text):
+        char = text[index]
+        if char == '\\':
+            index += 2
+            continue
+        if char == quote:
+            return index + 1
+        if quote == '`' and text.startswith('${', index):
+            index = _scan_braces(text, index + 2)
+            continue
+        index += 1
+    return len(text)
+
+
+def _scan_braces(text, start):
+    """返回与 start 之前的 { 匹配的 } 之后的位置"""
+    depth = 1
+    index = start
+    while index < len(text) and depth:
+        char = text[index]
+        if char in '\'"`':
+            index = _scan_string(text, index)
+            continue
+        depth += {'{': 1, '}': -1}.get(char, 0)
+        index += 1
+    return index
+
+
+def _split_code(text, line_comments):
+    """把源码切分为 (是否字符串, 片段)，去掉注释；字符串字面量原样保留"""
+    parts = []
+
+    def add(is_string, part):
+        # 注释两侧的代码合并为一段，压缩空白时能看到完整的上下文
+        if parts and not is_string and not parts[-1][0]:
+            parts[-1] = (False, parts[-1][1] + part)
+        else:
+            parts.append((is_string, part))
+
+    code_start = index = 0
+    while index < len(text):
+        char = text[index]
+        if char in '\'"`' if line_comments else char in '\'"':
+            add(False, text[code_start:index])
+            end = _scan_string(text, index)
+            add(True, text[index:end])
+            code_start = index = end
+        elif text.startswith('/*', index):
+            add(False, text[code_start:index] + ' ')
+            end = text.find('*/', index + 2)
+            code_start = index = len(text) if end < 0 else end + 2
+        elif line_comments and text.startswith('//', index):
+            add(False, text[code_start:index])
+            end = text.find('\n', index)
+            code_start = index = len(text) if end < 0 else end
+        else:
+            index += 1
+    add(False, text[code_start:])
+    return parts
+
+
+def minify_css(text):
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+    output = []
+    for is_string, part in _split_code(text, line_comments=False):
+        if not is_string:
+            part = re.sub(r'\s+', ' ', part)
+            # 冒号前的空白在选择器中有意义（后代选择器），只去掉冒号后的空白
+            part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+            part = re.sub(r':\s+', ':', part)
+            part = part.replace(';}', '}')
+        output.append(part)
+    return ''.join(output).strip()
+
+
+def minify_js(text):
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    output = []
+    for is_string, part in _split_code(text, line_comments=True):
+        if not is_string:
+            part = re.sub(r'[ \t]+', ' ', part)
+            # 保留换行，避免改变自动插入分号的结果
+            part = re.sub(r' ?\n\s*', '\n', part)
+            part = re.sub(r' ?([{}()\[\];,:=<>!&|?]) ?', r'\1', part)
+        output.append(part)
+    return ''.join(output).strip()
+
+
+def fingerprint(name, data):
+    """带内容哈希的文件名：styles.css -> styles.1a2b3c4d5e.css"""
+    stem, suffix = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{suffix}'
+
+
+def _write(build_dir, name, data):
+    """写入构建文件，文本文件同时写入更小的预压缩版本，返回写入的文件名"""
+    path = os.path.join(build_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if name.endswith(PRECOMPRESS_SUFFIXES):
+        compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['.br'] = brotli.compress(data, quality=11)
+        for suffix, body in compressed.items():
+            if len(body) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(body)
+    return name
+
+
+# ---- 图片 ----
+
+def _image_formats():
+    """当前 Pillow 能写出的现代图片格式，按优先顺序排列"""
+    formats = []
+    # 较早版本的 Pillow 不认识 avif 模块，不能直接 check
+    if 'avif' in features.get_supported_modules() and features.check('avif'):
+        formats.append(('avif', 'AVIF', {'quality': 55}))
+    if features.check('webp'):
+        formats.append(('webp', 'WEBP', {'quality': 80, 'method': 6}))
+    return formats
+
+
+def _encode(image, image_format, options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def build_image(source_path, name, build_dir, display_width):
+    """构建一张图片，返回 {'fallback': 兼容格式的文件名, 'sets': [(格式, [(文件名, 倍率), ...]), ...]}"""
+    with open(source_path, 'rb') as f:
+        original = f.read()
+    if Image is None:
+        return {'fallback': _write(build_dir, fingerprint(name, original), original), 'sets': []}
+
+    stem, suffix = os.path.splitext(name)
+    with Image.open(BytesIO(original)) as image:
+        image.load()
+        widths = sorted({min(display_width * scale, image.width) for scale in (1, 2)})
+        resized = {width: image if width == image.width else
+                   image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+                   for width in widths}
+        # 兼容格式使用最大的尺寸，PNG 按最大压缩级别重新编码
+        largest = resized[widths[-1]]
+        fallback_format = 'PNG' if suffix.lower() == '.png' else 'JPEG'
+        fallback_options = {'optimize': True} if fallback_format == 'PNG' else {'quality': 82, 'optimize': True}
+        fallback = _encode(largest, fallback_format, fallback_options)
+        if len(fallback) >= len(original) and largest is image:
+            fallback = original
+        result = {'fallback': _write(build_dir, fingerprint(name, fallback), fallback), 'sets': []}
+        for extension, image_format, options in _image_formats():
+            candidates = []
+            for width in widths:
+                data = _encode(resized[width], image_format, options)
+                candidates.append((_write(build_dir, fingerprint(f'{stem}-{width}.{extension}', data), data),
+                                   round(width / display_width, 2)))
+            result['sets'].append((extension, candidates))
+    return result
+
+
+def _image_set(image):
+    """image-set() 写法，浏览器按支持的格式和屏幕像素密度选择"""
+    candidates = [f'url({ASSET_URL_PREFIX}{name}) type("image/{extension}") {scale:g}x'
+                  for extension, names in image['sets'] for name, scale in names]
+    candidates += [f'url({ASSET_URL_PREFIX}{image["fallback"]}) 1x']
+    return f'image-set({",".join(candidates)})'
+
+
+_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def _split_declarations(block):
+    """按分号切分声明，字符串中的分号不切分"""
+    declarations = ['']
+    for is_string, part in _split_code(block, line_comments=False):
+        if is_string:
+            declarations[-1] += part
+            continue
+        pieces = part.split(';')
+        declarations[-1] += pieces[0]
+        declarations.extend(pieces[1:])
+    return declarations
+
+
+def _rewrite_css(css, source_dir, build_dir, display_width, manifest):
+    """把样式中引用的本地图片替换为构建后的文件；有现代格式时追加一条使用 image-set 的声明"""
+    images = {}
+
+    def local_image(reference):
+        if reference.startswith(('data:', 'http:', 'https:', '//', '/')) or not reference.lower().endswith(RASTER_SUFFIXES):
+            return None
+        if reference not in images:
+            source_path = os.path.join(source_dir, reference)
+            images[reference] = build_image(source_path, reference, build_dir, display_width)
+            manifest[reference] = images[reference]['fallback']
+        return images[reference]
+
+    def rewrite_rule(match):
+        output = []
+        for declaration in _split_declarations(match.group(2)):
+            found = [(m, local_image(m.group(2))) for m in _URL_PATTERN.finditer(declaration)]
+            found = [(m, image) for m, image in found if image]
+            if not found:
+                output.append(declaration)
+                continue
+            fallback, modern = declaration, declaration
+            for m, image in found:
+                fallback = fallback.replace(m.group(0), f'url({ASSET_URL_PREFIX}{image["fallback"]})')
+                modern = modern.replace(m.group(0), _image_set(image))
+            output.append(fallback)
+            # 不支持 image-set 的浏览器忽略这条声明，继续使用上一条
+            if any(image['sets'] for _, image in found):
+                output.append(modern)
+        return f'{match.group(1)}{{{";".join(output)}}}'
+
+    return re.sub(r'([^{}]*)\{([^{}]*)\}', rewrite_rule, css)
+
+
+# ---- 构建 ----
+
+def build(source_dir, build_dir, clean=False, display_width=800):
+    """构建静态资源，返回清单 {源文件名: 构建后的文件名}"""
+    if clean and os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    manifest = {}
+
+    def read(name):
+        with open(os.path.join(source_dir, name), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    css = _rewrite_css(minify_css(read('styles.css')), source_dir, build_dir, display_width, manifest)
+    data = css.encode('utf-8')
+    manifest['styles.css'] = _write(build_dir, fingerprint('styles.css', data), data)
+    data = minify_js(read('script.js')).encode('utf-8')
+    manifest['script.js'] = _write(build_dir, fingerprint('script.js', data), data)
+
+    html = read('index.html')
+    for source in ('styles.css', 'script.js'):
+        html = re.sub(rf'(href|src)=(["\']){re.escape(source)}\2', rf'\1=\2{ASSET_URL_PREFIX}{manifest[source]}\2', html)
+    # 首页不带哈希，每次向服务器验证，部署后立即引用新的文件
+    _write(build_dir, 'index.html', html.encode('utf-8'))
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='静态资源构建')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='压缩、加哈希、预压缩静态资源并转换图片')
+    build_parser.add_argument('--clean', action='store_true', help='先删除旧的构建结果（已打开旧页面的客户端将无法加载旧文件）')
+    build_parser.add_argument('--display-width', type=int, default=800, help='样式中图片的最大显示宽度（CSS像素）')
+    args = parser.parse_args()
+
+    setup_logging()
+    if Image is None:
+        logger.warning('未安装 Pillow，图片只复制并加上哈希，不转换格式和尺寸')
+    manifest = build(Config.STATIC_DIR, Config.ASSET_BUILD_DIR, clean=args.clean, display_width=args.display_width)
+    for source, target in manifest.items():
+        source_size = os.path.getsize(os.path.join(Config.STATIC_DIR, source))
+        target_path = os.path.join(Config.ASSET_BUILD_DIR, target)
+        sizes = [f'{os.path.getsize(target_path)} B'] + [
+            f'{suffix[1:]} {os.path.getsize(target_path + suffix)} B'
+            for _, suffix in ENCODING_SUFFIXES if os.path.isfile(target_path + suffix)]
+        print(f'{source} ({source_size} B) -> {target} ({", ".join(sizes)})')
+
+
+if __name__ == '__main__':
+    main()
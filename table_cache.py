@@ -0,0 +1,356 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from file_lock import FileLock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class SharedGenerations:
+    """保存在磁盘上的各数据表写入版本号，供同一台机器上的多个工作进程共用
+
+    任一进程写入数据表后把版本号加一，其他进程读取缓存时发现版本号变化即重新加载。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, table_id):
+        return os.path.join(self.directory, f'{table_id}.generation')
+
+    def read(self, table_id):
+        try:
+            with open(self._path(table_id), 'r', encoding='utf-8') as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self, table_id):
+        """版本号加一，返回 (加一前的版本号, 新版本号)"""
+        path = self._path(table_id)
+        with FileLock(f'{path}.lock'):
+            current = self.read(table_id)
+            write_atomic(path, str(current + 1))
+        return current, current + 1
+
+
+class TableSnapshots:
+    """各数据表最后一次成功加载的快照，以 tasks.json 的格式（{"code": 0, "data": [记录...]}）保存在磁盘上
+
+    进程启动时用来预热缓存，上游不可用时作为兜底数据；文件的修改时间就是快照的获取时间。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._digests = {}  # table_id -> 上次写入内容的哈希
+
+    def _path(self, table_id):
+        return os.path.join(self.directory, f'{table_id}.json')
+
+    def load(self, table_id):
+        """返回 (记录列表, 获取时间戳)，没有快照或文件已损坏时返回 None"""
+        path = self._path(table_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)['data']
+            return records, os.path.getmtime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, table_id, records):
+        path = self._path(table_id)
+        data = json.dumps({'code': 0, 'data': records}, indent=2) + '\n'
+        digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        if self._digests.get(table_id) == digest and os.path.exists(path):
+            # 内容没有变化时只更新修改时间
+            os.utime(path)
+            return
+        write_atomic(path, data)
+        self._digests[table_id] = digest
+
+
+class TableCache:
+    """数据表快照的进程内读穿缓存
+
+    - 每个数据表缓存一份完整的记录列表，超过 ttl 秒后重新加载
+    - 同一数据表并发未命中时只有一个线程去上游加载，其余线程等待结果（single-flight）
+    - 写操作通过 patch_record / add_record / invalidate 精确更新缓存
+    - 缓存中的记录按"写时复制"处理，已经返回给调用方的列表不会被后续写操作修改
+    - 传入 shared（SharedGenerations）时，其他工作进程写入数据表后本进程的缓存随之失效
+    - 只读调用方（get 传入 allow_stale=True）可以接受旧数据：过期不超过 stale_ttl 秒的快照直接返回，
+      同时在后台线程重新加载（stale-while-revalidate）；加载失败时返回最后一份成功加载的数据并通过
+      freshness 标明。写操作和内部调用只使用有效期内的数据，加载失败时看到异常
+    - 传入 snapshots（TableSnapshots）时最后一份成功加载的数据同时保存到磁盘，进程启动时由 preload 读回
+    """
+
+    def __init__(self, ttl, shared=None, stale_ttl=0, snapshots=None):
+        self.ttl = ttl
+        self.shared = shared
+        self.stale_ttl = stale_ttl
+        self.snapshots = snapshots
+        self._lock = threading.Lock()
+        self._entries = {}      # table_id -> (records, loaded_at, 跨进程版本号)
+        self._loading = {}      # table_id -> threading.Event
+        self._generations = {}  # table_id -> 写入版本号，用于丢弃加载期间被写入覆盖的旧数据
+        self._last_good = {}    # table_id -> (records, 获取时间戳, 来源)，加载失败时的兜底数据，不随失效清除
+        self._errors = {}       # table_id -> 最近一次加载失败的原因，加载成功后清除
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.loads = 0
+        self.revalidations = 0
+        self.fallbacks = 0
+        self.invalidations = 0
+
+    def get(self, table_id, loader, allow_stale=False):
+        """读取数据表快照，未命中或过期时调用 loader() 从上游加载
+
+        allow_stale 为 True（只读接口）时，过期不久的快照先直接返回并在后台刷新，加载失败时返回
+        最后一次成功加载的数据；为 False（写操作和内部调用）时只返回有效期内的数据，加载失败时抛出异常。
+        从未加载成功过时总是抛出 loader 的异常。
+        """
+        while True:
+            shared_generation = self.shared.read(table_id) if self.shared else 0
+            with self._lock:
+                entry = self._entries.get(table_id)
+                # 其他进程写入过的快照已不可信，不能当作旧数据直接返回
+                if entry and entry[2] == shared_generation:
+                    age = time.monotonic() - entry[1]
+                    if age < self.ttl:
+                        self.hits += 1
+                        return list(entry[0])
+                    if allow_stale and age < self.ttl + self.stale_ttl:
+                        self.stale_hits += 1
+                        if table_id not in self._loading:
+                            self.revalidations += 1
+                            event, generation = self._begin_load(table_id)
+                            threading.Thread(target=self._revalidate, name=f'cache-revalidate-{table_id}', daemon=True,
+                                             args=(table_id, loader, event, generation, shared_generation)).start()
+                        return list(entry[0])
+                event = self._loading.get(table_id)
+                if event is None:
+                    # 当前线程负责加载
+                    self.misses += 1
+                    event, generation = self._begin_load(table_id)
+                    break
+                self.coalesced += 1
+            # 等待正在进行的加载完成后重新读取；加载失败时返回兜底数据，不接受旧数据或没有兜底数据时下一轮由当前线程重试
+            event.wait()
+            if allow_stale and getattr(event, 'failed', False):
+                records = self._fallback(table_id)
+                if records is not None:
+                    return records
+
+        try:
+            return self._load(table_id, loader, event, generation, shared_generation)
+        except Exception:
+            if not allow_stale:
+                raise
+            records = self._fallback(table_id)
+            if records is None:
+                raise
+            return records
+
+    def _fallback(self, table_id):
+        """返回最后一次成功加载的数据，没有时返回 None"""
+        with self._lock:
+            last_good = self._last_good.get(table_id)
+            if last_good is None:
+                return None
+            self.fallbacks += 1
+        logger.warning('加载数据表 %s 失败，返回 %.0f 秒前的快照', table_id, time.time() - last_good[1])
+        return list(last_good[0])
+
+    def _begin_load(self, table_id):
+        """登记由当前调用方负责加载，调用时需持有锁"""
+        event = threading.Event()
+        self._loading[table_id] = event
+        return event, self._generations.get(table_id, 0)
+
+    def _load(self, table_id, loader, event, generation, shared_generation):
+        try:
+            records = loader()
+        except Exception as e:
+            with self._lock:
+                self._errors[table_id] = str(e)
+                self._loading.pop(table_id, None)
+            event.failed = True
+            event.set()
+            raise
+
+        with self._lock:
+            self.loads += 1
+            self._errors.pop(table_id, None)
+            # 加载期间如果发生了写操作，这份数据可能已经过时，不写入缓存
+            current = self._generations.get(table_id, 0) == generation
+            if current:
+                self._entries[table_id] = (list(records), time.monotonic(), shared_generation)
+                self._last_good[table_id] = (list(records), time.time(), 'upstream')
+            self._loading.pop(table_id, None)
+        event.set()
+        if current and self.snapshots is not None:
+            try:
+                self.snapshots.save(table_id, records)
+            except OSError as e:
+                logger.warning('保存数据表 %s 的快照失败: %s', table_id, e)
+        return list(records)
+
+    def _revalidate(self, table_id, loader, event, generation, shared_generation):
+        """后台重新加载；失败时保留旧快照，下一次读取再重试"""
+        try:
+            self._load(table_id, loader, event, generation, shared_generation)
+        except Exception as e:
+            logger.warning('后台刷新数据表 %s 失败，继续返回旧快照: %s', table_id, e)
+
+    def preload(self, table_ids):
+        """由磁盘快照预热缓存，冷启动的进程在第一次上游请求完成之前就可以返回数据
+
+        快照可能缺少保存之后的写入，按已过期处理：不超过 stale_ttl 时直接返回并在后台刷新，
+        更旧的快照只在上游加载失败时使用。
+        """
+        if self.snapshots is None:
+            return
+        for table_id in table_ids:
+            snapshot = self.snapshots.load(table_id)
+            if snapshot is None:
+                continue
+            records, fetched_at = snapshot
+            age = max(time.time() - fetched_at, self.ttl)
+            shared_generation = self.shared.read(table_id) if self.shared else 0
+            with self._lock:
+                if table_id in self._last_good:
+                    continue
+                self._last_good[table_id] = (records, fetched_at, 'snapshot')
+                if age < self.ttl + self.stale_ttl:
+                    self._entries[table_id] = (records, time.monotonic() - age, shared_generation)
+            logger.info('由磁盘快照预热数据表 %s: %d 条记录，%.0f 秒前保存', table_id, len(records),
+                        time.time() - fetched_at)
+
+    def freshness(self, table_id):
+        """当前可读数据的新鲜度，从未加载过时返回 None
+
+        返回 {'stale', 'age', 'fetched_at', 'source', 'error'}：超过 ttl 或最近一次加载失败时 stale 为 True，
+        source 为 upstream（本进程加载）或 snapshot（磁盘快照），error 为最近一次加载失败的原因。
+        """
+        with self._lock:
+            last_good = self._last_good.get(table_id)
+            if last_good is None:
+                return None
+            age = max(time.time() - last_good[1], 0)
+            error = self._errors.get(table_id)
+            return {
+                'stale': age >= self.ttl or error is not None,
+                'age': round(age, 1),
+                'fetched_at': last_good[1],
+                'source': last_good[2],
+                'error': error
+            }
+
+    def generation(self, table_id):
+        """本进程内该数据表的写入版本号，每次写入或失效时加一"""
+        with self._lock:
+            return self._generations.get(table_id, 0)
+
+    def peek(self, table_id):
+        """返回缓存中的快照（即使已过期），没有缓存时返回 None，不会触发加载"""
+        with self._lock:
+            entry = self._entries.get(table_id)
+            return list(entry[0]) if entry else None
+
+    def patch_record(self, table_id, record_id, fields):
+        """将写入成功的字段合并到缓存中的对应记录，返回写入后本进程的版本号"""
+        with self._lock:
+            # 在锁内更新跨进程版本号，本进程的并发写入按顺序推进版本号，不会误判为其他进程的写入
+            shared_generation = self._bump_shared(table_id)
+            self._bump(table_id)
+            entry = self._current_entry(table_id, shared_generation)
+            if not entry:
+                return self._generations[table_id]
+            records, loaded_at = entry[:2]
+            for index, record in enumerate(records):
+                if record.get('record_id') == record_id:
+                    patched = dict(record)
+                    patched['fields'] = {**record.get('fields', {}), **fields}
+                    records = list(records)
+                    records[index] = patched
+                    self._entries[table_id] = (records, loaded_at, shared_generation[1])
+                    self._keep_last_good(table_id, records)
+                    return self._generations[table_id]
+            # 缓存中找不到该记录，说明快照已不完整，直接失效
+            self._entries.pop(table_id, None)
+            self.invalidations += 1
+            return self._generations[table_id]
+
+    def add_record(self, table_id, record):
+        """将新创建的记录追加到缓存中，返回写入后本进程的版本号"""
+        with self._lock:
+            shared_generation = self._bump_shared(table_id)
+            self._bump(table_id)
+            entry = self._current_entry(table_id, shared_generation)
+            if entry and record:
+                self._entries[table_id] = (entry[0] + [record], entry[1], shared_generation[1])
+                self._keep_last_good(table_id, self._entries[table_id][0])
+            return self._generations[table_id]
+
+    def invalidate(self, table_id=None):
+        """使指定数据表（或全部数据表）的缓存失效，启用跨进程共享时其他进程的缓存也会失效"""
+        with self._lock:
+            table_ids = [table_id] if table_id else list(self._entries)
+            for key in table_ids:
+                self._bump_shared(key)
+                self._bump(key)
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def _keep_last_good(self, table_id, records):
+        """写入后的快照同时作为兜底数据，获取时间不变"""
+        last_good = self._last_good.get(table_id)
+        if last_good is not None:
+            self._last_good[table_id] = (records, last_good[1], last_good[2])
+
+    def _bump(self, table_id):
+        self._generations[table_id] = self._generations.get(table_id, 0) + 1
+
+    def _bump_shared(self, table_id):
+        return self.shared.bump(table_id) if self.shared else (0, 0)
+
+    def _current_entry(self, table_id, shared_generation):
+        """返回可以在本地直接修改的缓存项
+
+        加一前的跨进程版本号与缓存项不一致，说明其他进程在此之前写入过，缓存已不可信，直接丢弃。
+        """
+        entry = self._entries.get(table_id)
+        if entry and entry[2] != shared_generation[0]:
+            self._entries.pop(table_id, None)
+            self.invalidations += 1
+            return None
+        return entry
+
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'loads': self.loads,
+                'revalidations': self.revalidations,
+                'fallbacks': self.fallbacks,
+                'load_errors': dict(self._errors),
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'tables': len(self._entries),
+                'shared': self.shared is not None,
+                'snapshots': self.snapshots.directory if self.snapshots is not None else None
+            }
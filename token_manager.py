@@ -0,0 +1,163 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from file_lock import FileLock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class TenantTokenManager:
+    """飞书 tenant_access_token 管理器
+
+    - 进程内单飞：令牌失效时只有一个线程去飞书获取，其余线程等待并复用结果
+    - 提前刷新：剩余有效期少于 refresh_ahead 秒时，在后台线程中刷新，请求线程继续使用旧令牌
+    - 跨进程共享：设置 cache_path 后，令牌保存在磁盘文件中，多个工作进程在文件锁保护下共用同一个令牌
+    """
+
+    # 令牌剩余有效期少于该值时不再使用，必须同步刷新（秒）
+    EXPIRY_MARGIN = 30
+    # 两次提前刷新之间的最短间隔（秒）；飞书只在剩余有效期少于30分钟时才会下发新令牌
+    MIN_RETRY_INTERVAL = 60
+
+    def __init__(self, fetch_token, refresh_ahead, cache_path=''):
+        """fetch_token() 向飞书请求令牌，返回 (令牌, 有效期秒数)"""
+        self._fetch_token = fetch_token
+        self.refresh_ahead = refresh_ahead
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._flag_lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._last_attempt = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh_count = 0
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    def get_token(self):
+        """返回可用的令牌，必要时刷新"""
+        token, expires_at = self._token, self._expires_at
+        remaining = expires_at - time.time()
+        if token and remaining > self.refresh_ahead:
+            return token
+        if token and remaining > self.EXPIRY_MARGIN:
+            self._refresh_in_background()
+            return token
+        return self._refresh(self.EXPIRY_MARGIN)
+
+    def invalidate(self, token):
+        """飞书返回令牌无效时调用，强制下一次获取新令牌
+
+        只有当前令牌仍是 token 时才会丢弃，避免多个线程同时收到401时重复刷新。
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+        return self._refresh(self.EXPIRY_MARGIN, reject=token)
+
+    def _usable(self, min_remaining, reject):
+        return (self._token and self._token != reject
+                and self._expires_at - time.time() > min_remaining)
+
+    def _refresh(self, min_remaining, reject=None):
+        with self._lock:
+            # 等待锁期间其他线程可能已经刷新过
+            if self._usable(min_remaining, reject):
+                return self._token
+            with self._shared_lock():
+                # 其他进程可能已经刷新并写入了共享缓存
+                self._load_shared(reject)
+                if self._usable(min_remaining, reject):
+                    return self._token
+                self._last_attempt = time.time()
+                token, expire = self._fetch_token()
+                self._token = token
+                self._expires_at = time.time() + expire
+                self.refresh_count += 1
+                self._save_shared()
+                return token
+
+    def _refresh_in_background(self):
+        with self._flag_lock:
+            if self._refreshing or time.time() - self._last_attempt < self.MIN_RETRY_INTERVAL:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='token-refresh', daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh(self.refresh_ahead)
+        except Exception as e:
+            logger.warning('后台刷新访问令牌失败: %s', e)
+        finally:
+            with self._flag_lock:
+                self._refreshing = False
+
+    # ---- 跨进程共享 ----
+
+    def _shared_lock(self):
+        if not self.cache_path:
+            return contextlib.nullcontext()
+        return FileLock(f'{self.cache_path}.lock')
+
+    def _load_shared(self, reject=None):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get('token') and cached.get('token') != reject and cached.get('expires_at', 0) > self._expires_at:
+            self._token = cached['token']
+            self._expires_at = cached['expires_at']
+
+    def _save_shared(self):
+        if not self.cache_path:
+            return
+        # 令牌文件从创建起就只有当前用户可读
+        write_atomic(self.cache_path, json.dumps({'token': self._token, 'expires_at': self._expires_at}), mode=0o600)
+
+    # ---- 主动刷新线程 ----
+
+    def start(self):
+        """启动后台线程，在令牌进入刷新窗口时主动刷新"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='token-manager', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self._expires_at - self.refresh_ahead - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            try:
+                self._refresh(self.refresh_ahead)
+            except Exception as e:
+                logger.warning('主动刷新访问令牌失败: %s', e)
+            # 飞书可能返回剩余有效期不变的同一个令牌，留出间隔避免反复请求
+            self._stop.wait(self.MIN_RETRY_INTERVAL)
+
+    def status(self):
+        return {
+            'has_token': bool(self._token),
+            'expires_in': round(self._expires_at - time.time(), 1) if self._token else None,
+            'refresh_count': self.refresh_count,
+            'shared': bool(self.cache_path)
+        }
@@ -0,0 +1,216 @@
+"""上游调用追踪与延迟指标
+
+FeishuAPI 发出的每一次HTTP请求（包括重试）都会记录接口、数据表、状态、响应大小和耗时，
+并归属到发起它的 Flask 请求上，用于：
+- 每个请求的上游调用汇总（响应头 X-Upstream-Calls / Server-Timing）
+- Prometheus 文本格式的 /metrics（按路由和按上游操作的延迟直方图）
+- 慢请求日志：处理时间超过阈值的请求输出每一次上游调用的明细
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 当前正在处理的入站请求；线程池中执行的任务需要通过 contextvars.copy_context() 传递
+_current_trace = contextvars.ContextVar('feishu_request_trace', default=None)
+
+_RECORDS = r'/bitable/v1/apps/[^/]+/tables/(?P<table>[^/]+)/records'
+_OPERATIONS = [
+    ('POST', re.compile(r'/auth/v3/tenant_access_token/internal$'), 'token'),
+    ('GET', re.compile(r'/bitable/v1/apps/[^/]+/tables$'), 'list_tables'),
+    ('GET', re.compile(f'{_RECORDS}$'), 'list_records'),
+    ('POST', re.compile(f'{_RECORDS}$'), 'create_record'),
+    ('POST', re.compile(f'{_RECORDS}/search$'), 'search_records'),
+    ('POST', re.compile(f'{_RECORDS}/batch_create$'), 'batch_create'),
+    ('POST', re.compile(f'{_RECORDS}/batch_update$'), 'batch_update'),
+    ('GET', re.compile(f'{_RECORDS}/[^/]+$'), 'get_record'),
+    ('PUT', re.compile(f'{_RECORDS}/[^/]+$'), 'update_record'),
+]
+
+
+def classify(method, path):
+    """把上游请求归类为 (操作名, 数据表ID)，无法识别时操作名为 other"""
+    for op_method, pattern, name in _OPERATIONS:
+        match = pattern.search(path)
+        if op_method == method and match:
+            return name, match.groupdict().get('table')
+    return 'other', None
+
+
+class Histogram:
+    """累积分桶的延迟直方图，由 Tracer 的锁保护"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class RequestTrace:
+    """一个入站请求期间发出的全部上游调用"""
+
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.calls = []
+
+    def summary(self, status, duration):
+        return {
+            'method': self.method,
+            'route': self.route,
+            'status': status,
+            'duration': round(duration, 4),
+            'upstream_calls': len(self.calls),
+            'upstream_duration': round(sum(call['duration'] for call in self.calls), 4),
+            'upstream_bytes': sum(call['bytes'] for call in self.calls),
+            'calls': list(self.calls)
+        }
+
+
+class Tracer:
+    """记录上游调用并汇总为请求级摘要和 Prometheus 指标"""
+
+    def __init__(self, slow_threshold=0, buckets=DEFAULT_BUCKETS, keep_slow=50):
+        self.slow_threshold = slow_threshold
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._upstream = {}
+        self._upstream_bytes = {}
+        self._request_calls = {}
+        self._slow = deque(maxlen=keep_slow)
+
+    @classmethod
+    def from_config(cls):
+        return cls(Config.SLOW_REQUEST_THRESHOLD)
+
+    # ---- 入站请求 ----
+
+    def start_request(self, method, route):
+        """开始追踪一个入站请求，返回 (追踪对象, 用于 end_request 的上下文标记)"""
+        trace = RequestTrace(method, route)
+        return trace, _current_trace.set(trace)
+
+    def end_request(self, trace, context_token, status):
+        """结束追踪，记录路由指标，返回请求摘要"""
+        _current_trace.reset(context_token)
+        duration = time.perf_counter() - trace.started
+        summary = trace.summary(status, duration)
+        key = (trace.route, trace.method, str(status))
+        with self._lock:
+            self._histogram(self._routes, key).observe(duration)
+            calls_key = (trace.route, trace.method)
+            self._request_calls[calls_key] = self._request_calls.get(calls_key, 0) + len(trace.calls)
+        if self.slow_threshold and duration >= self.slow_threshold:
+            self._slow.append(summary)
+            self._log_slow(summary)
+        return summary
+
+    def _log_slow(self, summary):
+        calls = '; '.join(
+            f'{call["operation"]} {call["table"] or "-"} {call["status"]}/{call["code"]} '
+            f'{call["bytes"]}B {call["duration"] * 1000:.0f}ms'
+            for call in summary['calls']
+        )
+        # 完整的调用明细作为结构化字段附加，JSON 格式输出时可直接检索
+        logger.warning('慢请求: %s %s %s 耗时 %.0f ms, 上游调用 %d 次 共 %.0f ms [%s]',
+                       summary['method'], summary['route'], summary['status'], summary['duration'] * 1000,
+                       summary['upstream_calls'], summary['upstream_duration'] * 1000, calls,
+                       extra={'trace': summary})
+
+    def slow_requests(self):
+        """最近的慢请求摘要，最新的在前"""
+        return list(reversed(self._slow))
+
+    # ---- 上游调用 ----
+
+    def record_upstream(self, method, path, status, code, size, duration):
+        """记录一次上游HTTP请求；status 为 HTTP 状态码，网络错误时为 'error'"""
+        operation, table = classify(method, path)
+        call = {
+            'operation': operation,
+            'table': table,
+            'status': status,
+            'code': code,
+            'bytes': size,
+            'duration': round(duration, 4)
+        }
+        with self._lock:
+            self._histogram(self._upstream, (operation, str(status))).observe(duration)
+            self._upstream_bytes[operation] = self._upstream_bytes.get(operation, 0) + size
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.calls.append(call)
+        return call
+
+    def _histogram(self, family, key):
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram(self.buckets)
+        return histogram
+
+    # ---- Prometheus 输出 ----
+
+    def render_metrics(self):
+        """按 Prometheus 文本格式输出全部指标"""
+        lines = []
+        with self._lock:
+            lines += _render_histogram(
+                'app_request_duration_seconds', '入站请求的处理时间',
+                ('route', 'method', 'status'), self._routes)
+            lines += [
+                '# HELP app_request_upstream_calls_total 入站请求触发的上游调用次数',
+                '# TYPE app_request_upstream_calls_total counter',
+            ] + [
+                f'app_request_upstream_calls_total{_labels(("route", "method"), key)} {value}'
+                for key, value in sorted(self._request_calls.items())
+            ]
+            lines += _render_histogram(
+                'feishu_upstream_duration_seconds', '飞书接口单次请求的耗时',
+                ('operation', 'status'), self._upstream)
+            lines += [
+                '# HELP feishu_upstream_response_bytes_total 飞书接口返回的响应体字节数',
+                '# TYPE feishu_upstream_response_bytes_total counter',
+            ] + [
+                f'feishu_upstream_response_bytes_total{_labels(("operation",), (operation,))} {value}'
+                for operation, value in sorted(self._upstream_bytes.items())
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _render_histogram(name, help_text, label_names, family):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(family.items()):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{_labels(label_names, key, le=bound)} {count}')
+        lines.append(f'{name}_bucket{_labels(label_names, key, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(label_names, key)} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{_labels(label_names, key)} {histogram.count}')
+    return lines
@@ -0,0 +1,122 @@
+"""按用户保存的任务完成状态（多用户模式）
+
+任务表由同一个多维表格中的所有用户共用，表中的"任务完成状态"列是全局的。启用 MULTI_USER_ENABLED 后，
+每个用户每个任务日完成了哪些任务保存在本地SQLite中，以 (用户ID, 任务日, 任务ID) 为主键：
+- 打卡只写入当前用户的记录，不再修改任务表
+- 任务日变化后自然从空状态开始，不需要逐条重置
+- 最近访问的用户的完成集合按用户分区缓存在内存中（LRU），读取一个用户的状态不受用户总数影响
+
+多个工作进程共用 SHARED_STATE_DIR 下的同一个数据库；其他进程写入后（PRAGMA data_version 变化）本进程的分区缓存全部失效。
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+class UserCompletionStore:
+    """用户任务完成状态的存储和按用户分区的缓存"""
+
+    def __init__(self, db_path, business_date, cache_size=10000):
+        self.db_path = db_path
+        # 返回当前任务日（YYYY-MM-DD）的函数，与每日重置使用相同的时区和重置时间
+        self.business_date = business_date
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS completions (
+                user_id TEXT NOT NULL,
+                business_date TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (user_id, business_date, task_id)
+            ) WITHOUT ROWID;
+        ''')
+        self._conn.commit()
+        self._data_version = self._read_data_version()
+        # 用户ID -> (任务日, 已完成任务ID集合)
+        self._partitions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, business_date):
+        path = Config.USER_STATE_DB_PATH or (
+            os.path.join(Config.SHARED_STATE_DIR, 'user_state.db') if Config.SHARED_STATE_DIR else 'user_state.db')
+        return cls(path, business_date, Config.USER_CACHE_SIZE)
+
+    def _read_data_version(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _partition(self, user_id, business_date):
+        """返回用户当前任务日的完成集合（调用方持有锁）"""
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            # 其他进程写入过，无法确定影响了哪些用户，整体失效
+            self._partitions.clear()
+            self._data_version = data_version
+        partition = self._partitions.get(user_id)
+        if partition is not None and partition[0] == business_date:
+            self._partitions.move_to_end(user_id)
+            self.hits += 1
+            return partition[1]
+        self.misses += 1
+        completed = {row[0] for row in self._conn.execute(
+            'SELECT task_id FROM completions WHERE user_id = ? AND business_date = ?', (user_id, business_date))}
+        self._partitions[user_id] = (business_date, completed)
+        self._partitions.move_to_end(user_id)
+        while len(self._partitions) > self.cache_size:
+            self._partitions.popitem(last=False)
+            self.evictions += 1
+        return completed
+
+    def completed(self, user_id):
+        """用户在当前任务日已完成的任务ID集合"""
+        with self._lock:
+            return frozenset(self._partition(user_id, self.business_date()))
+
+    def set_completed(self, user_id, task_ids, completed=True):
+        """设置用户当前任务日的任务完成状态，返回状态实际发生变化的任务ID列表"""
+        business_date = self.business_date()
+        with self._lock:
+            current = self._partition(user_id, business_date)
+            changed = [task_id for task_id in dict.fromkeys(task_ids) if (task_id in current) != completed]
+            if not changed:
+                return []
+            with self._conn:
+                if completed:
+                    now = time.time()
+                    self._conn.executemany(
+                        'INSERT OR IGNORE INTO completions (user_id, business_date, task_id, completed_at) '
+                        'VALUES (?, ?, ?, ?)', [(user_id, business_date, task_id, now) for task_id in changed])
+                else:
+                    self._conn.executemany(
+                        'DELETE FROM completions WHERE user_id = ? AND business_date = ? AND task_id = ?',
+                        [(user_id, business_date, task_id) for task_id in changed])
+            updated = current | set(changed) if completed else current - set(changed)
+            self._partitions[user_id] = (business_date, updated)
+            # 自己的提交不会改变本连接看到的 data_version
+            return changed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'cached_users': len(self._partitions),
+                'cache_size': self.cache_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,319 @@
+"""打卡写入的本地日志（write-behind）
+
+启用 JOURNAL_ENABLED 后，打卡不再同步等待飞书写入：任务完成状态和进度记录先写入本地SQLite日志，
+本地缓存和进度随即更新并返回，后台线程再把日志批量回放到飞书：
+- task_status  任务完成状态，合并为批量更新；回放时任务日已经变化（已每日重置）的条目直接跳过
+- progress     用户进度表的新记录，合并为批量创建
+
+每批条目在第一次提交前分配固定的 client_token 并写入日志，失败重试时按原批次、原 token 重新提交，
+飞书对相同 token 的创建只执行一次，进程在提交后、标记完成前退出也不会重复创建。
+失败的批次按指数退避重试，超过 JOURNAL_MAX_ATTEMPTS 次后标记为 failed，可通过 /api/journal/retry 重新排队。
+
+用法:
+    python write_journal.py status       查看待回放和失败的条目
+    python write_journal.py flush        立即回放一次
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+from file_lock import FileLock
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteJournal:
+    """本地持久化的写入日志与后台回放"""
+
+    # 重试间隔的上限（秒）
+    RETRY_BACKOFF_MAX = 300
+    # 已回放的条目保留的时间（秒），供排查问题
+    DONE_RETENTION = 7 * 86400
+
+    def __init__(self, api, db_path, business_date, flush_interval, batch_window, max_attempts):
+        self.api = api
+        self.db_path = db_path
+        # 返回当前任务日（YYYY-MM-DD）的函数，与每日重置使用相同的时区和重置时间
+        self.business_date = business_date
+        self.flush_interval = flush_interval
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # 多个工作进程共用同一个日志文件时，同一时间只有一个进程回放
+        self._flush_lock_path = f'{db_path}.flush.lock'
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                business_date TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                batch_token TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                done_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS entries_status ON entries (status, next_attempt_at);
+        ''')
+        self._conn.commit()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_flush_at = None
+        self.last_error = None
+        self.flushed = 0
+
+    @classmethod
+    def from_config(cls, api, business_date):
+        path = Config.JOURNAL_DB_PATH or (
+            os.path.join(Config.SHARED_STATE_DIR, 'write_journal.db') if Config.SHARED_STATE_DIR else 'write_journal.db')
+        return cls(api, path, business_date, Config.JOURNAL_FLUSH_INTERVAL,
+                   Config.JOURNAL_BATCH_WINDOW, Config.JOURNAL_MAX_ATTEMPTS)
+
+    # ---- 写入 ----
+
+    def append(self, user_id, entries):
+        """在一个事务中写入多条条目，entries 为 [(kind, payload), ...]，返回条目ID列表"""
+        business_date = self.business_date()
+        now = time.time()
+        with self._lock, self._conn:
+            ids = [self._conn.execute(
+                'INSERT INTO entries (kind, user_id, business_date, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                (kind, user_id, business_date, json.dumps(payload, ensure_ascii=False), now)).lastrowid
+                for kind, payload in entries]
+        # 唤醒后台线程尽快回放
+        self._wakeup.set()
+        return ids
+
+    def pending_fields(self):
+        """当前任务日还未回放的任务字段 {record_id: fields}，任务表从飞书重新加载时覆盖到加载结果上"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM entries WHERE kind = 'task_status' AND status = 'pending' "
+                'AND business_date = ? ORDER BY id', (self.business_date(),)).fetchall()
+        fields = {}
+        for row in rows:
+            payload = json.loads(row['payload'])
+            fields.setdefault(payload['record_id'], {}).update(payload['fields'])
+        return fields
+
+    # ---- 回放 ----
+
+    def flush(self, blocking=True):
+        """回放所有到期的条目，返回 {'done': 成功条数, 'skipped': 跳过条数, 'failed': 失败条数}
+
+        blocking 为 False 时，其他进程正在回放则直接返回 None。
+        """
+        flush_lock = FileLock(self._flush_lock_path)
+        if not flush_lock.acquire(blocking=blocking):
+            return None
+        try:
+            counts = {'done': 0, 'skipped': 0, 'failed': 0}
+            for kind, token, entries in self._claim_batches():
+                try:
+                    counts['skipped'] += self._replay(kind, token, entries)
+                    counts['done'] += len(entries)
+                    self._finish(entries)
+                except Exception as e:
+                    counts['failed'] += len(entries)
+                    self._retry_later(entries, str(e))
+            self.last_flush_at = time.time()
+            self.flushed += counts['done']
+            if counts['done']:
+                self.purge(self.DONE_RETENTION)
+            return counts
+        finally:
+            flush_lock.release()
+
+    def _claim_batches(self):
+        """取出到期的条目并分批：已分配过 token 的按原批次重试，其余按类型合并为新批次并分配 token"""
+        now = time.time()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT * FROM entries WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id",
+                (now,)).fetchall()
+            batches = {}
+            fresh = {}
+            for row in rows:
+                if row['batch_token']:
+                    batches.setdefault(row['batch_token'], (row['kind'], []))[1].append(row)
+                else:
+                    fresh.setdefault(row['kind'], []).append(row)
+            for kind, kind_rows in fresh.items():
+                batch, size = [], 0
+                for row in kind_rows:
+                    records = self._record_count(kind, row)
+                    if batch and size + records > self.api.BATCH_RECORD_LIMIT:
+                        batches[self._assign(batch)] = (kind, batch)
+                        batch, size = [], 0
+                    batch.append(row)
+                    size += records
+                if batch:
+                    batches[self._assign(batch)] = (kind, batch)
+        # 先回放任务完成状态，再创建进度记录
+        ordered = sorted(batches.items(), key=lambda item: (item[1][0] != 'task_status', item[1][1][0]['id']))
+        return [(kind, token, entries) for token, (kind, entries) in ordered]
+
+    def _assign(self, rows):
+        """为新批次分配 client_token 并持久化（调用方持有锁并处于事务中）"""
+        token = str(uuid.uuid4())
+        self._conn.executemany('UPDATE entries SET batch_token = ? WHERE id = ?', [(token, row['id']) for row in rows])
+        return token
+
+    @staticmethod
+    def _record_count(kind, row):
+        return len(json.loads(row['payload'])['fields_list']) if kind == 'progress' else 1
+
+    def _replay(self, kind, token, entries):
+        """把一批条目写入飞书，失败时抛出异常，返回跳过的条目数"""
+        if kind == 'task_status':
+            today = self.business_date()
+            merged = {}
+            for row in entries:
+                if row['business_date'] != today:
+                    continue
+                payload = json.loads(row['payload'])
+                merged.setdefault(payload['record_id'], {}).update(payload['fields'])
+            skipped = sum(row['business_date'] != today for row in entries)
+            if merged:
+                result = self.api.batch_update_records(
+                    self.api.table_id, [{'record_id': record_id, 'fields': fields} for record_id, fields in merged.items()])
+                if result['errors']:
+                    raise Exception(f'{len(result["errors"])} 个任务更新失败: {result["errors"][0]["error"]}')
+            return skipped
+        if kind == 'progress':
+            fields_list = [fields for row in entries for fields in json.loads(row['payload'])['fields_list']]
+            result = self.api.batch_create_records(Config.PROGRESS_TABLE_ID, fields_list, client_token=token)
+            if result['errors']:
+                raise Exception(f'{len(result["errors"])} 条进度记录创建失败: {result["errors"][0]["error"]}')
+            return 0
+        raise Exception(f'未知的日志条目类型: {kind}')
+
+    def _finish(self, entries):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE entries SET status = 'done', done_at = ?, last_error = NULL WHERE id = ?",
+                                   [(time.time(), row['id']) for row in entries])
+
+    def _retry_later(self, entries, error):
+        attempts = entries[0]['attempts'] + 1
+        status = 'failed' if attempts >= self.max_attempts else 'pending'
+        next_attempt_at = time.time() + min(self.flush_interval * 2 ** attempts, self.RETRY_BACKOFF_MAX)
+        self.last_error = error
+        logger.warning('日志回放失败（第 %d 次）: %s', attempts, error)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE entries SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                [(status, attempts, next_attempt_at, error, row['id']) for row in entries])
+
+    def retry_failed(self):
+        """把失败的条目重新排队，保留原批次和 client_token，返回条目数"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE entries SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'")
+        self._wakeup.set()
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        """删除 older_than 秒之前已完成的条目"""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM entries WHERE status = 'done' AND done_at < ?",
+                                      (time.time() - older_than,)).rowcount
+
+    def status(self, failures=20):
+        """待回放、失败的条目数和最近的失败明细"""
+        now = time.time()
+        with self._lock:
+            counts = {row['status']: (row['count'], row['oldest']) for row in self._conn.execute(
+                'SELECT status, COUNT(*) AS count, MIN(created_at) AS oldest FROM entries GROUP BY status')}
+            failed = [dict(row) for row in self._conn.execute(
+                "SELECT id, kind, user_id, business_date, attempts, last_error, created_at FROM entries "
+                "WHERE status = 'failed' ORDER BY id DESC LIMIT ?", (failures,))]
+        pending = counts.get('pending', (0, None))
+        return {
+            'pending': pending[0],
+            'oldest_pending_age': round(now - pending[1], 3) if pending[1] else None,
+            'failed': counts.get('failed', (0, None))[0],
+            'done': counts.get('done', (0, None))[0],
+            'flushed': self.flushed,
+            'last_flush_age': round(now - self.last_flush_at, 3) if self.last_flush_at else None,
+            'last_error': self.last_error,
+            'failures': failed
+        }
+
+    # ---- 后台线程 ----
+
+    def start(self):
+        """启动后台回放线程"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='journal-flush', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._wakeup.wait(self.flush_interval):
+                # 稍等片刻，把同一时间段内的多次打卡合并为一批
+                self._stop.wait(self.batch_window)
+            self._wakeup.clear()
+            try:
+                counts = self.flush(blocking=False)
+                if counts and any(counts.values()):
+                    logger.info('日志回放完成: %s', counts)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning('日志回放失败: %s', e)
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    from daily_reset import DailyResetScheduler
+    from feishu_api import FeishuAPI
+
+    parser = argparse.ArgumentParser(description='打卡写入日志')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='查看待回放和失败的条目')
+    flush = subparsers.add_parser('flush', help='立即回放一次')
+    flush.add_argument('--retry-failed', action='store_true', help='先把失败的条目重新排队')
+    args = parser.parse_args()
+
+    setup_logging()
+    Config.validate_config()
+    api = FeishuAPI()
+    journal = WriteJournal.from_config(api, DailyResetScheduler.from_config(api).business_date)
+
+    if args.command == 'flush':
+        if args.retry_failed:
+            print(f'重新排队: {journal.retry_failed()} 条')
+        print(f'回放完成: {journal.flush()}')
+    print(json.dumps(journal.status(), ensure_ascii=False, indent=2))
+    if journal.status()['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""WSGI 入口
+
+生产环境使用多进程服务器加载本模块，例如:
+    gunicorn -c gunicorn.conf.py wsgi:app
+    uwsgi --ini uwsgi.ini
+"""
+from app import create_app
+
+app = create_app()